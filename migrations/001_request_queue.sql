@@ -0,0 +1,33 @@
+-- columns and trigger the csv service relies on, added once by hand rather than by the service at
+-- runtime (see "Database migrations" in the README). Safe to re-run. Apply in one transaction:
+--
+--   psql "$HNTTAX_DATABASE_URL" -1 -f migrations/001_request_queue.sql
+
+-- which worker has claimed a request, until when, and how many times it's been claimed (see db.request_queue)
+ALTER TABLE hnt_csv_requests
+    ADD COLUMN IF NOT EXISTS worker_id TEXT,
+    ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMPTZ,
+    ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ,
+    ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+
+ALTER TABLE hnt_schedc_requests
+    ADD COLUMN IF NOT EXISTS worker_id TEXT,
+    ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMPTZ,
+    ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ,
+    ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+
+-- estimate mode's result (see estimate_csv_request) - stays empty for exact requests
+ALTER TABLE hnt_csv_requests
+    ADD COLUMN IF NOT EXISTS estimate JSONB;
+
+-- notifies the daemon's listener of each new request (see db.request_queue.RequestListener)
+CREATE OR REPLACE FUNCTION notify_hnt_csv_requests_new() RETURNS trigger AS $fn$
+BEGIN
+    PERFORM pg_notify('hnt_csv_requests_new', CAST(NEW.id AS text));
+    RETURN NEW;
+END;
+$fn$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS hnt_csv_requests_new_notify ON hnt_csv_requests;
+CREATE TRIGGER hnt_csv_requests_new_notify AFTER INSERT ON hnt_csv_requests
+    FOR EACH ROW EXECUTE PROCEDURE notify_hnt_csv_requests_new();
@@ -3,6 +3,9 @@
 # generate new aws password token - needed for pushing to our aws acct
 aws ecr get-login-password --region us-east-2 | docker login --username AWS --password-stdin 529675500956.dkr.ecr.us-east-2.amazonaws.com
 
+# refresh oracle price index so the image ships with it prebuilt
+(cd src && python process.py -s oracle_index)
+
 # build image - adaptation on docker build cmd to specify linux amd64 build (override mac m1 build issues)
 docker buildx build --platform=linux/amd64 -t hnt-miner-tax .
 
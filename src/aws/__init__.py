@@ -1,7 +1,12 @@
 import boto3
-from io import StringIO
+from io import BytesIO
 from loguru import logger
+from helium import TIMESTAMP_FORMAT
 import os
+import tempfile
+import threading
+from processors.RewardWriter import RewardWriter, output_file_name, write_parquet
+from aws.multipart import S3TextStream
 
 # map location for each key (csv, schc) for where to save files in aws
 SAVE_MAP = {
@@ -10,8 +15,28 @@ SAVE_MAP = {
 }
 
 
-def save_df_to_s3(df, request_type='csv', file_year=2021, file_name='test.csv'):
-    "save a given df to s3. type can either be csv, or schc"
+# bucket name in s3
+S3_BUCKET = 'service-outputs'
+
+# point s3 calls at a stand-in (e.g. moto server or minio) instead of aws, for local testing
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+
+def get_s3_client():
+    "one s3 client for the process, shared by every upload thread (clients are thread safe, resources aren't)"
+
+    global _s3_client
+    with _s3_client_lock:
+        if _s3_client is None:
+            _s3_client = boto3.client('s3', endpoint_url=S3_ENDPOINT_URL)
+        return _s3_client
+
+
+def _s3_key(request_type, file_year, file_name):
+    "path in the s3 bucket a file of the given type is saved to"
 
     # build file path to save df to, given args
     saved_file = f"{SAVE_MAP[request_type]}/{file_year}/{file_name}"
@@ -20,15 +45,50 @@ def save_df_to_s3(df, request_type='csv', file_year=2021, file_name='test.csv'):
     if os.getenv("DEV_S3_FOLDER"):
         saved_file = f"dev/{saved_file}"
 
-    # bucket name in s3
-    bucket = 'service-outputs'
+    return saved_file
+
+
+def save_df_to_s3(df, request_type='csv', file_year=2021, file_name='test.csv', output_format='csv'):
+    "save a given df to s3, as csv (optionally gzipped) or parquet. type can either be csv, or schc"
 
-    logger.info(f"[AWS] Saving CSV to AWS, in s3 bucket: {bucket}, path: {saved_file}")
+    saved_file = _s3_key(request_type, file_year, output_file_name(file_name, output_format))
+    s3 = get_s3_client()
 
-    csv_buffer = StringIO()
-    df.to_csv(csv_buffer)
-    s3 = boto3.resource('s3')
-    s3.Object(bucket, saved_file).put(Body=csv_buffer.getvalue())
+    if output_format == 'parquet':
+        logger.info(f"[AWS] Saving Parquet to AWS, in s3 bucket: {S3_BUCKET}, path: {saved_file}")
+        parquet_buffer = BytesIO()
+        write_parquet(df, parquet_buffer)
+        s3.put_object(Bucket=S3_BUCKET, Key=saved_file, Body=parquet_buffer.getvalue())
+        return
+
+    logger.info(f"[AWS] Saving CSV to AWS, in s3 bucket: {S3_BUCKET}, path: {saved_file}")
+
+    # rows are uploaded in parts as to_csv writes them, rather than building the whole csv in memory first
+    with S3TextStream(s3, S3_BUCKET, saved_file, compress=output_format == 'csv.gz') as csv_stream:
+        df.to_csv(csv_stream, date_format=TIMESTAMP_FORMAT)
+
+
+def open_s3_csv_writer(request_type='csv', file_year=2021, file_name='test.csv', output_format='csv'):
+    "same as save_df_to_s3, but returns a RewardWriter that uploads rows as they're compiled (parquet goes to a temp file that's uploaded at the end)"
+
+    file_name = output_file_name(file_name, output_format)
+    saved_file = _s3_key(request_type, file_year, file_name)
+
+    if output_format != 'parquet':
+        logger.info(f"[AWS] Streaming {output_format} to AWS, in s3 bucket: {S3_BUCKET}, path: {saved_file}")
+        csv_stream = S3TextStream(get_s3_client(), S3_BUCKET, saved_file, compress=output_format == 'csv.gz')
+        return RewardWriter(saved_file, index=True, output_format=output_format, stream=csv_stream)
+
+    local_filename = os.path.join(tempfile.gettempdir(), os.path.basename(file_name))
+
+    def upload(file_path):
+        logger.info(f"[AWS] Saving {output_format} to AWS, in s3 bucket: {S3_BUCKET}, path: {saved_file}")
+        try:
+            get_s3_client().upload_file(file_path, S3_BUCKET, saved_file)
+        finally:
+            os.remove(file_path)
+
+    return RewardWriter(local_filename, index=True, on_complete=upload, output_format=output_format)
 
 
 def save_to_s3(local_filename, file_year=2021, aws_file_name='test.csv'):
@@ -46,6 +106,4 @@ def save_to_s3(local_filename, file_year=2021, aws_file_name='test.csv'):
 
     logger.info(f"[AWS] Saving Schedule C to AWS, in s3 bucket: {bucket}, path: {saved_file}")
 
-    s3 = boto3.resource('s3')
-
-    s3.Bucket(bucket).upload_file(local_filename, saved_file)
\ No newline at end of file
+    get_s3_client().upload_file(local_filename, bucket, saved_file)
\ No newline at end of file
@@ -0,0 +1,158 @@
+import gzip
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+
+
+# size of each multipart upload part (s3's minimum is 5 MB, except for the last part)
+S3_PART_SIZE_MB = max(5, int(os.getenv("S3_PART_SIZE_MB", 8)))
+
+# parts uploaded at once, while the next part is being written
+S3_UPLOAD_CONCURRENCY = int(os.getenv("S3_UPLOAD_CONCURRENCY", 2))
+
+
+class S3MultipartWriter(io.RawIOBase):
+    """
+    Binary file object that uploads what's written to it as an s3 multipart upload, one part
+    every part_size bytes, in background threads - only the part being filled and the parts in
+    flight are held in memory, however big the file gets.
+
+    close() uploads the last part and completes the upload (or, if the whole file fit in one
+    part, just puts it as a normal object). abort() throws away everything uploaded so far.
+    """
+
+    def __init__(self, client, bucket, key, part_size_mb=S3_PART_SIZE_MB, concurrency=S3_UPLOAD_CONCURRENCY, **put_args):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size_mb * 1024 * 1024
+        self.concurrency = concurrency
+
+        # extra args for the object, e.g. ContentType
+        self.put_args = put_args
+
+        self.num_bytes = 0
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []
+        self._executor = None
+        self._aborted = False
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        # anything still being flushed into an aborted upload is dropped
+        if self._aborted:
+            return len(data)
+
+        self._buffer += data
+        self.num_bytes += len(data)
+        if len(self._buffer) >= self.part_size:
+            self._upload_part()
+        return len(data)
+
+    def _upload_part(self):
+        if self._upload_id is None:
+            self._upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key, **self.put_args)['UploadId']
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+        # wait for the oldest part once enough are in flight, so memory stays bounded
+        in_flight = [future for _, future in self._parts if not future.done()]
+        if len(in_flight) >= self.concurrency:
+            in_flight[0].result()
+
+        part_number = len(self._parts) + 1
+        body = bytes(self._buffer)
+        self._buffer = bytearray()
+        future = self._executor.submit(
+            self.client.upload_part,
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id, PartNumber=part_number, Body=body
+        )
+        self._parts.append((part_number, future))
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._aborted:
+                return
+
+            if self._upload_id is None:
+                self.client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer), **self.put_args)
+                return
+
+            if self._buffer:
+                self._upload_part()
+            parts = [{"PartNumber": part_number, "ETag": future.result()['ETag']} for part_number, future in self._parts]
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self._upload_id, MultipartUpload={"Parts": parts}
+            )
+            logger.info(f"[AWS] uploaded {len(parts)} parts ({round(self.num_bytes / 1024 / 1024, 1)} MB) to s3, path: {self.key}")
+
+        except Exception:
+            self.abort()
+            raise
+
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+            super().close()
+
+    def abort(self):
+        """
+        Cancels the upload - nothing is left in s3
+        """
+        self._aborted = True
+        self._buffer = bytearray()
+        if self._upload_id is not None:
+            # parts still uploading would be stored again after the abort, so let them finish first
+            for _, future in self._parts:
+                future.cancel()
+            self._executor.shutdown(wait=True)
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            logger.warning(f"[AWS] aborted multipart upload to s3, path: {self.key}")
+            self._upload_id = None
+
+
+class S3TextStream:
+    """
+    Text file object for writing a csv straight to s3 (see S3MultipartWriter), gzip compressed
+    on the way if compress is set - e.g. as the target of df.to_csv, or a RewardWriter's stream.
+
+    close() finishes the upload, abort() cancels it.
+    """
+
+    def __init__(self, client, bucket, key, compress=False, **put_args):
+        self.key = key
+        self.upload = S3MultipartWriter(client, bucket, key, ContentType='application/gzip' if compress else 'text/csv', **put_args)
+        self._gzip = gzip.GzipFile(fileobj=self.upload, mode='wb') if compress else None
+        self._text = io.TextIOWrapper(self._gzip or self.upload, encoding='utf-8', newline='')
+
+    def write(self, text):
+        return self._text.write(text)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def close(self):
+        # flushes the text and gzip buffers (gzip doesn't close a file object it was given), then completes the upload
+        self._text.flush()
+        self._text.detach()
+        if self._gzip is not None:
+            self._gzip.close()
+        self.upload.close()
+
+    def abort(self):
+        self.upload.abort()
+        self._text.detach()
+        if self._gzip is not None:
+            self._gzip.close()
+        self.upload.close()
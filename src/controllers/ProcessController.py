@@ -1,17 +1,24 @@
+import multiprocessing
+import os
+import signal
+import tempfile
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from processors.CsvProcessor import CsvProcessor
-from processors.SchcProcessor import SchcProcessor
 from db.hntdb import hnt_db_engine as hnt_db
-from db.hntdb import hnt_metadata
+from db.hntdb import check_estimate_column, get_table
 from loguru import logger
 from helium.service import HeliumClient
-from sqlalchemy.dialects.postgresql import insert as pinsert
+from helium.oracle_index import update_oracle_index
+from helium.checkpoint import RequestCheckpoint, prune_checkpoints
+from db.request_queue import POLL_SECONDS, LeaseHeartbeat, RequestListener, check_claim_columns, check_notify_trigger, release_claims
+from db.status_writer import StatusWriter
 import pandas as pd
-from aws import save_df_to_s3
 from datetime import datetime
-from taxes.taxes import write_schc
-from taxes.utils import collect_flags
-from controllers import create_stripe_customer, save_csv
-from taxes import utils
+from functools import partial
+from controllers import save_csv, open_csv_writer
+from processors.RewardWriter import reward_totals
+from processors.OutputStage import OutputStage, save_outputs
 
 
 # key for determining service level for schc processing
@@ -22,132 +29,452 @@ SERVICE_KEY = {
 }
 
 
-def process_csv_requests(id_=None):
+def process_csv_requests(id_=None, hotspot_workers=1, incremental_sync=True, skip_idle=True, fetch_strategy="auto", time_windows=1, stream_output=False, output_format="csv", mode="exact", workers=1, checkpoint=True):
     """
     Processes all new csv requests in hnttax db (status="new")
     if id given, takes in db id to run the csv processor for
+    hotspot_workers sets how many hotspots' rewards are fetched concurrently
+    incremental_sync only fetches rewards newer than those already stored in the reward sync table
+    skip_idle checks each hotspot's reward total first, and skips paginating it if it had no rewards
+    fetch_strategy picks per-hotspot or wallet-level reward fetching ("auto" chooses by number of hotspots)
+    time_windows splits each hotspot's year into that many sub-windows, paginated concurrently
+    stream_output writes reward rows to csv as they're compiled, instead of building one df per wallet
+    checkpoint saves each request's progress to local disk, so a request that dies partway through resumes from there
+    output_format is "csv", "csv.gz" or "parquet"
+    mode "estimate" uses daily reward sums and prices instead of every reward transaction (see estimate_csv_request) -
+    only for a given id, so quotes never claim requests from the queue
+    workers processes that many forms at once, in separate processes
     """
+    if mode == "estimate" and not id_:
+        raise ValueError("estimate mode needs a request id - it only quotes single requests, and never claims from the queue")
 
-    processor = CsvProcessor()
-    client = HeliumClient()
+    processor = CsvProcessor(hotspot_workers=hotspot_workers, incremental_sync=incremental_sync, skip_idle=skip_idle, fetch_strategy=fetch_strategy)
 
-    csv_table = hnt_metadata.tables[processor.HNT_DB_TABLE_NAME]
+    csv_table = get_table(processor.HNT_DB_TABLE_NAME)
+    form_options = {"stream_output": stream_output, "output_format": output_format, "mode": mode, "checkpoint": checkpoint}
+    prune_checkpoints()
+    if mode == "estimate":
+        check_estimate_column(csv_table)
 
-    # loop over new form entries 1 by 1, and run the csv-creation code
-    for form in processor.get_forms(id_=id_):
-        
-        row_id = form['id']
-        wallet = form['wallet']
-        year = form['year']
+    # spread forms across worker processes, each with its own db connections and helium client
+    if workers > 1:
+        processor_options = {"hotspot_workers": hotspot_workers, "incremental_sync": incremental_sync, "skip_idle": skip_idle, "fetch_strategy": fetch_strategy}
+        process_forms_in_pool(processor, csv_table, id_, workers, processor_options, time_windows, form_options)
+        logger.info(f"[{processor.HNT_SERVICE_NAME}] DONE - completed processing all new CSV requests")
+        return
 
-        valid_wallet = client.validate_wallet(form['wallet'])
+    client = HeliumClient(time_windows=time_windows, pool_size=processor.hotspot_workers * time_windows)
 
-        # if the valid wallet returned from validation is different from db value, update db
-        if valid_wallet is not None and valid_wallet != wallet:
-            logger.info(f"[{processor.HNT_SERVICE_NAME}] updating helium wallet address in db - hotspot address provided")
-            update_wallet_values = {
-                "wallet": valid_wallet
-            }
-            update_wallet_stmt = csv_table.update().where(csv_table.c.id == row_id)
-            hnt_db.execute(update_wallet_stmt, update_wallet_values)
- 
-        # if we didn't get a valid wallet address, we log the error, write the message to the db, and continue on to next form
-        if valid_wallet is None:
-            logger.error(f"[{processor.HNT_SERVICE_NAME}] invalid helium wallet address for db id: {row_id}")
-            error_info = {
-                "msg": "wallet not found on Helium blockchain/no wallet data",
-                "stage": "wallet validation"
-            }
-            update_values = {
-                "status": "error",
-                "errors": error_info,
-                "processed_at": datetime.utcnow()
-            }
-            error_stmt = csv_table.update().where(csv_table.c.id == row_id)
-            hnt_db.execute(error_stmt, update_values)
-        
-        # otherwise, process the csv request
-        else:
-            logger.info(f"[{processor.HNT_SERVICE_NAME}] valid wallet found on Helium blockchain, processing request for tax year {year}, wallet: {valid_wallet}")
+    # loop over new form entries 1 by 1, and run the csv-creation code - output files are saved in the
+    # background while the next form is fetched, and db updates are buffered and written in batches
+    with StatusWriter(csv_table) as status_writer, OutputStage(status_writer) as output_stage:
+        try:
+            for form in processor.get_forms(id_=id_):
+                output_stage.submit(form['id'], *process_csv_form(processor, client, form, **form_options))
+
+        # write what's finished, then hand any request we've claimed but not finished back to the queue
+        except KeyboardInterrupt:
+            output_stage.wait()
+            status_writer.flush()
+            release_claims(csv_table, processor.worker_id)
+            raise
+
+    logger.info(f"[{processor.HNT_SERVICE_NAME}] oracle price cache stats: {client.price_cache.stats()}")
+    logger.info(f"[{processor.HNT_SERVICE_NAME}] page cache stats: {client.page_cache.stats()}")
+    logger.info(f"[{processor.HNT_SERVICE_NAME}] wallet cache stats: {client.wallet_cache.stats()}")
+    logger.info(f"[{processor.HNT_SERVICE_NAME}] DONE - completed processing all new CSV requests")
 
-            # get all hotspots associated with this wallet + hotspot rewards
-            hotspots = client.get_hotspots_for_wallet(valid_wallet)
-            num_hotspots = len(hotspots['data'])
-            logger.info(f"[{processor.HNT_SERVICE_NAME}] num hotspots associated with this address: {num_hotspots}")
-            
-            all_hotspot_rewards = processor.compile_hotspot_rewards(client, valid_wallet, hotspots, year)
-            
-            # get all validators associated with this wallet
-            validators = client.get_validators_for_wallet(valid_wallet)
-            num_validators = len(validators['data'])
-            logger.info(f"[{processor.HNT_SERVICE_NAME}] num validators associated with this address: {num_validators}")
 
-            all_validator_rewards = processor.compile_validator_rewards(client, valid_wallet, validators, year)
+def run_csv_daemon(hotspot_workers=1, incremental_sync=True, skip_idle=True, fetch_strategy="auto", time_windows=1, stream_output=False, output_format="csv", checkpoint=True, poll_seconds=POLL_SECONDS):
+    """
+    Keeps processing csv requests as they come in, in one long-running process, instead of
+    exiting once there are no new ones - the db engine, helium client, caches and http sessions
+    stay warm between requests (options are the same as process_csv_requests, but requests are
+    always processed exactly - estimates are only run for a given id)
+
+    Between passes it sleeps until the insert trigger on the request table sends a notification,
+    or poll_seconds pass (see db.request_queue.RequestListener). SIGTERM/SIGINT stop it once the
+    current request is finished
+    """
+    processor = CsvProcessor(hotspot_workers=hotspot_workers, incremental_sync=incremental_sync, skip_idle=skip_idle, fetch_strategy=fetch_strategy)
+    csv_table = get_table(processor.HNT_DB_TABLE_NAME)
+    form_options = {"stream_output": stream_output, "output_format": output_format, "checkpoint": checkpoint}
+    client = HeliumClient(time_windows=time_windows, pool_size=processor.hotspot_workers * time_windows)
 
-            # once all rewards are collected for a wallet, convert to dataframe and save to csv
-            total_usd = 0
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        logger.info(f"[{processor.HNT_SERVICE_NAME}] received signal {signum}, stopping after the current request")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    # fail now if the schema isn't migrated, rather than on every pass below
+    check_claim_columns(csv_table)
+    check_notify_trigger(csv_table)
+
+    # listen before the first pass, so requests submitted while it runs aren't missed
+    listener = RequestListener(csv_table, poll_seconds=poll_seconds).start()
+    logger.info(f"[{processor.HNT_SERVICE_NAME}] running as a daemon, worker: {processor.worker_id}")
+
+    with StatusWriter(csv_table) as status_writer, OutputStage(status_writer) as output_stage:
+        try:
+            while not stop.is_set():
+                prune_checkpoints()
+                forms = processor.get_forms(id_=None)
+                try:
+                    for form in forms:
+                        output_stage.submit(form['id'], *process_csv_form(processor, client, form, **form_options))
+                        if stop.is_set():
+                            break
+                    output_stage.wait()
+                    status_writer.flush()
+
+                # e.g. the db is unreachable, or a request failed (it stays claimed until its lease runs out,
+                # then it's retried, up to REQUEST_MAX_ATTEMPTS claims) - keep the daemon up either way
+                except Exception as e:
+                    logger.exception(f"[{processor.HNT_SERVICE_NAME}] error processing csv requests ({e})")
+
+                finally:
+                    forms.close()
+
+                if not stop.is_set():
+                    listener.wait(stop)
+
+        # write what's finished, then hand back anything claimed but not finished
+        finally:
+            listener.close()
+            output_stage.wait()
+            status_writer.flush()
+            release_claims(csv_table, processor.worker_id)
+
+    logger.info(f"[{processor.HNT_SERVICE_NAME}] oracle price cache stats: {client.price_cache.stats()}")
+    logger.info(f"[{processor.HNT_SERVICE_NAME}] page cache stats: {client.page_cache.stats()}")
+    logger.info(f"[{processor.HNT_SERVICE_NAME}] wallet cache stats: {client.wallet_cache.stats()}")
+    logger.info(f"[{processor.HNT_SERVICE_NAME}] daemon stopped")
+
+
+def process_csv_form(processor, client, form, stream_output=False, output_format="csv", mode="exact", checkpoint=True):
+    """
+    Runs the csv-creation code for one form, and returns the list of updates (dicts of column
+    values, in order) to make to its row in the hnttax db - the caller applies them, so this can
+    run in a worker process (see process_forms_in_pool), and batch them (see db.status_writer)
+
+    Also returns the saves (callables) that write the form's output files, which the caller runs
+    before applying the updates - e.g. in the background, while the next form is fetched (see
+    processors.OutputStage)
+    """
+    row_id = form['id']
+    wallet = form['wallet']
+    year = form['year']
+    processor.reset_stats()
+    updates = []
+    saves = []
+
+    # validates the wallet and gets its hotspots and validators (cached per address)
+    valid_wallet, hotspots, validators = client.get_wallet_metadata(form['wallet'])
+
+    # if the valid wallet returned from validation is different from db value, update db
+    if valid_wallet is not None and valid_wallet != wallet:
+        logger.info(f"[{processor.HNT_SERVICE_NAME}] updating helium wallet address in db - hotspot address provided")
+        update_wallet_values = {
+            "wallet": valid_wallet
+        }
+        updates.append(update_wallet_values)
+
+    # if we didn't get a valid wallet address, we log the error, write the message to the db, and continue on to next form
+    if valid_wallet is None:
+        logger.error(f"[{processor.HNT_SERVICE_NAME}] invalid helium wallet address for db id: {row_id}")
+        error_info = {
+            "msg": "wallet not found on Helium blockchain/no wallet data",
+            "stage": "wallet validation"
+        }
+        update_values = {
+            "status": "error",
+            "errors": error_info,
+            "processed_at": datetime.utcnow()
+        }
+
+        # estimates leave the request's status for its exact run to set
+        if mode == "estimate":
+            update_values = {"estimate": error_info}
+        updates.append(update_values)
+
+    # in estimate mode, answer from daily reward sums instead of paginating every transaction
+    elif mode == "estimate":
+        estimate_updates, estimate_saves = estimate_csv_request(processor, client, row_id, valid_wallet, year, hotspots, validators, output_format)
+        updates.extend(estimate_updates)
+        saves.extend(estimate_saves)
+
+    # otherwise, process the csv request
+    else:
+        logger.info(f"[{processor.HNT_SERVICE_NAME}] valid wallet found on Helium blockchain, processing request for tax year {year}, wallet: {valid_wallet}")
+
+        # hotspot rewards for all hotspots associated with this wallet
+        num_hotspots = len(hotspots['data'])
+        logger.info(f"[{processor.HNT_SERVICE_NAME}] num hotspots associated with this address: {num_hotspots}")
+
+        h_file_name = f"{row_id}_{year}_{valid_wallet[0:7]}_hotspots.csv"
+        v_file_name = f"{row_id}_{year}_{valid_wallet[0:7]}_validators.csv"
+
+        # progress from an earlier, unfinished run of this request (if any) is picked up from here
+        request_checkpoint = RequestCheckpoint(f"{processor.HNT_DB_TABLE_NAME}_{row_id}") if checkpoint else None
+
+        # in stream output mode, rows are written to csv as they're compiled and only the totals come back
+        if stream_output:
+            hotspot_totals = processor.compile_hotspot_rewards(client, valid_wallet, hotspots, year, writer=open_csv_writer(file_year=year, file_name=h_file_name, output_format=output_format), checkpoint=request_checkpoint)
+        else:
+            all_hotspot_rewards = processor.compile_hotspot_rewards(client, valid_wallet, hotspots, year, checkpoint=request_checkpoint)
+            hotspot_totals = None
             if all_hotspot_rewards is not None:
-            
                 logger.info(f"[{processor.HNT_SERVICE_NAME}] Compilation of all hotspot reward transactions for db id {row_id} from year {year} complete. Saving to csv in AWS.")
-                h_file_name = f"{row_id}_{year}_{valid_wallet[0:7]}_hotspots.csv"
-                save_csv(all_hotspot_rewards, file_year=year, file_name=h_file_name)
-                hotspot_usd = round(all_hotspot_rewards['usd'].sum(), 3)
-                total_usd += hotspot_usd
+                saves.append(partial(save_csv, all_hotspot_rewards, file_year=year, file_name=h_file_name, output_format=output_format))
+                hotspot_totals = reward_totals(all_hotspot_rewards)
+
+        # validator rewards for all validators associated with this wallet
+        num_validators = len(validators['data'])
+        logger.info(f"[{processor.HNT_SERVICE_NAME}] num validators associated with this address: {num_validators}")
 
-            # if we got validator rewards, write those to csv
+        if stream_output:
+            validator_totals = processor.compile_validator_rewards(client, valid_wallet, validators, year, writer=open_csv_writer(file_year=year, file_name=v_file_name, output_format=output_format), checkpoint=request_checkpoint)
+        else:
+            all_validator_rewards = processor.compile_validator_rewards(client, valid_wallet, validators, year, checkpoint=request_checkpoint)
+            validator_totals = None
             if all_validator_rewards is not None:
-            
                 logger.info(f"[{processor.HNT_SERVICE_NAME}] Compilation of all validator reward transactions for db id {row_id} from year {year} complete. Saving to csv in AWS.")
-                v_file_name = f"{row_id}_{year}_{valid_wallet[0:7]}_validators.csv"
-                save_csv(all_validator_rewards, file_year=year, file_name=v_file_name)
+                saves.append(partial(save_csv, all_validator_rewards, file_year=year, file_name=v_file_name, output_format=output_format))
+                validator_totals = reward_totals(all_validator_rewards)
+
+        # once all rewards are saved, add up the usd totals
+        total_usd = 0
+        if hotspot_totals is not None:
+            hotspot_usd = round(hotspot_totals['usd'], 3)
+            total_usd += hotspot_usd
+
+        if validator_totals is not None:
+            validator_usd = round(validator_totals['usd'], 3)
+            total_usd += validator_usd
+
+        if hotspot_totals is not None or validator_totals is not None:
+            # Once csv is compiled, we need the total in the USD column 
+            logger.info(f"[{processor.HNT_SERVICE_NAME}] Total usd income for year {year}: ${total_usd}") 
+
+            # update hnttax db for this request
+            update_success_values = {
+                "status": "processed",
+                "income": total_usd,
+                "processed_at": datetime.utcnow(),
+                "num_hotspots": num_hotspots,
+            }
+            updates.append(update_success_values)
 
-                validator_usd = round(all_validator_rewards['usd'].sum(), 3)
-                total_usd += validator_usd
-                
-            if all_hotspot_rewards is not None or all_validator_rewards is not None:
-                # Once csv is compiled, we need the total in the USD column 
-                logger.info(f"[{processor.HNT_SERVICE_NAME}] Total usd income for year {year}: ${total_usd}") 
+        else:
+            msg = "No reward transactions found"
+            logger.warning(f"[{processor.HNT_SERVICE_NAME}] {msg} for wallet {valid_wallet} for year {year}")
+            update_empty = {
+                "status": "empty",
+                "errors": {
+                    "msg": msg,
+                    "stage": "reward collection for wallet - empty csv"
+                },
+                "processed_at": datetime.utcnow(),
+                "num_hotspots": num_hotspots,
+            }
+            updates.append(update_empty)
 
-                # update hnttax db for this request
-                update_success_values = {
-                    "status": "processed",
-                    "income": total_usd,
-                    "processed_at": datetime.utcnow(),
-                    "num_hotspots": num_hotspots,
-                }
-                update_success_stmt = csv_table.update().where(csv_table.c.id == row_id)
-                hnt_db.execute(update_success_stmt, update_success_values)
-            
-            else:
-                msg = "No reward transactions found"
-                logger.warning(f"[{processor.HNT_SERVICE_NAME}] {msg} for wallet {valid_wallet} for year {year}")
-                update_empty = {
-                    "status": "empty",
-                    "errors": {
-                        "msg": msg,
-                        "stage": "reward collection for wallet - empty csv"
-                    },
-                    "processed_at": datetime.utcnow(),
-                    "num_hotspots": num_hotspots,
-                }
-                update_empty_stmt = csv_table.update().where(csv_table.c.id == row_id)
-                hnt_db.execute(update_empty_stmt, update_empty)
+        # once everything's saved, there's nothing left to resume
+        if request_checkpoint is not None:
+            saves.append(request_checkpoint.clear)
+
+    if processor.stats:
+        logger.info(f"[{processor.HNT_SERVICE_NAME}] request stats for db id {row_id}: {dict(processor.stats)}")
+
+    return updates, saves
+
+
+# state of a worker process started by process_forms_in_pool (see _init_form_worker)
+_form_worker = {}
+
+
+def _init_form_worker(processor_options, time_windows):
+    """
+    Runs once in each worker process - sets up the processor and helium client it uses for every form
+    """
+    # ctrl-c goes to the whole process group, but shutting down is left to the parent process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    processor = CsvProcessor(**processor_options)
+    _form_worker["processor"] = processor
+    _form_worker["client"] = HeliumClient(time_windows=time_windows, pool_size=processor.hotspot_workers * time_windows)
+    logger.info(f"[{processor.HNT_SERVICE_NAME}] worker process {os.getpid()} ready")
+
+
+def _process_form_in_worker(form, form_options):
+    # outputs are saved by the worker, and only the db updates are sent back
+    updates, saves = process_csv_form(_form_worker["processor"], _form_worker["client"], form, **form_options)
+    return form['id'], save_outputs(form['id'], updates, saves)
 
-    logger.info(f"[{processor.HNT_SERVICE_NAME}] DONE - completed processing all new CSV requests")
 
+def process_forms_in_pool(processor, table, id_, workers, processor_options, time_windows, form_options):
+    """
+    Runs process_csv_form for the forms from processor.get_forms across a pool of worker processes,
+    each with its own helium client (and caches, and http sessions) and db connections
 
-def process_schc_requests(id_=None):
+    Forms are only claimed as workers free up, so there are never more than `workers` in flight.
+    Workers send their db updates back here, to be written in batches by this process. On ctrl-c, forms that
+    haven't started are handed back to the queue, and the ones in progress are finished first
+    """
+    # without a shared state file, every worker would get the full helium request budget to itself -
+    # use a temp one for this run if none is set
+    rate_limit_file = None
+    if not os.getenv("HELIUM_RATE_LIMIT_FILE"):
+        fd, rate_limit_file = tempfile.mkstemp(prefix="helium_rate_limit_", suffix=".json")
+        os.close(fd)
+        os.environ["HELIUM_RATE_LIMIT_FILE"] = rate_limit_file
+
+    # the workers are forked from this process, so they mustn't inherit any pooled db connections -
+    # drop them, and start every worker before this process touches the db again
+    hnt_db.dispose()
+
+    logger.info(f"[{processor.HNT_SERVICE_NAME}] processing forms with {workers} worker processes")
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=_init_form_worker,
+        initargs=(processor_options, time_windows)
+    )
+    wait([executor.submit(os.getpid) for _ in range(workers)])
+
+    def finish(futures):
+        for future in futures:
+            try:
+                row_id, updates = future.result()
+            except Exception as e:
+                # left in "processing" - it'll be picked up again once its lease expires after this run
+                logger.exception(f"[{processor.HNT_SERVICE_NAME}] worker failed to process a form ({e})")
+                continue
+            status_writer.add(row_id, updates)
+
+    # claims are made under this process's worker id, so keep renewing them until the last
+    # form in flight is done, not just until the last one is claimed
+    heartbeat = LeaseHeartbeat(table, processor.worker_id).start()
+    forms = processor.get_forms(id_=id_)
+    pending = set()
+    with StatusWriter(table) as status_writer:
+        try:
+            while True:
+                if len(pending) >= workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    finish(done)
+
+                form = next(forms, None)
+                if form is None:
+                    break
+                pending.add(executor.submit(_process_form_in_worker, form, form_options))
+
+            finish(wait(pending)[0])
+
+        except KeyboardInterrupt:
+            logger.warning(f"[{processor.HNT_SERVICE_NAME}] interrupted - finishing forms already in progress, then releasing the rest")
+            for future in pending:
+                future.cancel()
+            finish([future for future in wait(pending)[0] if not future.cancelled()])
+            status_writer.flush()
+            release_claims(table, processor.worker_id)
+            raise
+
+        finally:
+            forms.close()
+            heartbeat.stop()
+            executor.shutdown(wait=True)
+
+            if rate_limit_file:
+                del os.environ["HELIUM_RATE_LIMIT_FILE"]
+                os.remove(rate_limit_file)
+
+
+def estimate_csv_request(processor, client, row_id, wallet, year, hotspots, validators, output_format='csv'):
+    """
+    Estimates a csv request from per-day reward sums for each hotspot/validator, converted at each
+    day's average oracle price. Much faster than paginating every reward for big wallets, at the
+    cost of per-block precision - the error bound (from each day's min/max price) is logged and
+    saved to the request's estimate column (see db.hntdb.check_estimate_column)
+
+    Only the estimate column is updated - the request's status and income are left alone, so it
+    still gets its exact output when it's processed normally
+
+    Returns the db updates for the request's row, and the saves that write its output file, like
+    process_csv_form
+    """
+    logger.info(f"[{processor.HNT_SERVICE_NAME}] valid wallet found on Helium blockchain, estimating request for tax year {year}, wallet: {wallet}")
+
+    num_hotspots = len(hotspots['data'])
+    logger.info(f"[{processor.HNT_SERVICE_NAME}] num hotspots associated with this address: {num_hotspots}")
+
+    logger.info(f"[{processor.HNT_SERVICE_NAME}] num validators associated with this address: {len(validators['data'])}")
+
+    daily_rewards = [
+        processor.estimate_hotspot_rewards(client, wallet, hotspots, year),
+        processor.estimate_validator_rewards(client, wallet, validators, year)
+    ]
+    daily_rewards = [df for df in daily_rewards if df is not None]
+
+    if not daily_rewards:
+        msg = "No reward transactions found"
+        logger.warning(f"[{processor.HNT_SERVICE_NAME}] {msg} for wallet {wallet} for year {year}")
+        update_empty = {
+            "estimate": {
+                "method": "daily reward sums",
+                "usd": 0.0,
+                "msg": msg,
+                "estimated_at": datetime.utcnow().isoformat()
+            }
+        }
+        return [update_empty], []
+
+    all_daily_rewards = pd.concat(daily_rewards, ignore_index=True)
+    file_name = f"{row_id}_{year}_{wallet[0:7]}_estimate.csv"
+    saves = [partial(save_csv, all_daily_rewards, file_year=year, file_name=file_name, output_format=output_format)]
+
+    total_usd = round(all_daily_rewards['usd'].sum(), 3)
+    usd_min = round(all_daily_rewards['usd_min'].sum(), 3)
+    usd_max = round(all_daily_rewards['usd_max'].sum(), 3)
+    error_bound = round(max(total_usd - usd_min, usd_max - total_usd), 3)
+    logger.info(f"[{processor.HNT_SERVICE_NAME}] Estimated usd income for year {year}: ${total_usd} (+/- ${error_bound}, range ${usd_min} - ${usd_max})")
+
+    update_estimate = {
+        "estimate": {
+            "method": "daily reward sums",
+            "usd": total_usd,
+            "error_bound": error_bound,
+            "usd_min": usd_min,
+            "usd_max": usd_max,
+            "file_name": file_name,
+            "estimated_at": datetime.utcnow().isoformat()
+        }
+    }
+    return [update_estimate], saves
+
+
+def process_schc_requests(id_=None, hotspot_workers=1, incremental_sync=True, skip_idle=True, fetch_strategy="auto", time_windows=1, stream_output=False, output_format="csv"):
     """
     Processes all new csv requests in hnttax db (status="new")
     if id given, takes in db id to run the csv processor for
 
     Phased out - we no longer provide this service but keeping here for now
     """
+    # schedule c only - imported here so the csv service doesn't pay for boto3, stripe and the pdf libraries
+    from processors.SchcProcessor import SchcProcessor
+    from aws import save_df_to_s3, open_s3_csv_writer
+    from taxes.taxes import write_schc
+    from taxes.utils import collect_flags
+    from controllers import create_stripe_customer
 
-    processor = SchcProcessor()
-    client = HeliumClient()
+    processor = SchcProcessor(hotspot_workers=hotspot_workers, incremental_sync=incremental_sync, skip_idle=skip_idle, fetch_strategy=fetch_strategy)
+    client = HeliumClient(time_windows=time_windows, pool_size=processor.hotspot_workers * time_windows)
 
-    schc_table = hnt_metadata.tables[processor.HNT_DB_TABLE_NAME]
+    schc_table = get_table(processor.HNT_DB_TABLE_NAME)
 
     # loop over new form entries 1 by 1, and run the schc-creation code
     for form in processor.get_forms(id_=id_):
@@ -156,9 +483,10 @@ def process_schc_requests(id_=None):
         wallet = form['wallet']
         year = form['year']
         tax_data = form['tax_data']
+        processor.reset_stats()
 
         ## STEP 1 - WALLET VALIDATION
-        valid_wallet = client.validate_wallet(form['wallet'])
+        valid_wallet, hotspots, validators = client.get_wallet_metadata(form['wallet'])
 
         # if the valid wallet returned from validation is different from db value, update db
         if valid_wallet is not None and valid_wallet != wallet:
@@ -199,8 +527,7 @@ def process_schc_requests(id_=None):
 
             logger.info(f"[{processor.HNT_SERVICE_NAME}] valid wallet found on Helium blockchain, processing request for tax year {year}, wallet: {valid_wallet}")
 
-            ## STEP 2 - get all hotspots associated with this wallet
-            hotspots = client.get_hotspots_for_wallet(valid_wallet)
+            ## STEP 2 - hotspots associated with this wallet (fetched during validation)
             num_hotspots = len(hotspots['data'])
             logger.info(f"[{processor.HNT_SERVICE_NAME}] num hotspots associated with this address: {num_hotspots}")
 
@@ -220,41 +547,47 @@ def process_schc_requests(id_=None):
             elif num_hotspots > 1 and not is_single_state:
                 service_level = SERVICE_KEY["single_state_mult_miners"]
             
-            all_hotspot_rewards = processor.compile_hotspot_rewards(client, valid_wallet, hotspots, year)
+            file_name = f"{row_id}/{row_id}_{year}_{valid_wallet[0:7]}_hotspots.csv"
+            v_file_name = f"{row_id}/{row_id}_{year}_{valid_wallet[0:7]}_validators.csv"
 
-            # STEP 4 - get all validators associated with this wallet
-            validators = client.get_validators_for_wallet(valid_wallet)
+            # in stream output mode, rows are written out as they're compiled and only the totals come back
+            if stream_output:
+                hotspot_totals = processor.compile_hotspot_rewards(client, valid_wallet, hotspots, year, writer=open_s3_csv_writer(request_type='schc', file_year=year, file_name=file_name, output_format=output_format))
+            else:
+                all_hotspot_rewards = processor.compile_hotspot_rewards(client, valid_wallet, hotspots, year)
+                hotspot_totals = None
+                if all_hotspot_rewards is not None:
+                    logger.info(f"[{processor.HNT_SERVICE_NAME}] Compilation of all hotspot reward transactions for db id {row_id} from year {year} complete. Saving to csv in AWS.")
+                    save_df_to_s3(all_hotspot_rewards, request_type='schc', file_year=year, file_name=file_name, output_format=output_format)
+                    hotspot_totals = reward_totals(all_hotspot_rewards)
+                    del all_hotspot_rewards
+
+            # STEP 4 - validators associated with this wallet (fetched during validation)
             num_validators = len(validators['data'])
             logger.info(f"[{processor.HNT_SERVICE_NAME}] num validators associated with this address: {num_validators}")
 
-            all_validator_rewards = processor.compile_validator_rewards(client, valid_wallet, validators, year)
+            if stream_output:
+                validator_totals = processor.compile_validator_rewards(client, valid_wallet, validators, year, writer=open_s3_csv_writer(request_type='csv', file_year=year, file_name=v_file_name, output_format=output_format))
+            else:
+                all_validator_rewards = processor.compile_validator_rewards(client, valid_wallet, validators, year)
+                validator_totals = None
+                if all_validator_rewards is not None:
+                    logger.info(f"[{processor.HNT_SERVICE_NAME}] Compilation of all validator reward transactions for db id {row_id} from year {year} complete. Saving to csv in AWS.")
+                    save_df_to_s3(all_validator_rewards, request_type='csv', file_year=year, file_name=v_file_name, output_format=output_format)
+                    validator_totals = reward_totals(all_validator_rewards)
+                    del all_validator_rewards
 
             total_usd = 0
-            # once all rewards are collected for a wallet, convert to dataframe and save to csv
-            if all_hotspot_rewards is not None:  
-            
-                logger.info(f"[{processor.HNT_SERVICE_NAME}] Compilation of all hotspot reward transactions for db id {row_id} from year {year} complete. Saving to csv in AWS.")
-                file_name = f"{row_id}/{row_id}_{year}_{valid_wallet[0:7]}_hotspots.csv"
-                save_df_to_s3(all_hotspot_rewards, request_type='schc', file_year=year, file_name=file_name)
-
-                # Once csv is compiled, we need the total in the USD column 
-                hotspot_usd = round(all_hotspot_rewards['usd'].sum(), 3)
+            # once all rewards are saved, we need the total in the USD column
+            if hotspot_totals is not None:
+                hotspot_usd = round(hotspot_totals['usd'], 3)
                 total_usd += hotspot_usd
 
-                # update hnttax db values for this request
-                num_hotspots = num_hotspots
-            
-            # if we got validator rewards, write those to csv
-            if all_validator_rewards is not None:
-            
-                logger.info(f"[{processor.HNT_SERVICE_NAME}] Compilation of all validator reward transactions for db id {row_id} from year {year} complete. Saving to csv in AWS.")
-                v_file_name = f"{row_id}/{row_id}_{year}_{valid_wallet[0:7]}_validators.csv"
-                save_df_to_s3(all_validator_rewards, request_type='csv', file_year=year, file_name=v_file_name)
-
-                validator_usd = round(all_validator_rewards['usd'].sum(), 3)
+            if validator_totals is not None:
+                validator_usd = round(validator_totals['usd'], 3)
                 total_usd += validator_usd
 
-            if all_hotspot_rewards is not None or all_validator_rewards is not None:
+            if hotspot_totals is not None or validator_totals is not None:
                 logger.info(f"[{processor.HNT_SERVICE_NAME}] Total usd income for year {year}: ${total_usd}") 
 
                 # update hnttax db values for this request
@@ -295,6 +628,9 @@ def process_schc_requests(id_=None):
             update_stmt = schc_table.update().where(schc_table.c.id == row_id)
             hnt_db.execute(update_stmt, update_vals)
 
+        if processor.stats:
+            logger.info(f"[{processor.HNT_SERVICE_NAME}] request stats for db id {row_id}: {dict(processor.stats)}")
+
         # add customer to stripe account
         try:
             create_stripe_customer(name=form['name'], email=form['email'], db_id=row_id, service_level=service_level)
@@ -302,15 +638,20 @@ def process_schc_requests(id_=None):
         except Exception as e:
             logger.error(f"[{processor.HNT_SERVICE_NAME}] Could not add customer to stripe: ({e})")
 
+    logger.info(f"[{processor.HNT_SERVICE_NAME}] oracle price cache stats: {client.price_cache.stats()}")
+    logger.info(f"[{processor.HNT_SERVICE_NAME}] page cache stats: {client.page_cache.stats()}")
+    logger.info(f"[{processor.HNT_SERVICE_NAME}] wallet cache stats: {client.wallet_cache.stats()}")
     logger.info(f"[{processor.HNT_SERVICE_NAME}] DONE - completed processing all new schedule c requests")
 
 
 def process_test(id_):
+    from processors.SchcProcessor import SchcProcessor
+    from taxes.taxes import write_schc
 
     processor = SchcProcessor()
     client = HeliumClient()
 
-    schc_table = hnt_metadata.tables[processor.HNT_DB_TABLE_NAME]
+    schc_table = get_table(processor.HNT_DB_TABLE_NAME)
 
     # loop over new form entries 1 by 1, and run the schc-creation code
     for form in processor.get_forms(id_=id_):
@@ -318,8 +659,13 @@ def process_test(id_):
         tax_data = form['tax_data']
         income = int(form['income'])
         write_schc(income, tax_data, dbid=row_id)
-        
-    
-
 
 
+def build_oracle_index():
+    """
+    Builds the local oracle price index used for block -> price lookups, or appends
+    any newer price changes to it if it already exists
+    """
+    client = HeliumClient()
+    num_new = update_oracle_index(client)
+    logger.info(f"[oracle_index] DONE - added {num_new} oracle prices, index now covers blocks {client.price_index.first_block} - {client.price_index.last_block}")
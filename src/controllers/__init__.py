@@ -1,13 +1,15 @@
 from logging import LogRecord
 from sqlalchemy.sql.schema import MetaData
-import stripe
 import os
 from loguru import logger
+from helium import TIMESTAMP_FORMAT
 from pathlib import Path
+from processors.RewardWriter import RewardWriter, output_file_name, write_parquet
 
 
 
 def create_stripe_customer(name, email, db_id, service_level):
+    import stripe
 
     # load and set stripe API key
     STRIPE_API_KEY = os.getenv("STRIPE_API_KEY")
@@ -31,25 +33,42 @@ def create_stripe_customer(name, email, db_id, service_level):
             }
         )
 
-def save_csv(df, request_type='csv', file_year=2021, file_name='temp.csv'):
-    "save a given df to csv temp file. type can either be csv, or schc"
+def _csv_file_path(file_name):
+    "local path a csv with the given name is saved to"
 
     # get root directory
     root_dir = os.getenv("TEMP_FILE_LOCATION")
 
+    # if we're running in dev, prefix the file folder to save zip file to a dev folder
+    if os.getenv("DEV"):
+        return f"{root_dir}dev/{file_name}"
+    return f"{root_dir}{file_name}"
+
+def save_csv(df, request_type='csv', file_year=2021, file_name='temp.csv', output_format='csv'):
+    "save a given df to csv (or parquet) temp file. type can either be csv, or schc"
+
+    file_name = output_file_name(file_name, output_format)
+
     # get file stem (NOTE: was using this when trying to zip file)
     file_stem = Path(file_name).stem
 
-    # if we're running in dev, prefix the file folder to save zip file to a dev folder
-    if os.getenv("DEV"):
-        file_path = f"{root_dir}dev/{file_name}"
-    else:
-        file_path = f"{root_dir}{file_name}"
+    file_path = _csv_file_path(file_name)
 
     # compress the file - NOTE: was using this when trying to zip file
     compression_opts = dict(method='zip', archive_name=file_name)  
 
+    if output_format == 'parquet':
+        logger.info(f"Saving Parquet to temp dir locally, path: {file_path}")
+        write_parquet(df, file_path)
+        return
+
     logger.info(f"Saving CSV to temp dir locally, path: {file_path}")
-    df.to_csv(file_path, index=False) 
+    df.to_csv(file_path, index=False, date_format=TIMESTAMP_FORMAT)
+
 
+def open_csv_writer(request_type='csv', file_year=2021, file_name='temp.csv', output_format='csv'):
+    "same as save_csv, but returns a RewardWriter that streams rows to the file as they're compiled"
 
+    file_path = _csv_file_path(output_file_name(file_name, output_format))
+    logger.info(f"Streaming {output_format} to temp dir locally, path: {file_path}")
+    return RewardWriter(file_path, output_format=output_format)
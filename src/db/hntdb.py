@@ -1,7 +1,7 @@
-import pymysql
 from dotenv import load_dotenv
 import os
-from sqlalchemy import create_engine, MetaData, select
+import threading
+from sqlalchemy import create_engine, MetaData, Table, select
 import logging
 
 
@@ -14,16 +14,48 @@ HNT_DB_NAME = os.getenv("HNTTAX_DATABASE_NAME")
 HNT_DB_PORT = os.getenv("HNTTAX_DATABASE_PORT")
 
 
-hnt_db_engine = create_engine(f'postgresql://{HNT_DB_UN}:{HNT_DB_PW}@{HNT_DB_HOST}:{HNT_DB_PORT}/hnttax')
+# executemany UPDATEs (see db.status_writer) are sent in pages with psycopg2's execute_batch, not one round trip per row
+hnt_db_engine = create_engine(f'postgresql://{HNT_DB_UN}:{HNT_DB_PW}@{HNT_DB_HOST}:{HNT_DB_PORT}/hnttax', executemany_mode='values_plus_batch')
 
-# load metadata, to load table objects from hnt tax db
+# table objects from hnt tax db - only the tables a service uses are reflected, on first use (see get_table)
 hnt_metadata = MetaData(bind=hnt_db_engine)
-hnt_metadata.reflect()
+_reflect_lock = threading.Lock()
+
+
+def get_table(name):
+    """
+    Returns the Table object for a hnttax db table, reflecting just that table the first time
+    it's asked for (later calls return the same object from hnt_metadata)
+    """
+    with _reflect_lock:
+        if name not in hnt_metadata.tables:
+            Table(name, hnt_metadata, autoload_with=hnt_db_engine)
+        return hnt_metadata.tables[name]
+
+
+# schema changes the services rely on are shipped as sql files in migrations/ and applied by hand - never at runtime
+MIGRATION = "migrations/001_request_queue.sql"
+
+
+def check_columns(table, columns):
+    """
+    Raises a RuntimeError naming the migration to run if any of columns is missing from a table
+    """
+    missing = [name for name in columns if name not in table.c]
+    if missing:
+        raise RuntimeError(f"{table.name} is missing columns {missing} - apply {MIGRATION} to the hnttax db first (see README)")
+
+
+def check_estimate_column(table):
+    """
+    Checks a request table has the estimate column, where estimate mode stores what it estimated
+    """
+    check_columns(table, ['estimate'])
 
 
 def get_new_csv_requests():
 
-    csv_table = hnt_metadata.tables['hnt_csv_requests']
+    csv_table = get_table('hnt_csv_requests')
     stmt = select([csv_table.c.id, csv_table.c.wallet, csv_table.c.year]).where(csv_table.c.status == 'new')
 
     # try to get new csv requests from db table
@@ -0,0 +1,276 @@
+import os
+import select as io_select
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from loguru import logger
+from sqlalchemy import and_, func, or_, select, text
+from db.hntdb import MIGRATION, check_columns, hnt_db_engine
+
+
+# how long a claimed request stays reserved for its worker - leases are renewed while the worker
+# is alive (see LeaseHeartbeat), so this only matters once a worker has crashed
+LEASE_SECONDS = int(os.getenv("REQUEST_LEASE_SECONDS", 600))
+
+# a request is given up on (set to "error") once it's been claimed this many times without finishing -
+# e.g. it crashes its worker every time, or keeps failing - rather than being retried forever
+MAX_ATTEMPTS = int(os.getenv("REQUEST_MAX_ATTEMPTS", 3))
+
+# when listening for new requests, also check the table this often in case a notification was missed
+POLL_SECONDS = float(os.getenv("REQUEST_POLL_SECONDS", 60))
+
+# columns on the request tables that track which worker has claimed a request, until when, and how
+# many times it's been claimed - added by the migration in db.hntdb.MIGRATION
+CLAIM_COLUMNS = ["worker_id", "claimed_at", "lease_expires_at", "attempts"]
+
+_checked_tables = set()
+
+
+def get_worker_id():
+    """
+    Identifies this process in claimed requests - WORKER_ID if set, otherwise host:pid
+    """
+    return os.getenv("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+
+def check_claim_columns(table):
+    """
+    Raises a RuntimeError if a request table is missing the claim columns (checked once per table)
+    """
+    if table.name in _checked_tables:
+        return
+
+    check_columns(table, CLAIM_COLUMNS)
+    _checked_tables.add(table.name)
+
+
+def fail_exhausted_requests(table, max_attempts=MAX_ATTEMPTS):
+    """
+    Sets requests whose lease has run out after max_attempts claims to "error", instead of letting
+    them be claimed again, returns how many
+    """
+    check_claim_columns(table)
+    stmt = (
+        table.update()
+        .where(
+            (table.c.status == 'processing') &
+            (table.c.lease_expires_at < func.now()) &
+            (table.c.attempts >= max_attempts)
+        )
+        .values(
+            status='error',
+            errors={
+                "msg": f"gave up after {max_attempts} attempts to process this request",
+                "stage": "claiming request"
+            },
+            processed_at=datetime.utcnow(),
+            worker_id=None,
+            lease_expires_at=None
+        )
+        .returning(table.c.id)
+    )
+    failed = [row.id for row in hnt_db_engine.execute(stmt)]
+    if failed:
+        logger.error(f"[request queue] gave up on requests claimed {max_attempts} times without finishing: {failed}")
+    return len(failed)
+
+
+def claim_requests(table, worker_id, limit=1, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+    """
+    Atomically claims up to limit requests, in id order, and returns their rows - either new
+    requests, or ones still "processing" whose lease has run out because their worker died
+
+    Claimed rows are set to "processing" with this worker's id and a lease, and their attempts
+    are counted - requests that have already used up max_attempts are set to "error" instead of
+    being claimed again (see fail_exhausted_requests). The rows are picked with FOR UPDATE SKIP
+    LOCKED, so workers claiming at the same time never get the same row and never wait on each other
+    """
+    fail_exhausted_requests(table, max_attempts)
+
+    claimable = (
+        select([table.c.id])
+        .where(or_(
+            table.c.status == 'new',
+            and_(table.c.status == 'processing', table.c.lease_expires_at < func.now())
+        ))
+        .order_by(table.c.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    stmt = (
+        table.update()
+        .where(table.c.id.in_(claimable.scalar_subquery()))
+        .values(
+            status='processing',
+            worker_id=worker_id,
+            claimed_at=func.now(),
+            lease_expires_at=func.now() + timedelta(seconds=lease_seconds),
+            attempts=table.c.attempts + 1
+        )
+        .returning(*table.c)
+    )
+    rows = hnt_db_engine.execute(stmt).fetchall()
+    return sorted(rows, key=lambda row: row.id)
+
+
+def renew_leases(table, worker_id, lease_seconds=LEASE_SECONDS):
+    """
+    Extends the lease on every request this worker still has in "processing", returns how many
+    """
+    check_claim_columns(table)
+    stmt = (
+        table.update()
+        .where((table.c.worker_id == worker_id) & (table.c.status == 'processing'))
+        .values(lease_expires_at=func.now() + timedelta(seconds=lease_seconds))
+    )
+    return hnt_db_engine.execute(stmt).rowcount
+
+
+def release_claims(table, worker_id):
+    """
+    Puts every request this worker still has in "processing" back to "new", e.g. when shutting
+    down before finishing them, so other workers don't have to wait for the lease to expire.
+    Being handed back this way doesn't count as one of the request's attempts
+    """
+    check_claim_columns(table)
+    stmt = (
+        table.update()
+        .where((table.c.worker_id == worker_id) & (table.c.status == 'processing'))
+        .values(status='new', worker_id=None, claimed_at=None, lease_expires_at=None, attempts=func.greatest(table.c.attempts - 1, 0))
+    )
+    released = hnt_db_engine.execute(stmt).rowcount
+    if released:
+        logger.info(f"[request queue] released {released} unfinished requests claimed by worker {worker_id}")
+    return released
+
+
+class LeaseHeartbeat:
+    """
+    Background thread that keeps renewing this worker's leases while it's working through its
+    claimed requests, so long-running requests aren't picked up by another worker
+    """
+
+    def __init__(self, table, worker_id, lease_seconds=LEASE_SECONDS):
+        self.table = table
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                renew_leases(self.table, self.worker_id, self.lease_seconds)
+            except Exception as e:
+                logger.error(f"[request queue] could not renew leases for worker {self.worker_id} ({e})")
+
+
+
+def new_request_channel(table):
+    """
+    Name of the channel the insert trigger on a request table notifies (see check_notify_trigger)
+    """
+    return f"{table.name}_new"
+
+
+def check_notify_trigger(table):
+    """
+    Raises a RuntimeError if a request table is missing the insert trigger that sends a NOTIFY
+    with each new row's id, which a RequestListener waits on - it's added by the migration in
+    db.hntdb.MIGRATION
+    """
+    trigger = f"{new_request_channel(table)}_notify"
+    stmt = text("SELECT 1 FROM pg_trigger WHERE tgname = :trigger AND tgrelid = CAST(:table AS regclass)")
+    if hnt_db_engine.execute(stmt, trigger=trigger, table=table.name).first() is None:
+        raise RuntimeError(f"{table.name} is missing the {trigger} trigger - apply {MIGRATION} to the hnttax db first (see README)")
+
+
+class RequestListener:
+    """
+    LISTENs for new requests on a request table's notify channel, on a dedicated autocommit
+    connection, so a long-running worker can sleep until a request is submitted instead of
+    polling the table. If the connection drops it's re-opened on the next wait, and the wait
+    still returns after poll_seconds regardless, so a missed notification only delays a request.
+
+        listener = RequestListener(table)
+        while True:
+            process_new_requests()
+            listener.wait()
+    """
+
+    def __init__(self, table, poll_seconds=POLL_SECONDS):
+        self.channel = new_request_channel(table)
+        self.poll_seconds = poll_seconds
+        self._conn = None
+
+    def _connect(self):
+        # detached from the pool, so the autocommit connection is never handed out for anything else
+        fairy = hnt_db_engine.raw_connection()
+        fairy.detach()
+        conn = fairy.connection
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.channel}")
+        self._conn = conn
+        logger.info(f"[request queue] listening for new requests on channel {self.channel}")
+
+    def start(self):
+        """
+        Starts listening - call before the first check for new requests, so none submitted in between are missed
+        """
+        try:
+            self._connect()
+        except Exception as e:
+            logger.error(f"[request queue] could not listen on channel {self.channel}, polling instead ({e})")
+        return self
+
+    def wait(self, stop=None):
+        """
+        Blocks until a new request is notified, poll_seconds pass, or the stop event is set.
+        Returns True if woken by a notification
+        """
+        if self._conn is None:
+            self.start()
+
+        remaining = self.poll_seconds
+        while remaining > 0 and not (stop is not None and stop.is_set()):
+            # wait in short slices, so setting stop (e.g. from a signal handler) is noticed quickly
+            timeout = min(remaining, 1)
+            remaining -= timeout
+
+            if self._conn is None:
+                time.sleep(timeout)
+                continue
+
+            try:
+                if io_select.select([self._conn], [], [], timeout) == ([], [], []):
+                    continue
+                self._conn.poll()
+            except Exception as e:
+                logger.error(f"[request queue] lost connection listening on channel {self.channel}, reconnecting ({e})")
+                self.close()
+                continue
+
+            if self._conn.notifies:
+                ids = [notify.payload for notify in self._conn.notifies]
+                self._conn.notifies.clear()
+                logger.info(f"[request queue] notified of new requests: {ids}")
+                return True
+
+        return False
+
+    def close(self):
+        if self._conn:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
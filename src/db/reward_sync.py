@@ -0,0 +1,147 @@
+import threading
+from datetime import datetime
+import pandas as pd
+from loguru import logger
+from sqlalchemy import Table, Column, ForeignKey, Integer, BigInteger, Text, DateTime, UniqueConstraint, select
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import insert as pinsert
+from db.hntdb import hnt_db_engine, hnt_metadata
+from helium import TIMESTAMP_FORMAT
+
+
+# columns of converted reward rows we keep for each hotspot/validator-year
+SYNC_COLUMNS = ["timestamp", "block", "hnt", "oracle_price", "usd"]
+
+# per hotspot (or validator) and year: the newest reward we've already fetched (the high-water mark)
+reward_sync_table = Table(
+    'hnt_reward_sync', hnt_metadata,
+    Column('id', Integer, primary_key=True),
+    Column('entity_type', Text, nullable=False),
+    Column('address', Text, nullable=False),
+    Column('year', Integer, nullable=False),
+    Column('last_block', BigInteger, nullable=False),
+    Column('last_timestamp', DateTime(timezone=True), nullable=False),
+    Column('num_rows', Integer, nullable=False),
+    Column('updated_at', DateTime, nullable=False),
+    UniqueConstraint('entity_type', 'address', 'year'),
+    extend_existing=True
+)
+
+# the converted reward rows up to the high-water mark, one chunk per sync that found new rewards -
+# each sync only inserts its own rows, instead of rewriting everything stored so far
+reward_sync_rows_table = Table(
+    'hnt_reward_sync_rows', hnt_metadata,
+    Column('id', BigInteger, primary_key=True),
+    Column('sync_id', Integer, ForeignKey('hnt_reward_sync.id', ondelete='CASCADE'), nullable=False, index=True),
+    Column('rows', JSONB, nullable=False),
+    Column('created_at', DateTime, nullable=False),
+    extend_existing=True
+)
+
+_table_checked = False
+_table_lock = threading.Lock()
+
+
+def _ensure_table():
+    global _table_checked
+    # hotspot worker threads all get here on their first sync
+    with _table_lock:
+        if not _table_checked:
+            reward_sync_table.create(hnt_db_engine, checkfirst=True)
+            reward_sync_rows_table.create(hnt_db_engine, checkfirst=True)
+            _table_checked = True
+
+
+def get_sync_state(entity_type, address, year):
+    """
+    Returns the sync state for a hotspot/validator-year as a dict with the high-water mark
+    (last_block, last_timestamp) and a df of the rewards already converted, or None
+    """
+    _ensure_table()
+    stmt = select([reward_sync_table]).where(
+        (reward_sync_table.c.entity_type == entity_type) &
+        (reward_sync_table.c.address == address) &
+        (reward_sync_table.c.year == int(year))
+    )
+    row = hnt_db_engine.execute(stmt).fetchone()
+    if row is None:
+        return None
+
+    # every chunk is newest first, and later chunks are newer, so the newest chunk goes first
+    chunks_stmt = select([reward_sync_rows_table.c.rows]).where(reward_sync_rows_table.c.sync_id == row.id).order_by(reward_sync_rows_table.c.id.desc())
+    chunks = [pd.DataFrame(chunk.rows, columns=SYNC_COLUMNS) for chunk in hnt_db_engine.execute(chunks_stmt)]
+    df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=SYNC_COLUMNS)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+
+    return {
+        "last_block": row.last_block,
+        "last_timestamp": row.last_timestamp,
+        "rewards": df
+    }
+
+
+def save_sync_state(entity_type, address, year, df, replace=False):
+    """
+    Adds a df of newly converted rewards for a hotspot/validator-year to its sync state, and moves
+    the high-water mark up to them. With replace, whatever was stored before is dropped first (e.g.
+    after a full sync re-fetched everything)
+
+    The sync state's row is locked while it's updated, and rewards at or below the stored
+    high-water mark are dropped, so workers syncing the same hotspot-year at once never store
+    the same reward twice
+    """
+    _ensure_table()
+    rows = df[SYNC_COLUMNS].copy()
+    rows['timestamp'] = rows['timestamp'].dt.strftime(TIMESTAMP_FORMAT)
+    now = datetime.utcnow()
+
+    key = (
+        (reward_sync_table.c.entity_type == entity_type) &
+        (reward_sync_table.c.address == address) &
+        (reward_sync_table.c.year == int(year))
+    )
+
+    with hnt_db_engine.begin() as conn:
+        # the first sync of an entity-year creates its row - anyone else waits for it here, then locks it below
+        created = conn.execute(
+            pinsert(reward_sync_table).values(
+                entity_type=entity_type,
+                address=address,
+                year=int(year),
+                last_block=int(df['block'].max()),
+                last_timestamp=df['timestamp'].max().to_pydatetime(),
+                num_rows=len(rows),
+                updated_at=now
+            ).on_conflict_do_nothing().returning(reward_sync_table.c.id)
+        ).scalar()
+
+        if created is not None:
+            sync_id = created
+        else:
+            state = conn.execute(select([reward_sync_table]).where(key).with_for_update()).fetchone()
+            sync_id = state.id
+
+            if replace:
+                conn.execute(reward_sync_rows_table.delete().where(reward_sync_rows_table.c.sync_id == sync_id))
+                num_rows = len(rows)
+            else:
+                # another worker may have synced some (or all) of these since we read the sync state
+                new_rows = (df['block'] > state.last_block).to_numpy()
+                df, rows = df[new_rows], rows[new_rows]
+                if rows.empty:
+                    logger.debug(f"[reward sync] rewards for {entity_type} {address} ({year}) already synced up to block {state.last_block}")
+                    return
+                num_rows = state.num_rows + len(rows)
+
+            conn.execute(
+                reward_sync_table.update().where(reward_sync_table.c.id == sync_id).values(
+                    last_block=int(df['block'].max()),
+                    last_timestamp=df['timestamp'].max().to_pydatetime(),
+                    num_rows=num_rows,
+                    updated_at=now
+                )
+            )
+
+        conn.execute(reward_sync_rows_table.insert().values(sync_id=sync_id, rows=rows.to_dict(orient='list'), created_at=now))
+
+    logger.debug(f"[reward sync] saved {len(rows)} rewards for {entity_type} {address} ({year}), up to block {int(df['block'].max())}")
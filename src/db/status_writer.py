@@ -0,0 +1,110 @@
+import os
+import threading
+from loguru import logger
+from sqlalchemy import bindparam
+from db.hntdb import hnt_db_engine
+
+
+# buffered status updates are written once this many rows are waiting, or this many seconds after the last write
+STATUS_BATCH_ROWS = int(os.getenv("STATUS_BATCH_ROWS", 50))
+STATUS_BATCH_SECONDS = float(os.getenv("STATUS_BATCH_SECONDS", 5))
+
+
+class StatusWriter:
+    """
+    Buffers the updates made to request rows (wallet corrections, status, income, errors...) and
+    writes them in one transaction per batch, instead of one autocommitted UPDATE each.
+
+    A row's updates are merged into one set of column values. Rows updating the same columns are
+    sent together as one executemany, which the engine batches into a few round trips (see
+    executemany_mode in db.hntdb). Batches are written once max_rows are waiting, and by a
+    background thread every max_seconds, and whatever is left is written when the writer closes.
+
+        with StatusWriter(table) as status_writer:
+            for form in forms:
+                status_writer.add(form['id'], process(form))
+    """
+
+    def __init__(self, table, max_rows=STATUS_BATCH_ROWS, max_seconds=STATUS_BATCH_SECONDS):
+        self.table = table
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.num_flushed = 0
+
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add(self, row_id, updates):
+        """
+        Queues a list of updates (dicts of column values, applied in order) for one row
+        """
+        with self._lock:
+            values = self._pending.setdefault(row_id, {})
+            for update in updates:
+                values.update(update)
+            full = len(self._pending) >= self.max_rows
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes every queued update in one transaction, returns how many rows were updated
+        """
+        with self._lock:
+            if not self._pending:
+                return 0
+
+            pending, self._pending = self._pending, {}
+            try:
+                self._write(pending)
+            except Exception:
+                # keep them for the next flush - anything queued since is newer, so it wins
+                for row_id, values in pending.items():
+                    self._pending[row_id] = {**values, **self._pending.get(row_id, {})}
+                raise
+
+        self.num_flushed += len(pending)
+        logger.debug(f"[status writer] wrote updates for {len(pending)} rows of {self.table.name}")
+        return len(pending)
+
+    def _write(self, pending):
+        # one executemany per distinct set of columns being updated
+        batches = {}
+        for row_id, values in pending.items():
+            if values:
+                batches.setdefault(tuple(sorted(values)), []).append({"_row_id": row_id, **values})
+
+        with hnt_db_engine.begin() as conn:
+            for columns, params in batches.items():
+                stmt = (
+                    self.table.update()
+                    .where(self.table.c.id == bindparam("_row_id"))
+                    .values({column: bindparam(column, type_=self.table.c[column].type) for column in columns})
+                )
+                conn.execute(stmt, params)
+
+    def _run(self):
+        while not self._stop.wait(self.max_seconds):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"[status writer] could not write updates to {self.table.name}, will retry ({e})")
+
+    def close(self):
+        """
+        Stops the background thread and writes anything still queued
+        """
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.flush()
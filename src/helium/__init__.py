@@ -0,0 +1,2 @@
+# format Helium uses for reward timestamps - used to write them back out unchanged
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
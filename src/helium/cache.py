@@ -0,0 +1,101 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from loguru import logger
+
+
+class OraclePriceCache:
+    """
+    Persistent cache mapping a block to its resolved oracle price (in bones).
+
+    Entries live in a local sqlite file so they are shared by every process on the
+    machine, with a bounded in-memory LRU in front of it. Rewards are only ever paid
+    out on finalized blocks, whose oracle price can't change, so entries never expire.
+    """
+
+    service_name = 'ORACLE CACHE'
+
+    def __init__(self, path=None, max_memory_entries=None):
+        self.path = path or os.getenv("ORACLE_CACHE_PATH", "oracle_prices.sqlite")
+        self.max_memory_entries = int(max_memory_entries or os.getenv("ORACLE_CACHE_MEMORY_ENTRIES", 100000))
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        # counters exposed through stats()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        conn = self._connection()
+        conn.execute("CREATE TABLE IF NOT EXISTS oracle_prices (block INTEGER PRIMARY KEY, price INTEGER NOT NULL)")
+        conn.commit()
+        logger.info(f"[{self.service_name}] using oracle price cache at: {self.path}")
+
+    def _connection(self):
+        """
+        sqlite connections can't be shared between threads, so each thread gets its own
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            # WAL lets several processes read while one of them writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, block, price):
+        with self._lock:
+            self._memory[block] = price
+            self._memory.move_to_end(block)
+            if len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, block):
+        """
+        Returns the cached oracle price (in bones) for a block, or None if we haven't seen it
+        """
+        with self._lock:
+            price = self._memory.get(block)
+            if price is not None:
+                self._memory.move_to_end(block)
+                self.memory_hits += 1
+                return price
+
+        row = self._connection().execute("SELECT price FROM oracle_prices WHERE block = ?", (block,)).fetchone()
+        if row is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.disk_hits += 1
+        self._remember(block, row[0])
+        return row[0]
+
+    def set(self, block, price):
+        """
+        Stores the resolved oracle price (in bones) for a block
+        """
+        self._remember(block, price)
+        conn = self._connection()
+        conn.execute("INSERT OR IGNORE INTO oracle_prices (block, price) VALUES (?, ?)", (block, price))
+        conn.commit()
+
+    def stats(self):
+        """
+        Returns hit/miss counters for this cache, used for logging
+        """
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "hits": hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 3) if lookups else None,
+                "memory_entries": len(self._memory)
+            }
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import pandas as pd
+from loguru import logger
+
+
+# where request checkpoints are kept, and how long one is kept around if its request never finishes
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", "request_checkpoints")
+CHECKPOINT_MAX_AGE_DAYS = float(os.getenv("CHECKPOINT_MAX_AGE_DAYS", 7))
+
+
+def _write_atomic(path, write):
+    tmp_path = f"{path}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+class RequestCheckpoint:
+    """
+    On-disk progress of fetching one request's rewards, so a run that dies partway through
+    (retries exhausted, OOM, container restart) picks up where it left off instead of starting over.
+
+    Two levels are kept:
+    - per reward stream (one cursor chain, e.g. a hotspot's year or one of its time windows): every
+      page's raw rewards, spooled to a json lines file, and the cursor of the next page to fetch
+    - per hotspot/validator: its converted rewards df, once all of its pages are in
+
+    Checkpoints live in CHECKPOINT_DIR/<key>, and are removed with clear() once the request is done.
+    """
+
+    service_name = 'CHECKPOINT'
+
+    def __init__(self, key, root=None):
+        self.path = os.path.join(root or CHECKPOINT_DIR, key)
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, kind, name, suffix):
+        key = hashlib.sha256(name.encode()).hexdigest()[:32]
+        return os.path.join(self.path, f"{kind}_{key}{suffix}")
+
+    def load_stream(self, url):
+        """
+        Returns (rewards spooled so far, number of pages they came from, cursor to continue from,
+        whether the stream is complete) for the stream starting at url, or None if there's no
+        progress saved for it
+        """
+        try:
+            with open(self._file("stream", url, ".state")) as state_file:
+                state = json.load(state_file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        # only the pages the state file counts - anything after them was written by a run that died
+        # before updating the state, so it's cut off (that page is fetched again)
+        rewards = []
+        with open(self._file("stream", url, ".jsonl"), 'r+') as spool_file:
+            for _ in range(state['pages']):
+                rewards.extend(json.loads(spool_file.readline()))
+            spool_file.truncate(spool_file.tell())
+
+        logger.info(f"[{self.service_name}] resuming from {state['pages']} saved pages ({len(rewards)} rewards), url: {url}")
+        return rewards, state['pages'], state['cursor'], state['done']
+
+    def save_page(self, url, rewards, cursor, pages):
+        """
+        Appends one page of the stream starting at url to its spool, then records the cursor of
+        the next page (None once the stream is complete) and how many pages are spooled
+        """
+        with open(self._file("stream", url, ".jsonl"), 'a') as spool_file:
+            spool_file.write(json.dumps(rewards) + "\n")
+
+        state = {"pages": pages, "cursor": cursor, "done": cursor is None}
+
+        def write(tmp_path):
+            with open(tmp_path, 'w') as state_file:
+                json.dump(state, state_file)
+
+        _write_atomic(self._file("stream", url, ".state"), write)
+
+    def load_entity(self, entity_type, address):
+        """
+        Returns (True, converted rewards df or None if it had none) for a hotspot/validator that was
+        already finished, or (False, None)
+        """
+        path = self._file(entity_type, address, ".pkl")
+        if os.path.exists(path):
+            return True, pd.read_pickle(path)
+        if os.path.exists(self._file(entity_type, address, ".empty")):
+            return True, None
+        return False, None
+
+    def save_entity(self, entity_type, address, df):
+        """
+        Records a hotspot/validator as finished, with its converted rewards (or None)
+        """
+        if df is None:
+            open(self._file(entity_type, address, ".empty"), 'w').close()
+            return
+        _write_atomic(self._file(entity_type, address, ".pkl"), df.to_pickle)
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def prune_checkpoints(root=None, max_age_days=CHECKPOINT_MAX_AGE_DAYS):
+    """
+    Removes checkpoints that haven't been touched in max_age_days (their request never finished,
+    or was finished by another worker), returns how many
+    """
+    root = root or CHECKPOINT_DIR
+    if not os.path.isdir(root):
+        return 0
+
+    cutoff = time.time() - max_age_days * 24 * 60 * 60
+    num_pruned = 0
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        # saving progress moves files into place, which bumps the directory's mtime
+        if os.path.isdir(path) and os.path.getmtime(path) < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+            num_pruned += 1
+
+    if num_pruned:
+        logger.info(f"[{RequestCheckpoint.service_name}] removed {num_pruned} checkpoints older than {max_age_days} days")
+    return num_pruned
@@ -0,0 +1,127 @@
+import os
+import numpy as np
+from loguru import logger
+
+
+# each index entry is the block where an oracle price took effect, and that price (in bones)
+INDEX_DTYPE = np.dtype([('block', '<i8'), ('price', '<i8')])
+
+
+class OraclePriceIndex:
+    """
+    Compact on-disk index of the full oracle price history, read through a numpy memmap
+
+    The file is a flat array of (block, price) int64 pairs sorted by block, so the
+    price at any block is a binary search away and new price changes are just
+    appended to the end of the file.
+    """
+
+    service_name = 'ORACLE INDEX'
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv("ORACLE_INDEX_PATH", "oracle_prices.idx")
+        self._index = None
+        self._blocks = None
+        self.load()
+
+    def load(self):
+        """
+        (Re)maps the index file, if there is one
+        """
+        self._index = None
+        self._blocks = None
+
+        if not os.path.exists(self.path):
+            logger.warning(f"[{self.service_name}] no oracle price index found at {self.path}, prices will be fetched from Helium")
+            return
+
+        # ignore any partially written trailing entry
+        num_entries = os.path.getsize(self.path) // INDEX_DTYPE.itemsize
+        if num_entries == 0:
+            return
+
+        self._index = np.memmap(self.path, dtype=INDEX_DTYPE, mode='r', shape=(num_entries,))
+        self._blocks = self._index['block']
+        logger.info(f"[{self.service_name}] loaded {num_entries} oracle prices, blocks {self.first_block} - {self.last_block}")
+
+    def __len__(self):
+        return 0 if self._index is None else len(self._index)
+
+    @property
+    def first_block(self):
+        return None if self._index is None else int(self._blocks[0])
+
+    @property
+    def last_block(self):
+        return None if self._index is None else int(self._blocks[-1])
+
+    def price_at(self, block):
+        """
+        Returns the oracle price (in bones) in effect at or before the given block, or None
+        if the block isn't covered by the index (we can't know about price changes after the
+        last indexed block until the index is refreshed)
+        """
+        if self._index is None or block < self.first_block or block > self.last_block:
+            return None
+
+        position = np.searchsorted(self._blocks, block, side='right') - 1
+        return int(self._index['price'][position])
+
+    def prices_at(self, blocks):
+        """
+        Vectorized price_at - takes in an array of blocks and returns an int64 array of the
+        oracle price (in bones) at each, with -1 for any block the index doesn't cover
+        """
+        blocks = np.asarray(blocks, dtype=np.int64)
+        prices = np.full(blocks.shape, -1, dtype=np.int64)
+        if self._index is None:
+            return prices
+
+        covered = (blocks >= self.first_block) & (blocks <= self.last_block)
+        positions = np.searchsorted(self._blocks, blocks[covered], side='right') - 1
+        prices[covered] = self._index['price'][positions]
+        return prices
+
+    def append(self, entries):
+        """
+        Appends (block, price) entries newer than the last indexed block to the index file
+        """
+        last_block = self.last_block
+        if last_block is not None:
+            entries = [entry for entry in entries if entry[0] > last_block]
+
+        if not entries:
+            logger.info(f"[{self.service_name}] oracle price index already up to date")
+            return 0
+
+        new_entries = np.array(sorted(entries), dtype=INDEX_DTYPE)
+        with open(self.path, 'ab') as index_file:
+            index_file.write(new_entries.tobytes())
+
+        logger.info(f"[{self.service_name}] appended {len(new_entries)} oracle prices to {self.path}")
+        self.load()
+        return len(new_entries)
+
+
+def update_oracle_index(client, index=None):
+    """
+    Downloads oracle prices from Helium and writes them to the index. If the index already
+    exists, only the price changes newer than its last block are fetched and appended.
+    """
+    if index is None:
+        index = client.price_index
+    last_block = index.last_block
+
+    if last_block is None:
+        logger.info(f"[{index.service_name}] building oracle price index from full Helium price history")
+    else:
+        logger.info(f"[{index.service_name}] refreshing oracle price index with prices after block {last_block}")
+
+    # prices come back newest first, so we can stop as soon as we reach what's already indexed
+    new_entries = []
+    for price in client.get_oracle_prices():
+        if last_block is not None and price['block'] <= last_block:
+            break
+        new_entries.append((price['block'], price['price']))
+
+    return index.append(new_entries)
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit, parse_qsl, urlencode, urlunsplit
+from loguru import logger
+
+
+# a time range only counts as closed this long after its max_time, since blocks can be indexed
+# by the api a while after they were produced
+CLOSED_LAG_HOURS = float(os.getenv("HELIUM_PAGE_CACHE_LAG_HOURS", 24))
+
+
+class PageCache:
+    """
+    On-disk cache of Helium API response pages, keyed by a hash of the normalized url
+
+    Only pages for closed time ranges are cached (their max_time passed at least CLOSED_LAG_HOURS ago), since
+    rewards for those can't change. The cache is capped in size, evicting the least
+    recently used pages first.
+    """
+
+    service_name = 'PAGE CACHE'
+
+    def __init__(self, cache_dir=None, max_mb=None):
+        self.cache_dir = cache_dir or os.getenv("HELIUM_PAGE_CACHE_DIR", "helium_page_cache")
+        self.max_bytes = int(float(max_mb or os.getenv("HELIUM_PAGE_CACHE_MAX_MB", 1024)) * 1024 * 1024)
+
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+
+        self.hits = 0
+        self.misses = 0
+        logger.info(f"[{self.service_name}] using page cache at {self.cache_dir} ({round(self._size / 1024 / 1024, 1)} MB)")
+
+    @staticmethod
+    def normalize_url(url):
+        """
+        Lowercases scheme/host and sorts query params, so equivalent urls share a cache entry
+        """
+        parts = urlsplit(url)
+        query = urlencode(sorted(parse_qsl(parts.query)))
+        return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/'), query, ''))
+
+    @staticmethod
+    def is_cacheable(url, now=None):
+        """
+        Only pages for a time range that closed at least CLOSED_LAG_HOURS ago are immutable
+        """
+        max_time = dict(parse_qsl(urlsplit(url).query)).get('max_time')
+        if not max_time:
+            return False
+
+        try:
+            # a date or a full timestamp (e.g. a time window's bound) - either way in utc
+            closes_at = datetime.fromisoformat(max_time.replace('Z', '+00:00'))
+        except ValueError:
+            return False
+        if closes_at.tzinfo is None:
+            closes_at = closes_at.replace(tzinfo=timezone.utc)
+
+        now = now or datetime.now(timezone.utc)
+        return closes_at + timedelta(hours=CLOSED_LAG_HOURS) <= now
+
+    def _path(self, url):
+        key = hashlib.sha256(self.normalize_url(url).encode()).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def get(self, url):
+        """
+        Returns the cached response body for a url, or None
+        """
+        path = self._path(url)
+        try:
+            with open(path) as page_file:
+                page = json.load(page_file)
+        except (FileNotFoundError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # bump mtime so eviction treats this page as recently used
+        os.utime(path)
+        with self._lock:
+            self.hits += 1
+        return page
+
+    def set(self, url, page):
+        """
+        Stores a response body for a url, evicting old pages if we're over the size cap
+        """
+        path = self._path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # write to a temp file and move it into place, so readers never see a partial page
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as page_file:
+            json.dump(page, page_file)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._size += size
+            over_cap = self._size > self.max_bytes
+
+        if over_cap:
+            self._evict()
+
+    def _evict(self):
+        """
+        Removes least recently used pages until the cache is back under 90% of its cap
+        """
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[2])
+            self._size = sum(size for _, size, _ in entries)
+            target = self.max_bytes * 0.9
+
+            num_evicted = 0
+            for path, size, _ in entries:
+                if self._size <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                self._size -= size
+                num_evicted += 1
+
+        logger.info(f"[{self.service_name}] evicted {num_evicted} pages, cache now {round(self._size / 1024 / 1024, 1)} MB")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size_mb": round(self._size / 1024 / 1024, 1)
+            }
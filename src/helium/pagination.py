@@ -0,0 +1,79 @@
+import queue
+import threading
+
+
+# markers passed from the fetching thread to the consumer
+_DONE = object()
+
+
+class _FetchError:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def with_cursor(url, cursor):
+    """
+    Adds a cursor query param to a Helium API url
+    """
+    separator = '&' if '?' in url else '?'
+    return f"{url}{separator}cursor={cursor}"
+
+
+def paginate(fetch_page, url, read_ahead=1, cursor=None):
+    """
+    Yields each page (response body) of a cursor-paginated Helium endpoint, starting from url
+    (or from the page at cursor, e.g. when resuming)
+
+    With read_ahead > 0, pages are fetched in a background thread that requests page N+1 as soon
+    as page N's cursor is known, keeping up to read_ahead pages buffered - so network latency
+    overlaps with whatever the caller does with each page, instead of adding to it.
+    """
+    if read_ahead < 1:
+        next_url = with_cursor(url, cursor) if cursor else url
+        while next_url is not None:
+            page = fetch_page(next_url)
+            yield page
+            next_url = with_cursor(url, page['cursor']) if page.get('cursor') else None
+        return
+
+    pages = queue.Queue(maxsize=read_ahead)
+    stop = threading.Event()
+
+    def put(item):
+        # give up if the consumer has stopped iterating, rather than blocking on a full queue forever
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fetch_pages():
+        next_url = with_cursor(url, cursor) if cursor else url
+        try:
+            while next_url is not None and not stop.is_set():
+                page = fetch_page(next_url)
+                next_url = with_cursor(url, page['cursor']) if page.get('cursor') else None
+                if not put(page):
+                    return
+        except Exception as e:
+            put(_FetchError(e))
+            return
+        put(_DONE)
+
+    fetcher = threading.Thread(target=fetch_pages, daemon=True)
+    fetcher.start()
+
+    try:
+        while True:
+            item = pages.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _FetchError):
+                raise item.exc
+            yield item
+
+    finally:
+        # lets the fetching thread exit once any request it's in the middle of returns
+        stop.set()
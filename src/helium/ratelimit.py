@@ -0,0 +1,160 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from loguru import logger
+
+
+class RateLimiter:
+    """
+    Token bucket that paces requests to the Helium API, adapting its rate AIMD-style:
+    every 429 halves the rate (and pauses for Retry-After, if given), and each successful
+    request grows it back additively towards the target rate.
+
+    One limiter is shared by every thread in the process (see get_rate_limiter).
+    """
+
+    service_name = 'RATE LIMITER'
+
+    def __init__(self, rate, min_rate=None, increase=None, decrease=0.5):
+        self.max_rate = float(rate)
+        self.min_rate = float(min_rate or self.max_rate / 20)
+
+        # rate gained per second of successful requests, and the factor applied on a 429
+        self.increase = float(increase or self.max_rate / 10)
+        self.decrease = decrease
+
+        self._lock = threading.Lock()
+        self._memory_state = self._initial_state()
+
+    def _initial_state(self):
+        return {
+            "rate": self.max_rate,
+            "tokens": self.max_rate,
+            "last": time.time(),
+            "blocked_until": 0
+        }
+
+    @contextmanager
+    def _state(self):
+        """
+        Yields the mutable limiter state, locked for the duration of the block
+        """
+        with self._lock:
+            yield self._memory_state
+
+    def reserve(self):
+        """
+        Takes one token from the bucket and returns how many seconds the caller has to wait
+        before sending its request
+        """
+        with self._state() as state:
+            now = time.time()
+            rate = state["rate"]
+
+            # refill tokens for the time passed since the last request, allowing at most 1s of burst
+            state["tokens"] = min(rate, state["tokens"] + (now - state["last"]) * rate)
+            state["last"] = now
+            state["tokens"] -= 1
+
+            wait = max(0, state["blocked_until"] - now)
+            if state["tokens"] < 0:
+                wait += -state["tokens"] / rate
+
+            return wait
+
+    def acquire(self):
+        time.sleep(self.reserve())
+
+    def on_success(self):
+        with self._state() as state:
+            if state["rate"] < self.max_rate:
+                state["rate"] = min(self.max_rate, state["rate"] + self.increase / state["rate"])
+
+    def on_throttle(self, retry_after=None):
+        """
+        Called when Helium responds with a 429 - cuts the rate and honours Retry-After
+        """
+        with self._state() as state:
+            state["rate"] = max(self.min_rate, state["rate"] * self.decrease)
+            state["tokens"] = min(state["tokens"], 0)
+
+            if retry_after:
+                state["blocked_until"] = max(state["blocked_until"], time.time() + retry_after)
+
+            logger.warning(f"[{self.service_name}] throttled by Helium, rate now {round(state['rate'], 2)} req/s, retry after: {retry_after}")
+
+    @property
+    def rate(self):
+        with self._state() as state:
+            return state["rate"]
+
+
+class FileRateLimiter(RateLimiter):
+    """
+    RateLimiter whose state lives in a small local file, locked with flock, so that every
+    process on the machine shares one budget
+    """
+
+    def __init__(self, path, rate, **kwargs):
+        self.path = path
+        super().__init__(rate, **kwargs)
+
+    @contextmanager
+    def _state(self):
+        with self._lock, open(self.path, 'a+') as state_file:
+            fcntl.flock(state_file, fcntl.LOCK_EX)
+            try:
+                state_file.seek(0)
+                contents = state_file.read()
+                state = json.loads(contents) if contents else self._initial_state()
+
+                yield state
+
+                state_file.seek(0)
+                state_file.truncate()
+                state_file.write(json.dumps(state))
+                state_file.flush()
+            finally:
+                fcntl.flock(state_file, fcntl.LOCK_UN)
+
+
+def parse_retry_after(value):
+    """
+    Returns the number of seconds in a Retry-After header, or None if there isn't one we can use
+    """
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """
+    Returns the process-wide rate limiter, configured from env vars on first use:
+    HELIUM_RATE_LIMIT (target req/s), HELIUM_RATE_LIMIT_MIN (floor req/s) and, to share
+    the budget between processes, HELIUM_RATE_LIMIT_FILE
+    """
+    global _rate_limiter
+
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            rate = float(os.getenv("HELIUM_RATE_LIMIT", 10))
+            min_rate = os.getenv("HELIUM_RATE_LIMIT_MIN")
+            min_rate = float(min_rate) if min_rate else None
+            state_file = os.getenv("HELIUM_RATE_LIMIT_FILE")
+
+            if state_file:
+                logger.info(f"[{RateLimiter.service_name}] sharing {rate} req/s Helium rate limit across processes via {state_file}")
+                _rate_limiter = FileRateLimiter(state_file, rate, min_rate=min_rate)
+            else:
+                logger.info(f"[{RateLimiter.service_name}] limiting Helium requests to {rate} req/s")
+                _rate_limiter = RateLimiter(rate, min_rate=min_rate)
+
+        return _rate_limiter
@@ -1,4 +1,8 @@
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
 from loguru import logger
 import requests
 from requests import adapters
@@ -6,6 +10,24 @@ from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util import retry
 from requests.packages.urllib3.util.retry import Retry
 from urllib.parse import urljoin
+from helium.cache import OraclePriceCache
+from helium.oracle_index import OraclePriceIndex
+from helium.ratelimit import get_rate_limiter, parse_retry_after
+from helium.page_cache import PageCache
+from helium.wallet_cache import WalletMetadataCache
+from helium.pagination import paginate
+
+
+# retry settings for Helium API requests
+# 429s aren't retried here, they go through the rate limiter instead (see _get)
+RETRY_TOTAL = 25
+RETRY_BACKOFF_FACTOR = 1
+RETRY_BACKOFF_MAX = 420
+RETRY_STATUSES = (500, 502, 503, 504)
+
+# connections kept open to Helium by each client - at least one per request made at once
+# (hotspot workers x time windows), so concurrent pagination reuses warm keep-alive connections
+HELIUM_POOL_SIZE = int(os.getenv("HELIUM_POOL_SIZE", 10))
 
 
 class HeliumClient:
@@ -13,8 +35,10 @@ class HeliumClient:
     Client that sets up connection to Helium API
     """
 
-    _session = None
+    session = None
     base_url = None
+    read_ahead = None
+    time_windows = None
     service_name = 'HELIUM API'
 
     # Helium API updates as of 11/2021 require passing User-Agent param in header in requests - mocking a browser here
@@ -27,30 +51,136 @@ class HeliumClient:
     URL_ORACLE_BASE = None
     URL_VALIDATORS_BASE = None
 
-    def __init__(self, base_url=None):
+    def __init__(self, base_url=None, price_cache=None, price_index=None, rate_limiter=None, page_cache=None, wallet_cache=None, read_ahead=None, time_windows=1, pool_size=None):
         self.base_url = base_url or os.getenv("HELIUM_API_URL")
 
-        session = requests.Session()
-        retry = Retry(total=25, backoff_factor=1, status_forcelist=(500, 502, 503, 504, 429))
-        retry.BACKOFF_MAX = 420
-        adapter = HTTPAdapter(max_retries=retry)
-        session.mount("http://", adapter)
-        session.mount("https://", adapter)
-        self._session = session
+        # number of pages fetched ahead of the one being processed when paginating (0 = strictly sequential)
+        self.read_ahead = int(read_ahead if read_ahead is not None else os.getenv("HELIUM_READ_AHEAD", 1))
+
+        # number of sub-windows each reward time range is split into and paginated concurrently
+        self.time_windows = time_windows
+
+        # every request is paced through the rate limiter shared by all clients in this process
+        self.rate_limiter = rate_limiter if rate_limiter is not None else get_rate_limiter()
+
+        # prebuilt oracle price history, answers most price lookups without a network call
+        self.price_index = price_index if price_index is not None else OraclePriceIndex()
+
+        # block -> oracle price lookups outside the index are shared across every reward (and every process) via this cache
+        self.price_cache = price_cache if price_cache is not None else OraclePriceCache()
+
+        # reward pages for closed tax years never change, so re-runs are served from disk
+        self.page_cache = page_cache if page_cache is not None else PageCache()
+
+        # wallet validation and hotspot/validator lists, reused across forms (and runs) for the same address
+        self.wallet_cache = wallet_cache if wallet_cache is not None else WalletMetadataCache()
+
+        # daily oracle price stats per year, and the days whose stats were looked up after they ended,
+        # used by estimate mode - a lock per year, so a year being looked up doesn't hold up other years
+        self._daily_prices = {}
+        self._daily_prices_complete = {}
+        self._daily_prices_locks = {}
+        self._daily_prices_lock = threading.Lock()
+
+        # one session for every thread (worker threads, and paginate's read-ahead threads), so they all
+        # draw on the same pool of keep-alive connections instead of each opening its own
+        self.session = self._make_session(max(pool_size or 0, HELIUM_POOL_SIZE))
 
         self.URL_ACCOUNTS_BASE = urljoin(self.base_url, "accounts")
         self.URL_HOTSPOTS_BASE = urljoin(self.base_url, "hotspots")
         self.URL_ORACLE_BASE = urljoin(self.base_url, "oracle/prices")
         self.URL_VALIDATORS_BASE = urljoin(self.base_url, "validators")
 
+    @staticmethod
+    def _make_session(pool_size):
+        """
+        Session with our retry settings, keeping up to pool_size connections per host open
+        """
+        session = requests.Session()
+        retry = Retry(total=RETRY_TOTAL, backoff_factor=RETRY_BACKOFF_FACTOR, status_forcelist=RETRY_STATUSES)
+        retry.BACKOFF_MAX = RETRY_BACKOFF_MAX
+        adapter = HTTPAdapter(max_retries=retry, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _get(self, url):
+        """
+        GET a url through the rate limiter - 429s shrink the shared rate and are retried
+        (raising a RetryError after RETRY_TOTAL of them, like the session's Retry does for other
+        errors), so a throttled response is never handed back as if it were the api's answer
+        """
+        throttles = 0
+        while True:
+            self.rate_limiter.acquire()
+            resp = self.session.get(url, headers=self.HEADERS)
+
+            if resp.status_code == 429:
+                if throttles >= RETRY_TOTAL:
+                    raise requests.exceptions.RetryError(f"still throttled by Helium after {RETRY_TOTAL} retries, url: {url}", response=resp)
+                throttles += 1
+                self.rate_limiter.on_throttle(parse_retry_after(resp.headers.get("Retry-After")))
+                continue
+
+            self.rate_limiter.on_success()
+            return resp
+
+
+    def _cached(self, kind, address, fetch):
+        """
+        Returns the wallet cache entry for an address, calling fetch(address) and caching its result on a miss
+        """
+        found, value = self.wallet_cache.get(kind, address)
+        if found:
+            return value
+        return self._fetch_cached(kind, address, fetch)
+
+    def _fetch_cached(self, kind, address, fetch):
+        value = fetch(address)
+        self.wallet_cache.set(kind, address, value)
+        return value
+
+    def get_wallet_metadata(self, wallet_addr):
+        """
+        Returns (valid_wallet, hotspots, validators) for an address given on a form, or (None, None, None)
+        if it isn't a valid wallet or hotspot address. Lookups missing from the wallet cache run concurrently
+        """
+        found, valid_wallet = self.wallet_cache.get('wallet', wallet_addr)
+        if found and valid_wallet is None:
+            logger.info(f"[{self.service_name}] {wallet_addr} is cached as an invalid address")
+            return None, None, None
+
+        # if the address hasn't been validated yet, assume it's the wallet itself (the usual case)
+        # and fetch its hotspots and validators while it's being validated
+        lookup_addr = valid_wallet if found else wallet_addr
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            validation = None if found else pool.submit(self._fetch_cached, 'wallet', wallet_addr, self._validate_wallet)
+            hotspots = pool.submit(self.get_hotspots_for_wallet, lookup_addr)
+            validators = pool.submit(self.get_validators_for_wallet, lookup_addr)
+            if validation is not None:
+                valid_wallet = validation.result()
+
+        if valid_wallet is None:
+            return None, None, None
+
+        # a hotspot address was given, so the lists fetched above belong to the wrong address
+        if valid_wallet != lookup_addr:
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                hotspots = pool.submit(self.get_hotspots_for_wallet, valid_wallet)
+                validators = pool.submit(self.get_validators_for_wallet, valid_wallet)
+
+        return valid_wallet, hotspots.result(), validators.result()
 
     def validate_wallet(self, wallet_addr):
+        return self._cached('wallet', wallet_addr, self._validate_wallet)
+
+    def _validate_wallet(self, wallet_addr):
 
         # build url to hit in helium with given wallet address
         url = self.URL_ACCOUNTS_BASE + f'/{wallet_addr}'
 
         # make request, raise exceptions if they come up
-        resp = self._session.get(url, headers=self.HEADERS)
+        resp = self._get(url)
         logger.debug(f"[{self.service_name}] valid wallet check url: {url}")
         resp.raise_for_status()
 
@@ -79,7 +209,7 @@ class HeliumClient:
 
         # make request, raise exceptions if they come up
         try:
-            resp = self._session.get(url, headers=self.HEADERS)
+            resp = self._get(url)
             logger.debug(f"[{self.service_name}] validate hotspot check url: {url}")
 
             # load response body
@@ -100,12 +230,15 @@ class HeliumClient:
         
 
     def get_hotspots_for_wallet(self, wallet_addr):
+        return self._cached('hotspots', wallet_addr, self._get_hotspots_for_wallet)
+
+    def _get_hotspots_for_wallet(self, wallet_addr):
         
         # build url to hit in helium with given wallet address
         url = '/'.join([self.URL_ACCOUNTS_BASE, wallet_addr, 'hotspots'])        # make request, raise exceptions if they come up
         
         # make request, raise exceptions if they come up
-        resp = self._session.get(url, headers=self.HEADERS)
+        resp = self._get(url)
         resp.raise_for_status()
 
         # load response body
@@ -115,12 +248,15 @@ class HeliumClient:
 
 
     def get_validators_for_wallet(self, wallet_addr):
+        return self._cached('validators', wallet_addr, self._get_validators_for_wallet)
+
+    def _get_validators_for_wallet(self, wallet_addr):
         
         # build url to hit in helium with given wallet address
         url = '/'.join([self.URL_ACCOUNTS_BASE, wallet_addr, "validators"])        # make request, raise exceptions if they come up
         
         # make request, raise exceptions if they come up
-        resp = self._session.get(url, headers=self.HEADERS)
+        resp = self._get(url)
         resp.raise_for_status()
 
         # load response body
@@ -168,29 +304,73 @@ class HeliumClient:
         return all_hotspot_locations, is_single_state, non_usd_location
 
 
-    def get_hotspot_rewards(self, year, hotspot_addr):
+    def _get_page(self, url):
+        """
+        GET one page of results, served from the on-disk page cache when the url covers a closed
+        time range (those pages never change)
+        """
+        cacheable = self.page_cache is not None and self.page_cache.is_cacheable(url)
+        if cacheable:
+            page = self.page_cache.get(url)
+            if page is not None:
+                logger.debug(f"[{self.service_name}] page cache hit, url: {url}")
+                return page
+
+        resp = self._get(url)
+        resp.raise_for_status()
+        logger.info(f"[{self.service_name}] Rewards request status: {resp.status_code}, url: {url}")
+        page = resp.json()
 
-        next_year = str(int(year) + 1)
-        url_query = f"rewards?max_time={next_year}-01-01&min_time={year}-01-01" # should be 01-01
-    
-        next_cursor = None
+        if cacheable:
+            self.page_cache.set(url, page)
 
-        while True:
-            # need this here to reset base url for this query each time we loop
-            url = '/'.join([self.URL_HOTSPOTS_BASE, hotspot_addr, url_query]) 
+        return page
+
+    def _get_rewards(self, base_url, addr, year, entity_type, min_time=None, checkpoint=None):
+        """
+        Yields every reward for a hotspot or validator in the given year, following the cursor across pages
+        If min_time is given (an ISO 8601 timestamp within the year), only rewards from then on are returned
+
+        If the client was set up with time_windows > 1, the time range is split into that many sub-windows
+        which are paginated concurrently, then stitched back together in order
 
-            # if we don't have a cursor value (usually first request) hit endpoint normally
-            if next_cursor is None:
-                logger.info(f"[{self.service_name}] Getting initial data for Helium hotspot {hotspot_addr} for year {year}")
-                resp = self._session.get(url, headers=self.HEADERS)
+        With a RequestCheckpoint, every page is saved as it comes in, and pages saved by an earlier
+        run are replayed instead of fetched again
+        """
+        next_year = str(int(year) + 1)
+        min_time = min_time or f"{year}-01-01" # should be 01-01
+        max_time = f"{next_year}-01-01"
 
-            else:
-                url = '&'.join([url, f"cursor={next_cursor}"])
-                resp = self._session.get(url, headers=self.HEADERS)
+        logger.info(f"[{self.service_name}] Getting initial data for Helium {entity_type} {addr} for year {year}")
 
-            resp.raise_for_status()
-            logger.info(f"[{self.service_name}] Rewards request status: {resp.status_code}, url: {url}")
-            resp_data = resp.json()
+        if self.time_windows > 1:
+            yield from self._get_windowed_rewards(base_url, addr, min_time, max_time, checkpoint)
+        else:
+            yield from self._get_window_rewards(base_url, addr, min_time, max_time, checkpoint)
+
+    def _get_window_rewards(self, base_url, addr, min_time, max_time, checkpoint=None):
+        """
+        Yields every reward for a hotspot or validator between min_time and max_time, newest first
+        """
+        url_query = f"rewards?max_time={max_time}&min_time={min_time}"
+        url = '/'.join([base_url, addr, url_query])
+
+        # pick up after the last page an earlier run saved
+        cursor = None
+        num_pages = 0
+        if checkpoint is not None:
+            resumed = checkpoint.load_stream(url)
+            if resumed is not None:
+                rewards, num_pages, cursor, done = resumed
+                yield from rewards
+                if done:
+                    return
+
+        # the next page is requested in the background while this one's rewards are processed
+        for resp_data in paginate(self._get_page, url, read_ahead=self.read_ahead, cursor=cursor):
+            num_pages += 1
+            if checkpoint is not None:
+                checkpoint.save_page(url, resp_data.get('data', []), resp_data.get('cursor'), num_pages)
 
             # if there's data, yield it
             if 'data' in resp_data:
@@ -199,57 +379,113 @@ class HeliumClient:
                 for reward in resp_data['data']:
                     yield reward
 
-            # determine if paginated results + update cursor value if so
             if resp_data.get('cursor'):
-                # find number of rewards transactions on this page - for logging
                 logger.info(f"[{self.service_name}] Retrieved paginated cursor data")
-                next_cursor = resp_data.get('cursor')
 
-            # if there's no next cursor, we break
-            if resp_data.get('cursor') is None:
-                break
+    def _get_windowed_rewards(self, base_url, addr, min_time, max_time, checkpoint=None):
+        """
+        Splits min_time - max_time into self.time_windows equal sub-windows and paginates them all at
+        once. Rewards are yielded newest window first (the api's order), dropping any reward that
+        already came back from a neighbouring window at a boundary.
+        """
+        start = pd.to_datetime(min_time, utc=True)
+        end = pd.to_datetime(max_time, utc=True)
+        bounds = pd.date_range(start, end, periods=self.time_windows + 1)
+        bounds = [bound.strftime('%Y-%m-%dT%H:%M:%SZ') for bound in bounds]
+        windows = list(zip(bounds[:-1], bounds[1:]))[::-1]
+        logger.info(f"[{self.service_name}] paginating {addr} rewards in {len(windows)} time windows concurrently")
+
+        def fetch_window(window):
+            window_min, window_max = window
+            return list(self._get_window_rewards(base_url, addr, window_min, window_max, checkpoint))
+
+        seen = {}
+        with ThreadPoolExecutor(max_workers=len(windows)) as executor:
+            futures = [executor.submit(fetch_window, window) for window in windows]
+
+            for window_num, future in enumerate(futures):
+                for reward in future.result():
+                    key = (reward.get('hash'), reward.get('type'), reward.get('gateway'), reward['block'], reward['amount'])
+
+                    # only drop rewards seen in a different window - duplicates within one window are real
+                    if seen.setdefault(key, window_num) != window_num:
+                        continue
+                    yield reward
+
+    def get_hotspot_rewards(self, year, hotspot_addr, min_time=None, checkpoint=None):
+        return self._get_rewards(self.URL_HOTSPOTS_BASE, hotspot_addr, year, 'hotspot', min_time=min_time, checkpoint=checkpoint)
+
+    def get_validator_rewards(self, year, validator_addr, min_time=None, checkpoint=None):
+        return self._get_rewards(self.URL_VALIDATORS_BASE, validator_addr, year, 'validator', min_time=min_time, checkpoint=checkpoint)
 
-    
-    def get_validator_rewards(self, year, validator_addr):
+    def get_account_rewards(self, year, wallet_addr, min_time=None, checkpoint=None):
+        """
+        Yields every reward paid to a wallet in the given year, across all of its hotspots - each
+        reward's gateway field says which hotspot (or validator) earned it
+        """
+        return self._get_rewards(self.URL_ACCOUNTS_BASE, wallet_addr, year, 'account', min_time=min_time, checkpoint=checkpoint)
 
+    def _get_reward_sum(self, base_url, addr, year, bucket=None):
+        """
+        Gets the sum of an entity's rewards for the year from the rewards/sum endpoint - a single
+        total, or a list of totals per bucket (e.g. 'day') if given
+        """
         next_year = str(int(year) + 1)
-        url_query = f"rewards?max_time={next_year}-01-01&min_time={year}-01-01" # should be 01-01
-    
-        next_cursor = None
+        url = '/'.join([base_url, addr, f"rewards/sum?max_time={next_year}-01-01&min_time={year}-01-01"])
+        if bucket:
+            url = '&'.join([url, f"bucket={bucket}"])
 
-        while True:
-            # need this here to reset base url for this query each time we loop
-            url = '/'.join([self.URL_VALIDATORS_BASE, validator_addr, url_query]) 
+        return self._get_page(url)['data']
 
-            # if we don't have a cursor value (usually first request) hit endpoint normally
-            if next_cursor is None:
-                logger.info(f"[{self.service_name}] Getting initial data for Helium validator {validator_addr} for year {year}")
-                resp = self._session.get(url, headers=self.HEADERS)
+    def get_hotspot_reward_sum(self, year, hotspot_addr, bucket=None):
+        return self._get_reward_sum(self.URL_HOTSPOTS_BASE, hotspot_addr, year, bucket=bucket)
 
-            else:
-                url = '&'.join([url, f"cursor={next_cursor}"])
-                resp = self._session.get(url, headers=self.HEADERS)
+    def get_validator_reward_sum(self, year, validator_addr, bucket=None):
+        return self._get_reward_sum(self.URL_VALIDATORS_BASE, validator_addr, year, bucket=bucket)
 
-            resp.raise_for_status()
-            logger.info(f"[{self.service_name}] Rewards request status: {resp.status_code}, url: {url}")
-            resp_data = resp.json()
+    def get_daily_oracle_prices(self, year):
+        """
+        Returns a df indexed by date with the average, min and max oracle price (in usd) for each
+        day of the year up to today, from the oracle price stats endpoint. Days are looked up once
+        per client once they're over - today's are looked up again each time.
+        """
+        # days that haven't started yet (the rest of the current year) have no prices to look up
+        now = pd.Timestamp.utcnow().tz_localize(None)
+        days = pd.date_range(f"{year}-01-01", min(pd.Timestamp(f"{int(year) + 1}-01-01"), now.normalize() + pd.Timedelta(days=1)), freq='D')
 
-            # if there's data, yield it
-            if 'data' in resp_data:
-                num_rewards = len(resp_data['data'])
-                logger.info(f"[{self.service_name}] {num_rewards} new rewards transactions being recorded")
-                for reward in resp_data['data']:
-                    yield reward
+        with self._daily_prices_lock:
+            year_lock = self._daily_prices_locks.setdefault(year, threading.Lock())
 
-            # determine if paginated results + update cursor value if so
-            if resp_data.get('cursor'):
-                # find number of rewards transactions on this page - for logging
-                logger.info(f"[{self.service_name}] Retrieved paginated cursor data")
-                next_cursor = resp_data.get('cursor')
+        with year_lock:
+            prices = self._daily_prices.get(year)
+            complete = self._daily_prices_complete.setdefault(year, set())
+            missing = [(min_time, max_time) for min_time, max_time in zip(days[:-1], days[1:]) if min_time.date() not in complete]
+            if not missing:
+                return prices if prices is not None else pd.DataFrame(columns=["avg", "min", "max"])
 
-            # if there's no next cursor, we break
-            if resp_data.get('cursor') is None:
-                break
+            logger.info(f"[{self.service_name}] Getting daily oracle price stats for year {year}, {len(missing)} days")
+
+            def get_day_stats(day_bounds):
+                min_time, max_time = day_bounds
+                url = f"{self.URL_ORACLE_BASE}/stats?min_time={min_time:%Y-%m-%d}&max_time={max_time:%Y-%m-%d}"
+                return self._get_page(url)['data']
+
+            # a year of days is a lot of small requests, so run a few at a time
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                day_stats = list(executor.map(get_day_stats, missing))
+
+            new_prices = pd.DataFrame({
+                "avg": [stats['avg'] for stats in day_stats],
+                "min": [stats['min'] for stats in day_stats],
+                "max": [stats['max'] for stats in day_stats]
+            }, index=[min_time.date() for min_time, _ in missing])
+
+            if prices is not None:
+                new_prices = pd.concat([prices.drop(index=new_prices.index, errors='ignore'), new_prices]).sort_index()
+
+            self._daily_prices[year] = new_prices
+            complete.update(min_time.date() for min_time, max_time in missing if max_time <= now)
+            return new_prices
 
     def transform_reward(self, reward):
         """
@@ -275,20 +511,91 @@ class HeliumClient:
             "usd": usd
         }
 
+    def get_oracle_prices(self):
+        """
+        Yields every oracle price change recorded on the Helium blockchain, newest first
+        """
+        def get_prices_page(url):
+            resp = self._get(url)
+            resp.raise_for_status()
+            logger.debug(f"[{self.service_name}] Oracle prices request status: {resp.status_code}, url: {url}")
+            return resp.json()
+
+        for resp_data in paginate(get_prices_page, self.URL_ORACLE_BASE, read_ahead=self.read_ahead):
+            for price in resp_data.get('data', []):
+                yield price
+
+    def transform_rewards(self, rewards):
+        """
+        Batch version of transform_reward - takes in a list of rewards objects from helium api (a page,
+        or a whole hotspot-year) and converts them all to usd in one vectorized pass
+
+        Returns a df with the same columns as transform_reward, one row per reward
+        """
+        timestamps = pd.to_datetime([reward['timestamp'] for reward in rewards], utc=True)
+        blocks = np.fromiter((reward['block'] for reward in rewards), dtype=np.int64, count=len(rewards))
+        bones = np.fromiter((reward['amount'] for reward in rewards), dtype=np.int64, count=len(rewards))
+
+        prices = self.get_block_prices(blocks)
+        hnt_amts = bones * (10 ** -8)
+        oracle_prices = prices * (10 ** -8)
+
+        return pd.DataFrame({
+            "timestamp": timestamps,
+            "block": blocks,
+            "hnt": hnt_amts,
+            "oracle_price": oracle_prices,
+            "usd": hnt_amts * oracle_prices
+        })
+
+    def get_block_prices(self, blocks):
+        """
+        Takes in an array of blocks, returns an array of the oracle price (in bones) at each block
+        """
+        # resolve everything the price index covers with a single binary search over the whole array
+        prices = self.price_index.prices_at(blocks)
+
+        # anything left is looked up once per unique block
+        missing = prices < 0
+        if missing.any():
+            missing_blocks, inverse = np.unique(blocks[missing], return_inverse=True)
+            missing_prices = np.fromiter((self.get_block_price(int(block)) for block in missing_blocks), dtype=np.int64, count=len(missing_blocks))
+            prices[missing] = missing_prices[inverse]
+
+        return prices
+
     def convert_hnt_usd(self, this_block, hnt_amt):
+        oracle_price = self.get_block_price(this_block) * (10 ** -8)
+        usd = oracle_price * hnt_amt
+        return usd, oracle_price
+
+    def get_block_price(self, this_block):
+        """
+        Returns the oracle price (in bones) in effect at the given block
+        """
+        # the price index answers "price at or before this block" without a network call
+        indexed_price = self.price_index.price_at(this_block)
+        if indexed_price is not None:
+            return indexed_price
+
+        # then check the oracle price cache - most blocks are shared by many rewards
+        cached_price = self.price_cache.get(this_block)
+        if cached_price is not None:
+            return cached_price
+
         # get block price, if we can't get this block get the one before it
         block = this_block
-        usd = None
-        while usd is None:
+        while True:
             url_oracle = '/'.join([self.URL_ORACLE_BASE, str(block)])
-            oracle_response = self._session.get(url_oracle, headers=self.HEADERS)
+            oracle_response = self._get(url_oracle)
             oracle_data = oracle_response.json()
             
             # if we have data for this block, get the oracle price
             if 'data' in oracle_data:
-                oracle_price = oracle_data['data']['price'] * (10 ** -8)
-                usd = oracle_price * hnt_amt
-                return usd, oracle_price
+                # cache the price against the block we were asked for, so we don't walk back again next time
+                price = oracle_data['data']['price']
+                self.price_cache.set(this_block, price)
+                return price
             
             # if we get an error, handle it accordingly
             if 'error' in oracle_data:
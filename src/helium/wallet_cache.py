@@ -0,0 +1,99 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from loguru import logger
+
+
+class WalletMetadataCache:
+    """
+    Persistent TTL cache for per-address wallet metadata - wallet validation results and the
+    hotspot/validator lists for a wallet - keyed by (kind, address).
+
+    Entries live in a local sqlite file so repeat forms for the same wallet (other years,
+    resubmissions) and later runs skip the lookups. Unlike oracle prices this data does
+    change (hotspots get added or transferred), so entries expire after ttl seconds.
+    Invalid addresses are cached too (as None), with their own, usually shorter, TTL.
+    """
+
+    service_name = 'WALLET CACHE'
+
+    def __init__(self, path=None, ttl=None, negative_ttl=None):
+        self.path = path or os.getenv("WALLET_CACHE_PATH", "wallet_metadata.sqlite")
+        self.ttl = int(ttl if ttl is not None else os.getenv("WALLET_CACHE_TTL", 6 * 3600))
+        self.negative_ttl = int(negative_ttl if negative_ttl is not None else os.getenv("WALLET_CACHE_NEGATIVE_TTL", 3600))
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        # counters exposed through stats()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS wallet_metadata "
+            "(kind TEXT NOT NULL, address TEXT NOT NULL, value TEXT, expires_at REAL NOT NULL, PRIMARY KEY (kind, address))"
+        )
+        conn.commit()
+        logger.info(f"[{self.service_name}] using wallet metadata cache at: {self.path} (ttl {self.ttl}s, negative ttl {self.negative_ttl}s)")
+
+    def _connection(self):
+        """
+        sqlite connections can't be shared between threads, so each thread gets its own
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            # WAL lets several processes read while one of them writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, kind, address):
+        """
+        Returns (found, value) for an address - found is False if there's no unexpired entry,
+        value is None for a cached negative result
+        """
+        row = self._connection().execute(
+            "SELECT value FROM wallet_metadata WHERE kind = ? AND address = ? AND expires_at > ?",
+            (kind, address, time.time())
+        ).fetchone()
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return False, None
+            if row[0] is None:
+                self.negative_hits += 1
+                return True, None
+            self.hits += 1
+
+        return True, json.loads(row[0])
+
+    def set(self, kind, address, value):
+        """
+        Stores a value (anything json serializable) for an address, or a negative result if value is None
+        """
+        ttl = self.negative_ttl if value is None else self.ttl
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO wallet_metadata (kind, address, value, expires_at) VALUES (?, ?, ?, ?)",
+            (kind, address, None if value is None else json.dumps(value), time.time() + ttl)
+        )
+        conn.commit()
+
+    def stats(self):
+        """
+        Returns hit/miss counters for this cache, used for logging
+        """
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.negative_hits) / lookups, 3) if lookups else None
+            }
@@ -1,4 +1,5 @@
-from controllers.ProcessController import process_csv_requests, process_schc_requests, process_test
+from controllers.ProcessController import process_csv_requests, process_schc_requests, process_test, build_oracle_index, run_csv_daemon
+from processors.RewardWriter import OUTPUT_FORMATS
 import click
 import os
 from loguru import logger
@@ -7,33 +8,57 @@ import sys
 
 
 @click.command()
-@click.option("--service", '-s', default='csv', type=click.Choice(["csv", "all", "test"])) # removed 'schc' from options
+@click.option("--service", '-s', default='csv', type=click.Choice(["csv", "all", "test", "oracle_index"])) # removed 'schc' from options
 @click.option("--id", default=None)
+@click.option("--hotspot-workers", default=1, type=click.IntRange(min=1), help="Number of hotspots/validators to fetch rewards for concurrently")
+@click.option("--incremental/--full-sync", default=True, help="Only fetch rewards newer than those already synced for each hotspot/validator")
+@click.option("--skip-idle/--no-skip-idle", default=True, help="Check each hotspot's yearly reward total before paginating, and skip it if there were none")
+@click.option("--fetch-strategy", default="auto", type=click.Choice(["auto", "hotspot", "wallet"]), help="Fetch rewards per hotspot, or in one stream for the whole wallet (auto picks by number of hotspots)")
+@click.option("--time-windows", default=1, type=click.IntRange(min=1), help="Split each hotspot's year into this many time windows, paginated concurrently")
+@click.option("--stream-output", is_flag=True, default=False, help="Write reward rows to csv as they're compiled, keeping only running totals in memory")
+@click.option("--output-format", default="csv", type=click.Choice(OUTPUT_FORMATS), help="File format reward outputs are saved in")
+@click.option("--checkpoint/--no-checkpoint", default=True, help="Save each request's fetch progress to local disk, so a request that dies partway through resumes where it left off")
+@click.option("--workers", default=1, type=click.IntRange(min=1), help="Number of csv requests to process at once, each in its own process")
+@click.option("--daemon", is_flag=True, default=False, help="Keep running, and process new csv requests as they're submitted (csv service only)")
+@click.option("--mode", default="exact", type=click.Choice(["exact", "estimate"]), help="estimate uses daily reward sums and prices instead of every reward transaction (needs --id, saved to the request's estimate column only)")
 @click.option("--log_level", '-l',  default="INFO", type=click.Choice(("INFO", "DEBUG", "WARNING", "ERROR", "CRITICAL"), case_sensitive=False))
-def run(service, id, log_level):
+def run(service, id, hotspot_workers, incremental, skip_idle, fetch_strategy, time_windows, stream_output, output_format, checkpoint, workers, daemon, mode, log_level):
 
     logger.remove(0)
     log_root = os.getenv("LOG_FOLDER", "")
     log_date = date.today()
-    logger.add(f"{log_root}{log_date}_hnt-csv.log", rotation="1 month", level=log_level.upper())
+    # with worker processes, log records go through a queue so lines from different processes don't interleave
+    logger.add(f"{log_root}{log_date}_hnt-csv.log", rotation="1 month", level=log_level.upper(), enqueue=workers > 1)
+
+    # estimates are quotes for a single request, and never claim requests from the queue
+    if mode == "estimate" and (not id or daemon or service != "csv"):
+        raise click.UsageError("--mode estimate needs --id, with -s csv and without --daemon")
 
     if id: 
         logger.info(f'running for id: {id}')
 
     if service == "all":
-        process_csv_requests(id_=id)
+        process_csv_requests(id_=id, hotspot_workers=hotspot_workers, incremental_sync=incremental, skip_idle=skip_idle, fetch_strategy=fetch_strategy, time_windows=time_windows, stream_output=stream_output, output_format=output_format, mode=mode, workers=workers, checkpoint=checkpoint)
         # process_schc_requests(id_=id)
     
+    elif service == "csv" and daemon:
+        if workers > 1:
+            logger.warning("--workers is ignored in daemon mode, run more daemons instead")
+        run_csv_daemon(hotspot_workers=hotspot_workers, incremental_sync=incremental, skip_idle=skip_idle, fetch_strategy=fetch_strategy, time_windows=time_windows, stream_output=stream_output, output_format=output_format, checkpoint=checkpoint)
+
     elif service == "csv":
-        process_csv_requests(id_=id)
+        process_csv_requests(id_=id, hotspot_workers=hotspot_workers, incremental_sync=incremental, skip_idle=skip_idle, fetch_strategy=fetch_strategy, time_windows=time_windows, stream_output=stream_output, output_format=output_format, mode=mode, workers=workers, checkpoint=checkpoint)
 
     # discontinuing this but leaving code here in case ever needed in future
     elif service == "schc":
-        process_schc_requests(id_=id)
+        process_schc_requests(id_=id, hotspot_workers=hotspot_workers, incremental_sync=incremental, skip_idle=skip_idle, fetch_strategy=fetch_strategy, time_windows=time_windows, stream_output=stream_output, output_format=output_format)
 
     elif service == "test":
         logger.info("Running in test mode")
         process_test(id_=id)
+
+    elif service == "oracle_index":
+        build_oracle_index()
         
     else:
         logger.warn("Incompatible service requested. Please fetch csv, schc, or both.")
@@ -1,9 +1,83 @@
 from abc import abstractclassmethod, abstractstaticmethod
 from loguru import logger
-from db.hntdb import hnt_db_engine, hnt_metadata
+from db.hntdb import hnt_db_engine, get_table
 from sqlalchemy import select
 from abc import abstractstaticmethod
+import numpy as np
 import pandas as pd
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from queue import Queue
+from datetime import timezone
+from db.reward_sync import get_sync_state, save_sync_state
+from processors.RewardAccumulator import RewardAccumulator
+from db.request_queue import LeaseHeartbeat, claim_requests, get_worker_id
+
+
+# rewards are converted (and streamed to a writer) this many at a time - about one Helium page
+REWARD_BATCH_ROWS = 1000
+
+
+def _produce_in_order(produce, items, workers=1):
+    """
+    Yields (item, iterator over produce(item)) for each item, in order - the caller finishes each
+    iterator before moving on to the next item.
+
+    With more than one worker, the next items' generators are run ahead in background threads,
+    their output queued until it's their turn, but never more than `workers` items at a time -
+    the next one only starts once the caller has finished one.
+    """
+    if workers <= 1:
+        for item in items:
+            yield item, produce(item)
+        return
+
+    done = object()
+    stop = threading.Event()
+
+    def pump(item, out):
+        try:
+            for value in produce(item):
+                if stop.is_set():
+                    return
+                out.put((value, None))
+            out.put((done, None))
+        except BaseException as e:
+            out.put((done, e))
+
+    def drain(out):
+        while True:
+            value, error = out.get()
+            if error is not None:
+                raise error
+            if value is done:
+                return
+            yield value
+
+    items = iter(items)
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def submit():
+            item = next(items, done)
+            if item is not done:
+                out = Queue()
+                executor.submit(pump, item, out)
+                in_flight.append((item, out))
+
+        try:
+            for _ in range(workers):
+                submit()
+
+            while in_flight:
+                item, out = in_flight.popleft()
+                yield item, drain(out)
+                submit()
+
+        # e.g. the writer failed - don't fetch the rest of the entities in flight
+        finally:
+            stop.set()
 
 
 class BaseProcessor:
@@ -16,29 +90,49 @@ class BaseProcessor:
     STATUSES = ["new"]
 
     batch_size = None
+    worker_id = None
+    hotspot_workers = None
+    incremental_sync = None
+    skip_idle = None
+    fetch_strategy = None
+    stats = None
+
+    # in "auto" fetch strategy, wallets with at least this many hotspots fetch rewards at the wallet level
+    WALLET_STRATEGY_MIN_HOTSPOTS = 25
 
-    def __init__(self, batch_size=100):
+    def __init__(self, batch_size=1, hotspot_workers=1, incremental_sync=True, skip_idle=True, fetch_strategy="auto"):
+        # number of new requests claimed at a time - one keeps the rest available to other workers
         self.batch_size = batch_size
 
-    def _prep_select_stmt(self, max_id):
-        """
-        Prepares select statement used to query the hnttax db for
-        new form entries in batches
-        """
-        hnt_table = hnt_metadata.tables[self.HNT_DB_TABLE_NAME]
+        # recorded on each request this process claims
+        self.worker_id = get_worker_id()
+
+        # number of hotspots (or validators) to fetch rewards for at the same time
+        self.hotspot_workers = hotspot_workers
+
+        # only fetch rewards newer than what's stored in the reward sync table
+        self.incremental_sync = incremental_sync
+
+        # check each hotspot's reward total for the year before paginating, and skip it if there's nothing to fetch
+        self.skip_idle = skip_idle
+
+        # "hotspot" paginates each hotspot's rewards, "wallet" pulls them all in one stream from the account, "auto" picks by fleet size
+        self.fetch_strategy = fetch_strategy
 
-        # prepare base select statement, in batches, ordered by id
-        select_stmt = select([hnt_table]).where(hnt_table.c.status == 'new').limit(self.batch_size)
-        select_stmt = select_stmt.order_by(hnt_table.c.id)
+        # per-request counters (e.g. idle hotspots skipped), reset by the controller for each form
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
 
-        # if given a max id, filter select stmt to only include ids > max_id
-        if max_id is not None:
-            select_stmt = select_stmt.where(hnt_table.c.id > max_id)
+    def reset_stats(self):
+        with self._stats_lock:
+            self.stats = Counter()
 
-        return select_stmt
+    def _record_stat(self, key, count=1):
+        with self._stats_lock:
+            self.stats[key] += count
 
     def get_row_by_id(self, id_):
-        hnt_table = hnt_metadata.tables[self.HNT_DB_TABLE_NAME]
+        hnt_table = get_table(self.HNT_DB_TABLE_NAME)
         select_stmt = select([hnt_table]).where(hnt_table.c.id == id_)
         logger.debug(f"[{self.HNT_SERVICE_NAME}] fetching ID: {id_}, {select_stmt}")
 
@@ -47,29 +141,31 @@ class BaseProcessor:
 
     def _get_rows_batch(self):
         """
-        Query the hnttax db in batches of self.batch_size, yield whole batch,
-        determine max id of the batch, continue process
+        Claim new requests from the hnttax db in batches of self.batch_size and yield each
+        batch, until there are none left
+
+        Claimed rows are set to "processing" under this worker's id, so several workers can
+        run against the same table without picking up the same request. Leases are renewed
+        in the background until we're done, and requests left behind by a crashed worker are
+        reclaimed once their lease expires (see db.request_queue)
         """
-        
-        logger.info(f"[{self.HNT_SERVICE_NAME}] getting batches of {self.batch_size} from hnttax table: {self.HNT_DB_TABLE_NAME}")
-        max_id = None
-        while True:
-            select_stmt = self._prep_select_stmt(max_id)
-            rows = hnt_db_engine.execute(select_stmt).fetchall()
+        hnt_table = get_table(self.HNT_DB_TABLE_NAME)
+        logger.info(f"[{self.HNT_SERVICE_NAME}] claiming batches of {self.batch_size} from hnttax table: {self.HNT_DB_TABLE_NAME}, worker: {self.worker_id}")
 
-            if not rows:
-                logger.info(f"[{self.HNT_SERVICE_NAME}] end of retrieval of data rows from hnttax db")
-                break
+        heartbeat = LeaseHeartbeat(hnt_table, self.worker_id).start()
+        try:
+            while True:
+                rows = claim_requests(hnt_table, self.worker_id, limit=self.batch_size)
 
-            logger.info(f"[{self.HNT_SERVICE_NAME}] retrieved {len(rows)} rows of data from hnttax db")
-            yield rows
+                if not rows:
+                    logger.info(f"[{self.HNT_SERVICE_NAME}] end of retrieval of data rows from hnttax db")
+                    break
 
-            # get max entry_id value given last set of rows
-            ids = []
-            for row in rows:
-                ids.append(row.id)
+                logger.info(f"[{self.HNT_SERVICE_NAME}] claimed {len(rows)} rows of data from hnttax db: {[row.id for row in rows]}")
+                yield rows
 
-            max_id = max(ids)
+        finally:
+            heartbeat.stop()
 
     def _get_rows(self):
         """
@@ -101,88 +197,250 @@ class BaseProcessor:
             for row in self._get_rows():
                 yield self._transform_row(row)
 
-    def compile_hotspot_rewards(self, helium_client, wallet, hotspots, year):
+    def compile_hotspot_rewards(self, helium_client, wallet, hotspots, year, writer=None, checkpoint=None):
         """
         Compiles a df of hotspot rewards using the Helium client and given
         a list of hotspots
+
+        If given a RewardWriter, rows are streamed to it as each hotspot's rewards come in
+        and the writer's totals are returned instead of a df (see _collect_rewards). Rewards are
+        always fetched per hotspot then, since the wallet strategy holds the whole wallet-year in memory
+
+        If given a RequestCheckpoint, progress is saved as pages and hotspots come in, and
+        whatever an earlier run of the same request saved is picked up instead of fetched again
         """
+        if self._use_wallet_strategy(hotspots):
+            if writer is None:
+                return self._compile_wallet_rewards(helium_client, wallet, hotspots, year, checkpoint)
+            logger.info(f"[{self.HNT_SERVICE_NAME}] streaming output, so fetching rewards per hotspot instead of for the whole wallet at once")
 
-        num_hotspots = len(hotspots['data'])
-        all_rewards = []
-        x = 1
-        # loop through each hotpost and compile list of all transactions associated with this wallet
-        for hotspot in hotspots['data']:
-            logger.info(f"[{self.HNT_SERVICE_NAME}] hotspot {x} of {num_hotspots}")
-            hotspot_addr = hotspot['address']
-            logger.info(f"[{self.HNT_SERVICE_NAME}] retrieving hotspot reward activity for hotspot: {hotspot_addr}")
-
-            # collect hotspot-level attributes that are written to csv
-            hotspot_attr = {
-                "wallet": wallet,
-                "hotspot_address": hotspot_addr
-            }
-
-            # add this hotspot's rewards data to the list of all rewards
-            for reward in helium_client.get_hotspot_rewards(year, hotspot_addr):
-                
-                # transform the returned reward data into our format for saving to csv
-                transformed_reward = helium_client.transform_reward(reward)
-                complete_row = {
-                    **transformed_reward,
-                    **hotspot_attr
-                }
-                all_rewards.append(complete_row)
-
-            # increment the hotspot counter, for logging
-            x += 1
-
-        # once all rewards are collected for a wallet, convert to dataframe and save to csv
-        if all_rewards:
-            df = pd.DataFrame(all_rewards)
-            return df
-        
-        else:
-            return
+        return self._compile_rewards(helium_client, wallet, hotspots, year, 'hotspot', helium_client.get_hotspot_rewards, helium_client.get_hotspot_reward_sum, writer, checkpoint)
 
-    def compile_validator_rewards(self, helium_client, wallet, validators, year):
+    def compile_validator_rewards(self, helium_client, wallet, validators, year, writer=None, checkpoint=None):
         """
         Compiles a df of validator rewards using the Helium client and given
-        a list of validators
-        """
-
-        num_validators = len(validators['data'])
-        all_rewards = []
-        x = 1
-        # loop through each hotpost and compile list of all transactions associated with this wallet
-        for validator in validators['data']:
-            logger.info(f"[{self.HNT_SERVICE_NAME}] validator {x} of {num_validators}")
-            validator_addr = validator['address']
-            logger.info(f"[{self.HNT_SERVICE_NAME}] retrieving validator reward activity for validator: {validator_addr}")
-
-            # collect hotspot-level attributes that are written to csv
-            validator_attr = {
-                "wallet": wallet,
-                "validator_address": validator_addr
-            }
-
-            # add this hotspot's rewards data to the list of all rewards
-            for reward in helium_client.get_validator_rewards(year, validator_addr):
-                
-                # transform the returned reward data into our format for saving to csv
-                transformed_reward = helium_client.transform_reward(reward)
-                complete_row = {
-                    **transformed_reward,
-                    **validator_attr
-                }
-                all_rewards.append(complete_row)
-
-            # increment the hotspot counter, for logging
-            x += 1
-
-        # once all rewards are collected for a wallet, convert to dataframe and save to csv
-        if all_rewards:
-            df = pd.DataFrame(all_rewards)
+        a list of validators (or streams them to a RewardWriter, and checkpoints them, as above)
+        """
+        return self._compile_rewards(helium_client, wallet, validators, year, 'validator', helium_client.get_validator_rewards, helium_client.get_validator_reward_sum, writer, checkpoint)
+
+    def _use_wallet_strategy(self, hotspots):
+        if self.fetch_strategy == "wallet":
+            return True
+        if self.fetch_strategy == "auto":
+            return len(hotspots['data']) >= self.WALLET_STRATEGY_MIN_HOTSPOTS
+        return False
+
+    def _compile_wallet_rewards(self, helium_client, wallet, hotspots, year, checkpoint=None):
+        """
+        Compiles a df of hotspot rewards from a single stream of all rewards paid to the wallet, instead
+        of one paginated stream per hotspot - each row is attributed to the hotspot in its gateway field
+
+        Rows are ordered by hotspot (in the order of the given list), newest first, the same as
+        _compile_rewards. Incremental sync and the idle hotspot check only apply per hotspot, so
+        they're not used here. Every reward of the wallet-year is held in memory before the rows can
+        be put in that order, so this isn't used with a RewardWriter.
+        """
+        hotspot_addrs = [hotspot['address'] for hotspot in hotspots['data']]
+        logger.info(f"[{self.HNT_SERVICE_NAME}] retrieving reward activity for all {len(hotspot_addrs)} hotspots at once for wallet: {wallet}")
+
+        # only keep rewards earned by this wallet's hotspots (validator rewards are compiled separately)
+        hotspot_set = set(hotspot_addrs)
+        rewards = []
+        num_other = 0
+        for reward in helium_client.get_account_rewards(year, wallet, checkpoint=checkpoint):
+            if reward.get('gateway') in hotspot_set:
+                rewards.append(reward)
+            else:
+                num_other += 1
+
+        if num_other:
+            logger.info(f"[{self.HNT_SERVICE_NAME}] {num_other} wallet rewards weren't earned by a current hotspot, leaving them out")
+            self._record_stat("wallet_rewards_not_from_hotspots", num_other)
+
+        if not rewards:
+            return self._collect_rewards([], wallet, 'hotspot')
+
+        df = helium_client.transform_rewards(rewards)
+        gateways = pd.Categorical([reward['gateway'] for reward in rewards], categories=hotspot_addrs)
+
+        # grouping by the categorical goes through hotspots in list order, and keeps each hotspot's rewards in api order
+        hotspot_rewards = ((addr, hotspot_df) for addr, hotspot_df in df.groupby(gateways, sort=True, observed=True))
+        return self._collect_rewards(hotspot_rewards, wallet, 'hotspot')
+
+    def _compile_rewards(self, helium_client, wallet, entities, year, entity_type, get_rewards, get_reward_sum, writer=None, checkpoint=None):
+        """
+        Shared by hotspots and validators - fetches each entity's rewards for the year, converts
+        them to usd in batches of about a page, and returns them all in one df (or None if no rewards)
+
+        With a RewardWriter, each batch is written out as soon as it's converted instead, and the
+        writer's running totals are returned (or None if no rewards)
+        """
+        num_entities = len(entities['data'])
+
+        def entity_reward_batches(numbered_entity):
+            """
+            Yields an entity's converted rewards, newest first, in batches - new rewards as they're
+            fetched, then the ones already synced. The sync state is saved once all are fetched
+            """
+            x, entity = numbered_entity
+            logger.info(f"[{self.HNT_SERVICE_NAME}] {entity_type} {x} of {num_entities}")
+            entity_addr = entity['address']
+
+            # an earlier run of this request may have finished this entity already
+            if checkpoint is not None:
+                done, df = checkpoint.load_entity(entity_type, entity_addr)
+                if done:
+                    logger.info(f"[{self.HNT_SERVICE_NAME}] {entity_type} {entity_addr} already fetched by an earlier run, using its checkpoint")
+                    self._record_stat(f"{entity_type}s_from_checkpoint")
+                    if df is not None:
+                        yield df
+                    return
+
+            logger.info(f"[{self.HNT_SERVICE_NAME}] retrieving {entity_type} reward activity for {entity_type}: {entity_addr}")
+
+            # with incremental sync, pick up from the newest reward we already have for this entity-year
+            sync_state = get_sync_state(entity_type, entity_addr, year) if self.incremental_sync else None
+            if sync_state is None:
+                # one cheap aggregate call tells us whether there's anything to paginate through at all
+                if self.skip_idle and get_reward_sum(year, entity_addr)['sum'] == 0:
+                    logger.info(f"[{self.HNT_SERVICE_NAME}] no rewards for {entity_type} {entity_addr} in {year}, skipping")
+                    self._record_stat(f"idle_{entity_type}s_skipped")
+                    if checkpoint is not None:
+                        checkpoint.save_entity(entity_type, entity_addr, None)
+                    return
+
+                rewards = get_rewards(year, entity_addr, checkpoint=checkpoint)
+            else:
+                min_time = sync_state['last_timestamp'].astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+                logger.info(f"[{self.HNT_SERVICE_NAME}] {len(sync_state['rewards'])} rewards already synced for {entity_type} {entity_addr}, fetching rewards since {min_time}")
+
+                # min_time is inclusive, so drop anything from blocks we've already synced
+                rewards = (reward for reward in get_rewards(year, entity_addr, min_time=min_time, checkpoint=checkpoint) if reward['block'] > sync_state['last_block'])
+
+            # convert the new rewards to usd a batch at a time, as they come in - only the converted
+            # (typed) rows are kept until the end, for the sync state
+            new_dfs = []
+            for batch in iter(lambda: list(islice(rewards, REWARD_BATCH_ROWS)), []):
+                df = helium_client.transform_rewards(batch)
+                new_dfs.append(df)
+                yield df
+            new_df = pd.concat(new_dfs, ignore_index=True) if new_dfs else None
+
+            # store only the new rows, and move the high-water mark up to them - nothing to write if
+            # there weren't any. A full fetch (no sync state yet, or incremental sync off) has everything,
+            # so it replaces whatever was stored - e.g. by another worker that synced this entity-year meanwhile
+            if new_df is not None:
+                save_sync_state(entity_type, entity_addr, year, new_df, replace=sync_state is None)
+
+            # rewards come back newest first, so the ones we already had go after the new ones
+            synced_df = sync_state['rewards'] if sync_state is not None and not sync_state['rewards'].empty else None
+            if synced_df is not None:
+                yield synced_df
+
+            if checkpoint is not None:
+                dfs = [df for df in (new_df, synced_df) if df is not None]
+                checkpoint.save_entity(entity_type, entity_addr, pd.concat(dfs, ignore_index=True) if dfs else None)
+
+        numbered_entities = list(enumerate(entities['data'], start=1))
+        workers = self.hotspot_workers if num_entities > 1 else 1
+        if workers > 1:
+            logger.info(f"[{self.HNT_SERVICE_NAME}] fetching {entity_type} rewards with {workers} workers")
+
+        # streamed rows are written in entity order, so only `workers` entities are fetched ahead of the
+        # one being written, with their batches queued until it's their turn (see _produce_in_order)
+        if writer is not None:
+            entity_batches = (
+                (entity['address'], batches)
+                for (x, entity), batches in _produce_in_order(entity_reward_batches, numbered_entities, workers)
+            )
+            return self._write_rewards(entity_batches, wallet, entity_type, writer)
+
+        def fetch_entity_rewards(numbered_entity):
+            dfs = list(entity_reward_batches(numbered_entity))
+            return numbered_entity[1]['address'], pd.concat(dfs, ignore_index=True) if dfs else None
+
+        # paginate several entities at once if configured - map keeps results in entity order, so csv row order is stable
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                return self._collect_rewards(executor.map(fetch_entity_rewards, numbered_entities), wallet, entity_type)
+
+        return self._collect_rewards(map(fetch_entity_rewards, numbered_entities), wallet, entity_type)
+
+    def _collect_rewards(self, entity_rewards, wallet, entity_type):
+        """
+        Combines (entity address, rewards df) pairs into one df for the wallet, in order - the df is
+        None for entities without rewards. Rewards are accumulated column by column, and the wallet
+        and address columns are added once at the end, as categoricals (see RewardAccumulator).
+        Returns None if there were no rewards
+        """
+        accumulator = RewardAccumulator(wallet, entity_type)
+        for entity_addr, df in entity_rewards:
+            accumulator.append(df, entity_addr)
+
+        # once all rewards are collected for a wallet, combine into one dataframe
+        return accumulator.to_dataframe()
+
+    def _write_rewards(self, entity_batches, wallet, entity_type, writer):
+        """
+        Writes (entity address, batches of rewards) pairs to a RewardWriter, in order, each batch as
+        soon as it's ready - returns the writer's running totals, or None if there were no rewards
+        """
+        with writer:
+            for entity_addr, batches in entity_batches:
+                for df in batches:
+                    # add entity-level attributes that are written to csv
+                    writer.write(df.assign(**{'wallet': wallet, f'{entity_type}_address': entity_addr}))
+        return writer.totals() if writer.num_rows else None
+
+    def estimate_hotspot_rewards(self, helium_client, wallet, hotspots, year):
+        """
+        Estimates a df of daily hotspot rewards (see _estimate_rewards)
+        """
+        return self._estimate_rewards(helium_client, wallet, hotspots, year, 'hotspot', helium_client.get_hotspot_reward_sum)
+
+    def estimate_validator_rewards(self, helium_client, wallet, validators, year):
+        """
+        Estimates a df of daily validator rewards (see _estimate_rewards)
+        """
+        return self._estimate_rewards(helium_client, wallet, validators, year, 'validator', helium_client.get_validator_reward_sum)
+
+    def _estimate_rewards(self, helium_client, wallet, entities, year, entity_type, get_reward_sum):
+        """
+        Fast alternative to _compile_rewards - instead of paginating every reward transaction, gets
+        each entity's reward totals per day and converts them with that day's average oracle price
+
+        Returns a df with one row per entity-day (or None if no rewards), including usd_min/usd_max
+        columns valued at the day's lowest and highest oracle price, which bound the error against
+        converting each reward at its own block's price
+        """
+        daily_prices = helium_client.get_daily_oracle_prices(year)
+
+        def estimate_entity_rewards(entity):
+            entity_addr = entity['address']
+            logger.info(f"[{self.HNT_SERVICE_NAME}] estimating daily {entity_type} rewards for {entity_type}: {entity_addr}")
+
+            buckets = get_reward_sum(year, entity_addr, bucket='day')
+            days = pd.to_datetime([bucket['timestamp'] for bucket in buckets], utc=True).date
+            bones = np.array([bucket['sum'] for bucket in buckets], dtype=np.int64)
+
+            df = pd.DataFrame({"date": days, "hnt": bones * (10 ** -8)})
+            df = df[df['hnt'] > 0].sort_values('date', ignore_index=True)
+
+            prices = daily_prices.loc[df['date']]
+            df['oracle_price'] = prices['avg'].values
+            df['usd'] = df['hnt'] * df['oracle_price']
+            df['usd_min'] = df['hnt'] * prices['min'].values
+            df['usd_max'] = df['hnt'] * prices['max'].values
+            df['wallet'] = wallet
+            df[f'{entity_type}_address'] = entity_addr
             return df
-        
+
+        if self.hotspot_workers > 1 and len(entities['data']) > 1:
+            with ThreadPoolExecutor(max_workers=self.hotspot_workers) as executor:
+                entity_rewards = list(executor.map(estimate_entity_rewards, entities['data']))
         else:
-            return
+            entity_rewards = [estimate_entity_rewards(entity) for entity in entities['data']]
+
+        all_rewards = [df for df in entity_rewards if not df.empty]
+        if all_rewards:
+            return pd.concat(all_rewards, ignore_index=True)
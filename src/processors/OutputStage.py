@@ -0,0 +1,115 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from loguru import logger
+
+
+# threads saving/uploading output files, and how many requests can be waiting on them before the main loop blocks
+OUTPUT_WORKERS = int(os.getenv("OUTPUT_WORKERS", 2))
+OUTPUT_MAX_PENDING = int(os.getenv("OUTPUT_MAX_PENDING", 2))
+
+
+def save_outputs(row_id, updates, saves):
+    """
+    Runs a request's output saves (callables that serialize and write/upload a file), and returns
+    the db updates to make for it - the given ones if every save succeeded, otherwise an error
+    status (keeping any updates that don't set the status, like a corrected wallet)
+
+    Estimates never change a request's status, so a failed estimate save is recorded in the
+    estimate column instead
+    """
+    try:
+        for save in saves:
+            save()
+    except Exception as e:
+        logger.exception(f"[{OutputStage.service_name}] could not save output for db id {row_id} ({e})")
+        if any("estimate" in values for values in updates):
+            estimate_error = {
+                "estimate": {
+                    "msg": f"could not save output ({e})",
+                    "stage": "saving output"
+                }
+            }
+            return [values for values in updates if "estimate" not in values] + [estimate_error]
+
+        error_values = {
+            "status": "error",
+            "errors": {
+                "msg": f"could not save output ({e})",
+                "stage": "saving output"
+            },
+            "processed_at": datetime.utcnow()
+        }
+        return [values for values in updates if "status" not in values] + [error_values]
+
+    return updates
+
+
+class OutputStage:
+    """
+    Saves requests' output files in background threads, so the main loop can move on to fetching
+    the next request's rewards while the previous one's files serialize and upload.
+
+    A request's db updates are only handed to the status writer once all of its files are saved
+    (see save_outputs), so it's never marked processed with its output missing. At most
+    max_pending requests can be waiting to be saved - submit blocks past that, so finished
+    dfs can't pile up in memory if saving falls behind.
+
+        with StatusWriter(table) as status_writer, OutputStage(status_writer) as output_stage:
+            for form in forms:
+                output_stage.submit(form['id'], *process_csv_form(processor, client, form))
+    """
+
+    service_name = 'OUTPUT'
+
+    def __init__(self, status_writer, workers=OUTPUT_WORKERS, max_pending=OUTPUT_MAX_PENDING):
+        self.status_writer = status_writer
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="output")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures = set()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def submit(self, row_id, updates, saves):
+        """
+        Queues a request's output saves, then its db updates - requests with nothing to save
+        go straight to the status writer
+        """
+        if not saves:
+            self.status_writer.add(row_id, updates)
+            return
+
+        self._slots.acquire()
+        future = self._executor.submit(self._save, row_id, updates, saves)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._done)
+
+    def _save(self, row_id, updates, saves):
+        self.status_writer.add(row_id, save_outputs(row_id, updates, saves))
+
+    def _done(self, future):
+        with self._lock:
+            self._futures.discard(future)
+        self._slots.release()
+
+        # save errors are handled in save_outputs, so this is the status writer failing to write a batch
+        if future.exception() is not None:
+            logger.error(f"[{self.service_name}] could not queue db updates ({future.exception()})")
+
+    def wait(self):
+        """
+        Blocks until everything submitted so far is saved
+        """
+        with self._lock:
+            futures = list(self._futures)
+        wait(futures)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
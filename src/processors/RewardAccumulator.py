@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+
+# columns of converted rewards (see HeliumClient.transform_rewards), kept as typed arrays
+REWARD_COLUMNS = ["timestamp", "block", "hnt", "oracle_price", "usd"]
+
+
+class RewardAccumulator:
+    """
+    Collects a wallet's converted rewards column by column, one hotspot (or validator) at a time.
+
+    Each column is kept as a list of typed numpy chunks that's concatenated once at the end,
+    and the wallet/address strings are dictionary encoded - each entity's address is stored
+    once, with an int code per row - so they end up as categorical columns instead of one
+    python string per row.
+    """
+
+    def __init__(self, wallet, entity_type):
+        self.wallet = wallet
+        self.address_column = f'{entity_type}_address'
+        self.num_rows = 0
+
+        self._chunks = {column: [] for column in REWARD_COLUMNS}
+        self._addresses = {}
+        self._address_codes = []
+
+    def __len__(self):
+        return self.num_rows
+
+    def append(self, df, entity_addr):
+        """
+        Adds one entity's converted rewards (a df with REWARD_COLUMNS)
+        """
+        if df is None or df.empty:
+            return
+
+        # .values gives tz-aware timestamps as datetime64[ns] (in utc) rather than an object array
+        for column in REWARD_COLUMNS:
+            self._chunks[column].append(df[column].values)
+
+        code = self._addresses.setdefault(entity_addr, len(self._addresses))
+        self._address_codes.append(np.full(len(df), code, dtype=np.int32))
+        self.num_rows += len(df)
+
+    def to_dataframe(self):
+        """
+        Returns everything appended so far as one df, in the order it was appended, with
+        categorical wallet and address columns (or None if nothing was appended)
+        """
+        if not self.num_rows:
+            return
+
+        data = {column: np.concatenate(chunks) for column, chunks in self._chunks.items()}
+        data['timestamp'] = pd.to_datetime(data['timestamp'], utc=True)
+        data['wallet'] = pd.Categorical.from_codes(np.zeros(self.num_rows, dtype=np.int8), categories=[self.wallet])
+        data[self.address_column] = pd.Categorical.from_codes(np.concatenate(self._address_codes), categories=list(self._addresses))
+
+        return pd.DataFrame(data)
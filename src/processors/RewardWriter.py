@@ -0,0 +1,170 @@
+import gzip
+import os
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from loguru import logger
+from helium import TIMESTAMP_FORMAT
+
+
+# file formats reward outputs can be saved in
+OUTPUT_FORMATS = ("csv", "csv.gz", "parquet")
+
+# parquet files are written with this codec, and timestamps at the precision helium gives them
+PARQUET_OPTIONS = {
+    "compression": "zstd",
+    "coerce_timestamps": "us"
+}
+
+
+def output_file_name(file_name, output_format='csv'):
+    """
+    Swaps the extension of an output file name for the given output format
+    """
+    return str(Path(file_name).with_suffix(f".{output_format}"))
+
+
+def write_parquet(df, where):
+    """
+    Writes a rewards df to a parquet file (path or file object), with one row group per
+    hotspot/validator - rows are already grouped by entity, so readers can skip straight
+    to one entity's rewards
+    """
+    # pyarrow is only imported when parquet output is used
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    # start of each run of rows with the same address
+    address_columns = [column for column in df.columns if column.endswith('_address')]
+    if address_columns and len(df):
+        codes = pd.factorize(df[address_columns[0]])[0]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    else:
+        starts = np.array([0])
+    ends = np.r_[starts[1:], len(df)]
+
+    writer = pq.ParquetWriter(where, table.schema, **PARQUET_OPTIONS)
+    try:
+        for start, end in zip(starts, ends):
+            writer.write_table(table.slice(start, end - start))
+    finally:
+        writer.close()
+
+
+def reward_totals(df):
+    """
+    Totals for a compiled rewards df, in the same format as RewardWriter.totals()
+    """
+    return {
+        "rows": len(df),
+        "hnt": float(df['hnt'].sum()),
+        "usd": float(df['usd'].sum())
+    }
+
+
+class RewardWriter:
+    """
+    Writes compiled rewards to a csv (or parquet) file as each hotspot's (or validator's) rows
+    come in, instead of building one df for the whole wallet and serializing it at the end - only
+    running totals are kept in memory, so the file can be any size.
+
+    Rows go to a .part file that's renamed into place once the writer closes cleanly, and removed
+    if compilation fails or there turn out to be no rewards. on_complete(file_path) is called with
+    the finished file (e.g. to upload it). With output_format="parquet", each df written becomes
+    one row group, and with "csv.gz" the csv is gzip compressed.
+
+    Csv rows can also go straight to a stream instead of a local file (e.g. an aws.multipart.S3TextStream,
+    uploading as it goes) - it's closed once the writer closes cleanly, and aborted otherwise.
+
+        with RewardWriter(path) as writer:
+            for df in dfs:
+                writer.write(df)
+        totals = writer.totals()
+    """
+
+    def __init__(self, file_path, index=False, on_complete=None, output_format='csv', stream=None):
+        self.file_path = file_path
+        self.part_path = f"{file_path}.part"
+        self.output_format = output_format
+        self.stream = stream
+
+        # write a running row number as the first column, like df.to_csv does by default (csv only)
+        self.index = index
+        self.on_complete = on_complete
+
+        self.num_rows = 0
+        self.hnt = 0.0
+        self.usd = 0.0
+        self._file = None
+        self._parquet = None
+
+    def __enter__(self):
+        # the parquet writer needs the schema, so it's opened on the first write instead
+        if self.stream is not None:
+            self._file = self.stream
+        elif self.output_format == 'csv':
+            self._file = open(self.part_path, 'w', newline='')
+        elif self.output_format == 'csv.gz':
+            self._file = gzip.open(self.part_path, 'wt', newline='')
+        return self
+
+    def write(self, df):
+        """
+        Appends a df of rewards to the file (with a csv header before the first one) and adds it to the totals
+        """
+        if df.empty:
+            return
+
+        if self.output_format == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._parquet is None:
+                self._parquet = pq.ParquetWriter(self.part_path, table.schema, **PARQUET_OPTIONS)
+            self._parquet.write_table(table)
+
+        else:
+            if self.index:
+                df = df.set_axis(pd.RangeIndex(self.num_rows, self.num_rows + len(df)), axis=0)
+            df.to_csv(self._file, index=self.index, header=self.num_rows == 0, date_format=TIMESTAMP_FORMAT)
+
+        self.num_rows += len(df)
+        self.hnt += float(df['hnt'].sum())
+        self.usd += float(df['usd'].sum())
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.stream is not None:
+            if exc_type is not None or not self.num_rows:
+                self.stream.abort()
+                return
+            self.stream.close()
+            logger.info(f"Streamed {self.num_rows} rows to {self.output_format}, path: {self.file_path}")
+            return
+
+        if self._file is not None:
+            self._file.close()
+        if self._parquet is not None:
+            self._parquet.close()
+
+        if exc_type is not None or not self.num_rows:
+            if os.path.exists(self.part_path):
+                os.remove(self.part_path)
+            return
+
+        os.replace(self.part_path, self.file_path)
+        logger.info(f"Streamed {self.num_rows} rows to {self.output_format}, path: {self.file_path}")
+        if self.on_complete is not None:
+            self.on_complete(self.file_path)
+
+    def totals(self):
+        """
+        Running totals of everything written so far
+        """
+        return {
+            "rows": self.num_rows,
+            "hnt": self.hnt,
+            "usd": self.usd
+        }
@@ -0,0 +1,81 @@
+import re
+import statistics
+import subprocess
+import sys
+import time
+import click
+
+
+# what each service has to import before it can start work
+TARGETS = {
+    "cli": "process",
+    "csv": "controllers.ProcessController",
+    "schc": "processors.SchcProcessor, aws, taxes.taxes, controllers",
+}
+
+# imports the csv service shouldn't need - reported if they show up anyway
+HEAVY_MODULES = ("boto3", "stripe", "pdfrw", "PyPDF2", "pyarrow")
+
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def measure_imports(modules):
+    """
+    Imports the given modules in a fresh interpreter with -X importtime, returns the wall time
+    (seconds), {package: cumulative import time (seconds)} and the names of every package that
+    was loaded
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modules}"],
+        capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        errors = [line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+        raise click.ClickException(f"importing {modules} failed:\n" + "\n".join(errors[-20:]))
+
+    cumulative = {}
+    loaded = set()
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if not match:
+            continue
+        module = match.group(4)
+        loaded.add(module.split(".")[0])
+        # timings per package (including everything it imports), rather than per submodule
+        if "." not in module:
+            cumulative[module] = int(match.group(2)) / 1e6
+    return elapsed, cumulative, loaded
+
+
+@click.command()
+@click.option("--runs", default=5, type=click.IntRange(min=1), help="Number of fresh interpreters to time each target in")
+@click.option("--top", default=8, type=click.IntRange(min=0), help="Number of slowest packages to list per target")
+@click.option("--target", "targets", multiple=True, type=click.Choice(list(TARGETS)), help="Only time these targets (default all)")
+def run(runs, top, targets):
+    """
+    Times interpreter startup plus imports for each service, to keep track of cold start cost
+    """
+    for name in targets or TARGETS:
+        modules = TARGETS[name]
+        timings = [measure_imports(modules) for _ in range(runs)]
+        wall = statistics.median(elapsed for elapsed, _, _ in timings)
+
+        # slowest packages, by their median across runs
+        imports = {}
+        for _, cumulative, _ in timings:
+            for module, seconds in cumulative.items():
+                imports.setdefault(module, []).append(seconds)
+        slowest = sorted(((statistics.median(seconds), module) for module, seconds in imports.items()), reverse=True)
+
+        heavy = [module for module in HEAVY_MODULES if module in timings[0][2]]
+
+        click.echo(f"{name} ({modules}): {wall * 1000:.0f} ms median wall time over {runs} runs")
+        click.echo(f"  heavy modules loaded: {', '.join(heavy) or 'none'}")
+        for seconds, module in slowest[:top]:
+            click.echo(f"  {seconds * 1000:8.1f} ms  {module}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,166 @@
+import os
+import sys
+from urllib.parse import parse_qsl, urlsplit
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+
+# the services run from src/ (see Dockerfile), so their modules import from there
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+# the hnttax engine is created on import - nothing connects to it (tests that need postgres use hnt_db)
+for name, value in [("HNTTAX_DATABASE_HOST", "localhost"), ("HNTTAX_DATABASE_PORT", "5432"), ("HNTTAX_DATABASE_UN", "test"), ("HNTTAX_DATABASE_PW", "test")]:
+    os.environ.setdefault(name, value)
+
+from db import hntdb, request_queue, reward_sync, status_writer
+from helium.cache import OraclePriceCache
+from helium.oracle_index import OraclePriceIndex
+from helium.page_cache import PageCache
+from helium.ratelimit import RateLimiter
+from helium.service import HeliumClient
+from helium.wallet_cache import WalletMetadataCache
+
+
+class StubResponse:
+    def __init__(self, body, status_code=200, headers=None):
+        self.body = body
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"status {self.status_code}")
+
+
+class StubHelium:
+    """
+    Stands in for the Helium API - serves reward and oracle price pages (page_size at a time,
+    with cursors), reward sums and oracle prices from the given data (and daily price stats made up
+    from the day of the month), and records every url requested.
+    Used as a HeliumClient's session, so requests still go through the client's _get
+
+    accounts maps wallet addresses to their {"hotspots": [...], "validators": [...]}, and
+    hotspot_owners maps hotspot addresses to their owner's wallet - any other address isn't on chain
+
+    With by_time, reward pages only have the rewards between the query's min_time and max_time,
+    inclusive at both ends - so a reward right on a time window boundary comes back from both windows
+    """
+
+    def __init__(self, rewards=None, prices=None, page_size=2, by_time=False, accounts=None, hotspot_owners=None):
+        # address -> rewards, newest first (the api's order)
+        self.rewards = rewards or {}
+        self.by_time = by_time
+        self.accounts = accounts or {}
+        self.hotspot_owners = hotspot_owners or {}
+
+        # block -> oracle price (in bones), blocks without one get the api's error body
+        self.prices = prices or {}
+        self.page_size = page_size
+        self.urls = []
+
+        # canned responses returned (in order) before any of the above, e.g. 429s
+        self.responses = []
+
+    def get(self, url, headers=None):
+        self.urls.append(url)
+        if self.responses:
+            return self.responses.pop(0)
+
+        parts = urlsplit(url)
+        path = parts.path.rstrip('/').split('/')
+        query = dict(parse_qsl(parts.query))
+
+        if path[-3:] == ['oracle', 'prices', 'stats']:
+            day = int(query['min_time'][-2:])
+            return StubResponse({"data": {"avg": day + 0.5, "min": day, "max": day + 1}})
+
+        # the price history, newest first
+        if path[-2:] == ['oracle', 'prices']:
+            prices = [{"block": block, "price": self.prices[block]} for block in sorted(self.prices, reverse=True)]
+            return self._page(prices, query)
+
+        if path[-3:-1] == ['oracle', 'prices']:
+            block = int(path[-1])
+            if block in self.prices:
+                return StubResponse({"data": {"block": block, "price": self.prices[block]}})
+            return StubResponse({"error": "not found"})
+
+        # wallet validation - addresses that aren't wallets come back without a block
+        if path[-2] == 'accounts':
+            return StubResponse({"data": {"address": path[-1], "block": 1 if path[-1] in self.accounts else None}})
+
+        if path[-3] == 'accounts' and path[-1] in ('hotspots', 'validators'):
+            return StubResponse({"data": self.accounts.get(path[-2], {}).get(path[-1], [])})
+
+        if path[-2] == 'hotspots':
+            if path[-1] in self.hotspot_owners:
+                return StubResponse({"data": {"address": path[-1], "owner": self.hotspot_owners[path[-1]]}})
+            return StubResponse({"error": "not found"})
+
+        if path[-1] == 'sum':
+            rewards = self.rewards.get(path[-3], [])
+            return StubResponse({"data": {"sum": sum(reward['amount'] for reward in rewards)}})
+
+        if path[-1] == 'rewards':
+            rewards = self.rewards.get(path[-2], [])
+            if self.by_time:
+                min_time, max_time = pd.Timestamp(query['min_time'], tz='UTC'), pd.Timestamp(query['max_time'], tz='UTC')
+                rewards = [reward for reward in rewards if min_time <= pd.Timestamp(reward['timestamp']) <= max_time]
+            return self._page(rewards, query)
+
+        raise AssertionError(f"unexpected url: {url}")
+
+    def _page(self, items, query):
+        start = int(query.get('cursor', 0))
+        end = start + self.page_size
+        page = {"data": items[start:end]}
+        if end < len(items):
+            page["cursor"] = str(end)
+        return StubResponse(page)
+
+
+@pytest.fixture
+def make_client(tmp_path):
+    """
+    Returns a function building a HeliumClient that talks to a StubHelium, with its caches
+    and price index in tmp_path
+    """
+    def make(stub, index_entries=None, **kwargs):
+        index = OraclePriceIndex(str(tmp_path / "oracle_prices.idx"))
+        if index_entries:
+            index.append(index_entries)
+
+        client = HeliumClient(
+            base_url="https://api.helium.test/v1/",
+            price_cache=OraclePriceCache(str(tmp_path / "oracle_prices.sqlite")),
+            price_index=index,
+            rate_limiter=RateLimiter(1000),
+            page_cache=PageCache(str(tmp_path / "helium_page_cache")),
+            wallet_cache=WalletMetadataCache(str(tmp_path / "wallet_metadata.sqlite")),
+            **kwargs
+        )
+        client.session = stub
+        return client
+
+    return make
+
+
+@pytest.fixture
+def hnt_db(monkeypatch):
+    """
+    Points the db modules at the scratch postgres database in TEST_DATABASE_URL (skips the
+    test if it isn't set) - tests create and drop their own tables there
+    """
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL isn't set")
+
+    engine = create_engine(url, executemany_mode='values_plus_batch')
+    for module in (hntdb, request_queue, reward_sync, status_writer):
+        monkeypatch.setattr(module, "hnt_db_engine", engine, raising=False)
+
+    yield engine
+    engine.dispose()
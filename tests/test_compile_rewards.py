@@ -0,0 +1,184 @@
+import pandas as pd
+import pytest
+from conftest import StubHelium
+from helium.checkpoint import RequestCheckpoint
+from processors import BaseProcessor as base_processor
+from processors.CsvProcessor import CsvProcessor
+from processors.RewardWriter import RewardWriter
+
+
+WALLET = "wallet1"
+
+# oracle price changes covered by the index - blocks after 200 are looked up from the api
+INDEX_ENTRIES = [(100, 10 * 10 ** 8), (140, 20 * 10 ** 8), (200, 15 * 10 ** 8)]
+API_PRICES = {209: 30 * 10 ** 8}
+
+
+def reward(gateway, block, hnt):
+    return {
+        "gateway": gateway,
+        "block": block,
+        "amount": int(hnt * 10 ** 8),
+        "hash": f"hash{block}",
+        "type": "poc_witnesses",
+        "timestamp": f"2021-01-01T00:{block % 60:02d}:00.000000Z"
+    }
+
+
+HOTSPOT_REWARDS = {
+    "hotspotA": [reward("hotspotA", 150, 1), reward("hotspotA", 120, 2), reward("hotspotA", 105, 0.5)],
+    "hotspotB": [reward("hotspotB", 210, 3)],
+    "hotspotC": []
+}
+HOTSPOTS = {"data": [{"address": address} for address in HOTSPOT_REWARDS]}
+
+# (hotspot, block, hnt, oracle price, usd) of every row, in csv order
+EXPECTED_ROWS = [
+    ("hotspotA", 150, 1.0, 20.0, 20.0),
+    ("hotspotA", 120, 2.0, 10.0, 20.0),
+    ("hotspotA", 105, 0.5, 10.0, 5.0),
+    ("hotspotB", 210, 3.0, 30.0, 90.0)
+]
+
+
+def stub_helium():
+    # the wallet's own stream has every hotspot's rewards newest first, plus one from a hotspot it no longer owns
+    account_rewards = sorted(sum(HOTSPOT_REWARDS.values(), [reward("sold", 130, 7)]), key=lambda r: -r['block'])
+    return StubHelium(rewards=dict(HOTSPOT_REWARDS, **{WALLET: account_rewards}), prices=API_PRICES)
+
+
+def rows(df):
+    return [
+        (row.hotspot_address, row.block, pytest.approx(row.hnt), pytest.approx(row.oracle_price), pytest.approx(row.usd))
+        for row in df.itertuples()
+    ]
+
+
+@pytest.fixture(autouse=True)
+def no_sync_state(monkeypatch):
+    # reward sync state lives in postgres - these tests fetch everything
+    saved = []
+    monkeypatch.setattr(base_processor, "save_sync_state", lambda *args, **kwargs: saved.append((args, kwargs)))
+    return saved
+
+
+@pytest.mark.parametrize("fetch_strategy, hotspot_workers, read_ahead", [
+    ("hotspot", 1, 0),
+    ("hotspot", 1, 1),
+    ("hotspot", 3, 1),
+    ("wallet", 1, 1)
+])
+def test_compile_hotspot_rewards(make_client, fetch_strategy, hotspot_workers, read_ahead):
+    client = make_client(stub_helium(), index_entries=INDEX_ENTRIES, read_ahead=read_ahead)
+    processor = CsvProcessor(incremental_sync=False, hotspot_workers=hotspot_workers, fetch_strategy=fetch_strategy)
+
+    df = processor.compile_hotspot_rewards(client, WALLET, HOTSPOTS, 2021)
+
+    assert rows(df) == EXPECTED_ROWS
+    assert (df['wallet'] == WALLET).all()
+    assert df['timestamp'].dt.tz is not None
+
+
+def test_incremental_sync_saves_only_new_rewards(make_client, monkeypatch, no_sync_state):
+    client = make_client(stub_helium(), index_entries=INDEX_ENTRIES)
+
+    # hotspotA was synced up to block 120 by an earlier request
+    synced = client.transform_rewards(HOTSPOT_REWARDS["hotspotA"][1:])
+    states = {"hotspotA": {"last_block": 120, "last_timestamp": synced['timestamp'].max(), "rewards": synced}}
+    monkeypatch.setattr(base_processor, "get_sync_state", lambda entity_type, address, year: states.get(address))
+
+    df = CsvProcessor(incremental_sync=True).compile_hotspot_rewards(client, WALLET, HOTSPOTS, 2021)
+
+    assert rows(df) == EXPECTED_ROWS
+    saved = {args[1]: (list(args[3]['block']), kwargs['replace']) for args, kwargs in no_sync_state}
+    # hotspotB had no sync state, so its full fetch replaces whatever might be stored
+    assert saved == {"hotspotA": ([150], False), "hotspotB": ([210], True)}
+
+
+@pytest.mark.parametrize("fetch_strategy, hotspot_workers", [
+    ("hotspot", 1),
+    ("hotspot", 3),
+    ("wallet", 1)
+])
+def test_compile_hotspot_rewards_to_writer(make_client, tmp_path, fetch_strategy, hotspot_workers):
+    stub = stub_helium()
+    client = make_client(stub, index_entries=INDEX_ENTRIES)
+    processor = CsvProcessor(incremental_sync=False, fetch_strategy=fetch_strategy, hotspot_workers=hotspot_workers)
+    path = tmp_path / "rewards.csv"
+
+    totals = processor.compile_hotspot_rewards(client, WALLET, HOTSPOTS, 2021, writer=RewardWriter(str(path)))
+
+    assert totals['rows'] == len(EXPECTED_ROWS)
+    assert totals['hnt'] == pytest.approx(6.5)
+    assert totals['usd'] == pytest.approx(135.0)
+    assert rows(pd.read_csv(path)) == EXPECTED_ROWS
+
+    # streaming never pulls the whole wallet-year into memory through the account's reward stream
+    assert not any(f"/accounts/{WALLET}/" in url for url in stub.urls)
+
+
+def test_streamed_rewards_are_written_a_batch_at_a_time(make_client, tmp_path, monkeypatch):
+    monkeypatch.setattr(base_processor, "REWARD_BATCH_ROWS", 2)
+    client = make_client(stub_helium(), index_entries=INDEX_ENTRIES)
+    processor = CsvProcessor(incremental_sync=False, hotspot_workers=2)
+    writer = RewardWriter(str(tmp_path / "rewards.csv"))
+    written = []
+    write = writer.write
+    monkeypatch.setattr(writer, "write", lambda df: written.append(list(df['block'])) or write(df))
+
+    processor.compile_hotspot_rewards(client, WALLET, HOTSPOTS, 2021, writer=writer)
+
+    # hotspotA's three rewards go out in two writes, not one per hotspot
+    assert written == [[150, 120], [105], [210]]
+
+
+def test_produce_in_order_bounds_items_in_flight():
+    started = []
+
+    def produce(item):
+        started.append(item)
+        yield from range(item)
+
+    results = []
+    for x, (item, values) in enumerate(base_processor._produce_in_order(produce, [3, 1, 4, 1, 5, 2], workers=2)):
+        # the next item only starts once the caller is done with one
+        assert len(started) <= x + 2
+        results.append((item, list(values)))
+
+    assert results == [(item, list(range(item))) for item in [3, 1, 4, 1, 5, 2]]
+
+
+def test_produce_in_order_raises_producer_errors():
+    def produce(item):
+        yield item
+        if item == 2:
+            raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        for item, values in base_processor._produce_in_order(produce, [1, 2, 3], workers=2):
+            list(values)
+
+
+def test_compile_hotspot_rewards_resumes_from_checkpoint(make_client, tmp_path):
+    checkpoint = RequestCheckpoint("request_1", root=str(tmp_path / "checkpoints"))
+    processor = CsvProcessor(incremental_sync=False)
+
+    first = processor.compile_hotspot_rewards(make_client(stub_helium(), index_entries=INDEX_ENTRIES), WALLET, HOTSPOTS, 2021, checkpoint=checkpoint)
+
+    # a rerun of the same request is served entirely from the checkpoint
+    stub = stub_helium()
+    second = processor.compile_hotspot_rewards(make_client(stub, index_entries=INDEX_ENTRIES), WALLET, HOTSPOTS, 2021, checkpoint=checkpoint)
+
+    assert rows(first) == rows(second) == EXPECTED_ROWS
+    assert stub.urls == []
+
+
+def test_oracle_price_lookups_are_cached(make_client):
+    stub = stub_helium()
+    client = make_client(stub, index_entries=INDEX_ENTRIES)
+
+    assert client.get_block_price(210) == API_PRICES[209]
+    assert client.get_block_price(210) == API_PRICES[209]
+
+    # walked back from 210 to 209 once, then answered from the cache
+    assert [url.rsplit('/', 1)[-1] for url in stub.urls] == ["210", "209"]
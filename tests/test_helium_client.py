@@ -0,0 +1,141 @@
+from datetime import date
+from urllib.parse import parse_qsl, urlsplit
+import pandas as pd
+import pytest
+import requests
+from conftest import StubHelium, StubResponse
+from helium.service import RETRY_TOTAL, HeliumClient
+from helium.wallet_cache import WalletMetadataCache
+
+
+def test_session_pool_size():
+    adapter = HeliumClient._make_session(40).get_adapter("https://api.helium.test/v1/")
+    assert adapter._pool_maxsize == 40
+
+
+def test_read_ahead_uses_client_session(make_client):
+    # read-ahead threads fetch through the client's one session, not a session of their own
+    stub = StubHelium(rewards={"hotspotA": [{"block": block, "amount": 1} for block in range(10, 0, -1)]})
+    client = make_client(stub, read_ahead=2)
+
+    rewards = list(client.get_hotspot_rewards(2021, "hotspotA"))
+
+    assert [reward['block'] for reward in rewards] == list(range(10, 0, -1))
+    assert len(stub.urls) == 5
+
+
+def test_time_windows_are_stitched_newest_first(make_client):
+    def reward(block, timestamp, hash_=None):
+        return {"gateway": "hotspotA", "block": block, "amount": 10, "hash": hash_ or f"hash{block}", "type": "poc_witnesses", "timestamp": timestamp}
+
+    # 2 windows split the year at 2021-07-02T12:00:00Z - the reward at block 300 is right on the boundary,
+    # and the one at block 250 really was paid twice
+    rewards = [
+        reward(400, "2021-12-01T00:00:00.000000Z"),
+        reward(350, "2021-09-01T00:00:00.000000Z"),
+        reward(300, "2021-07-02T12:00:00.000000Z"),
+        reward(250, "2021-05-01T00:00:00.000000Z"),
+        reward(250, "2021-05-01T00:00:00.000000Z"),
+        reward(200, "2021-03-01T00:00:00.000000Z"),
+        reward(100, "2021-02-01T00:00:00.000000Z")
+    ]
+    stub = StubHelium(rewards={"hotspotA": rewards}, by_time=True)
+    client = make_client(stub, time_windows=2)
+
+    blocks = [reward['block'] for reward in client.get_hotspot_rewards(2021, "hotspotA")]
+
+    # the boundary reward comes back from both windows, but is only kept once
+    assert blocks == [400, 350, 300, 250, 250, 200, 100]
+
+    # each window is paginated on its own
+    windows = sorted({(query['min_time'], query['max_time']) for query in (dict(parse_qsl(urlsplit(url).query)) for url in stub.urls)})
+    assert windows == [("2021-01-01T00:00:00Z", "2021-07-02T12:00:00Z"), ("2021-07-02T12:00:00Z", "2022-01-01T00:00:00Z")]
+    assert len(stub.urls) == 5
+
+
+def test_wallet_metadata_for_a_hotspot_address(make_client):
+    hotspots, validators = [{"address": "hotspotA"}], [{"address": "validatorA"}]
+    stub = StubHelium(accounts={"wallet1": {"hotspots": hotspots, "validators": validators}}, hotspot_owners={"hotspotA": "wallet1"})
+    client = make_client(stub)
+
+    # the lists fetched for the address while it was being validated belong to the hotspot, so the owner's are fetched
+    assert client.get_wallet_metadata("hotspotA") == ("wallet1", {"data": hotspots}, {"data": validators})
+    paths = [urlsplit(url).path for url in stub.urls]
+    assert "/v1/accounts/hotspotA/hotspots" in paths
+    assert {"/v1/accounts/wallet1/hotspots", "/v1/accounts/wallet1/validators"} <= set(paths)
+
+    # later forms with the same address are answered from the cache
+    stub.urls = []
+    assert client.get_wallet_metadata("hotspotA") == ("wallet1", {"data": hotspots}, {"data": validators})
+    assert stub.urls == []
+
+
+def test_invalid_addresses_are_cached(make_client, tmp_path):
+    stub = StubHelium()
+    client = make_client(stub)
+
+    assert client.get_wallet_metadata("nope") == (None, None, None)
+    assert "/v1/hotspots/nope" in [urlsplit(url).path for url in stub.urls]
+
+    stub.urls = []
+    assert client.get_wallet_metadata("nope") == (None, None, None)
+    assert stub.urls == []
+    assert client.wallet_cache.negative_hits == 1
+
+    # until the negative entry expires
+    client.wallet_cache = WalletMetadataCache(str(tmp_path / "wallet_metadata_expired.sqlite"), negative_ttl=0)
+    client.get_wallet_metadata("nope")
+    client.get_wallet_metadata("nope")
+    assert len([url for url in stub.urls if urlsplit(url).path == "/v1/hotspots/nope"]) == 2
+
+
+def test_throttled_requests_are_retried(make_client):
+    stub = StubHelium(prices={500: 12 * 10 ** 8})
+    stub.responses = [StubResponse({"error": "too many requests"}, status_code=429)] * 3
+    client = make_client(stub)
+
+    assert client.get_block_price(500) == 12 * 10 ** 8
+    assert len(stub.urls) == 4
+    assert client.rate_limiter.rate < client.rate_limiter.max_rate
+
+
+def test_throttled_requests_raise_once_retries_run_out(make_client):
+    stub = StubHelium(prices={499: 12 * 10 ** 8})
+    stub.responses = [StubResponse({"error": "too many requests"}, status_code=429)] * (RETRY_TOTAL + 1)
+    client = make_client(stub)
+
+    # the 429 body mustn't be read as "no price for this block" and walked back from
+    with pytest.raises(requests.exceptions.RetryError):
+        client.get_block_price(500)
+
+    assert len(stub.urls) == RETRY_TOTAL + 1
+    assert client.price_cache.get(500) is None
+    assert client.rate_limiter.rate == client.rate_limiter.min_rate
+
+
+def test_daily_oracle_prices_stop_at_today(make_client, monkeypatch):
+    stub = StubHelium()
+    client = make_client(stub)
+
+    # the page cache goes by the real time, not the one set here
+    client.page_cache = None
+    monkeypatch.setattr(pd.Timestamp, "utcnow", staticmethod(lambda: pd.Timestamp("2022-03-03T12:00:00Z")))
+
+    prices = client.get_daily_oracle_prices(2022)
+    assert len(prices) == 31 + 28 + 3
+    assert prices.loc[date(2022, 3, 3), 'avg'] == 3.5
+    assert len(stub.urls) == 62
+
+    # later the same day, only today's (still changing) stats are looked up again
+    client.get_daily_oracle_prices(2022)
+    assert [url.split('min_time=')[1][:10] for url in stub.urls[62:]] == ["2022-03-03"]
+
+    # the next day, only the days not looked up yet
+    monkeypatch.setattr(pd.Timestamp, "utcnow", staticmethod(lambda: pd.Timestamp("2022-03-04T01:00:00Z")))
+    assert len(client.get_daily_oracle_prices(2022)) == 63
+    assert sorted(url.split('min_time=')[1][:10] for url in stub.urls[63:]) == ["2022-03-03", "2022-03-04"]
+
+    # a past year is looked up in full, once
+    assert len(client.get_daily_oracle_prices(2021)) == 365
+    assert len(client.get_daily_oracle_prices(2021)) == 365
+    assert len(stub.urls) == 65 + 365
@@ -0,0 +1,39 @@
+from conftest import StubHelium
+from helium.oracle_index import update_oracle_index
+
+
+# block -> oracle price (in bones)
+PRICES = {100: 10 * 10 ** 8, 140: 20 * 10 ** 8, 200: 15 * 10 ** 8, 260: 30 * 10 ** 8, 300: 25 * 10 ** 8, 350: 40 * 10 ** 8}
+NEW_PRICES = {400: 45 * 10 ** 8, 450: 50 * 10 ** 8}
+
+
+def test_refresh_appends_only_new_prices(make_client):
+    stub = StubHelium(prices=dict(PRICES))
+    client = make_client(stub, read_ahead=0)
+
+    # the first run downloads the whole price history
+    assert update_oracle_index(client) == len(PRICES)
+    assert len(stub.urls) == 3
+    assert client.price_index.last_block == 350
+
+    # a refresh stops paginating at the first page reaching the last indexed block
+    stub.prices.update(NEW_PRICES)
+    stub.urls = []
+    assert update_oracle_index(client) == len(NEW_PRICES)
+    assert len(stub.urls) == 2
+    assert len(client.price_index) == len(PRICES) + len(NEW_PRICES)
+    assert client.price_index.last_block == 450
+
+    # and adds nothing if there are no new prices
+    assert update_oracle_index(client) == 0
+    assert len(client.price_index) == len(PRICES) + len(NEW_PRICES)
+
+
+def test_blocks_outside_the_index(make_client):
+    client = make_client(StubHelium(), index_entries=list(PRICES.items()))
+
+    # blocks before the first or after the last price change aren't covered - -1 marks them for a lookup
+    prices = client.price_index.prices_at([50, 100, 120, 140, 350, 351])
+    assert list(prices) == [-1, PRICES[100], PRICES[100], PRICES[140], PRICES[350], -1]
+    assert client.price_index.price_at(351) is None
+    assert client.price_index.price_at(299) == PRICES[260]
@@ -0,0 +1,38 @@
+from datetime import datetime, timezone
+import pytest
+from helium.page_cache import CLOSED_LAG_HOURS, PageCache
+
+
+NOW = datetime(2022, 6, 15, 12, 0, tzinfo=timezone.utc)
+URL = "https://api.helium.test/v1/hotspots/hotspotA/rewards?min_time=2021-01-01&max_time={}"
+
+
+@pytest.mark.parametrize("max_time, cacheable", [
+    # a closed tax year
+    ("2022-01-01", True),
+    # time windows ending earlier today, later today, and in the future
+    ("2022-06-15T06:00:00Z", False),
+    ("2022-06-15T18:00:00Z", False),
+    ("2023-01-01", False),
+    # closed, but not for long enough that late blocks are sure to be indexed
+    ("2022-06-15T00:00:00Z", CLOSED_LAG_HOURS <= 12),
+    ("2022-06-13T23:59:59Z", True),
+    ("not a time", False)
+])
+def test_is_cacheable(max_time, cacheable):
+    assert PageCache.is_cacheable(URL.format(max_time), now=NOW) is cacheable
+
+
+def test_is_cacheable_needs_max_time():
+    assert not PageCache.is_cacheable("https://api.helium.test/v1/oracle/prices/100", now=NOW)
+
+
+def test_get_set(tmp_path):
+    cache = PageCache(str(tmp_path))
+    url = URL.format("2022-01-01")
+    assert cache.get(url) is None
+
+    cache.set(url, {"data": [1, 2]})
+
+    # equivalent urls (query params in another order) share an entry
+    assert cache.get("https://API.helium.test/v1/hotspots/hotspotA/rewards?max_time=2022-01-01&min_time=2021-01-01") == {"data": [1, 2]}
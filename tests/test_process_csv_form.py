@@ -0,0 +1,80 @@
+import pandas as pd
+import pytest
+from controllers import ProcessController as process_controller
+from processors.CsvProcessor import CsvProcessor
+from processors.OutputStage import save_outputs
+
+
+WALLET = "wallet1"
+FORM = {"id": 7, "wallet": WALLET, "year": 2021}
+
+DAILY_REWARDS = pd.DataFrame({
+    "hotspot_address": ["hotspotA", "hotspotA"],
+    "hnt": [1.0, 2.0],
+    "usd": [10.0, 22.0],
+    "usd_min": [9.0, 20.0],
+    "usd_max": [11.0, 23.0]
+})
+
+
+class StubClient:
+    def get_wallet_metadata(self, wallet):
+        return wallet, {"data": [{"address": "hotspotA"}]}, {"data": []}
+
+
+@pytest.fixture
+def processor(monkeypatch):
+    processor = CsvProcessor(incremental_sync=False)
+    monkeypatch.setattr(processor, "estimate_hotspot_rewards", lambda *args: DAILY_REWARDS)
+    monkeypatch.setattr(processor, "estimate_validator_rewards", lambda *args: None)
+    return processor
+
+
+@pytest.fixture
+def saved(monkeypatch):
+    saved = []
+    monkeypatch.setattr(process_controller, "save_csv", lambda df, **kwargs: saved.append((df, kwargs)))
+    return saved
+
+
+def test_estimate_output_is_saved_by_the_caller(processor, saved):
+    updates, saves = process_controller.process_csv_form(processor, StubClient(), FORM, mode="estimate")
+
+    # nothing is written until the caller runs the saves
+    assert saved == []
+
+    # only the estimate column is set - the request's status and income are left for its exact run
+    assert [list(update) for update in updates] == [["estimate"]]
+    assert updates[0]['estimate']['usd'] == pytest.approx(32.0)
+    assert updates[0]['estimate']['error_bound'] == pytest.approx(3.0)
+
+    assert save_outputs(FORM['id'], updates, saves) == updates
+    assert [kwargs['file_name'] for df, kwargs in saved] == [f"7_2021_{WALLET[0:7]}_estimate.csv"]
+
+
+def test_estimate_save_failure_is_recorded_with_the_estimate(processor, monkeypatch):
+    def fail(df, **kwargs):
+        raise IOError("upload failed")
+    monkeypatch.setattr(process_controller, "save_csv", fail)
+
+    updates, saves = process_controller.process_csv_form(processor, StubClient(), FORM, mode="estimate")
+    updates = save_outputs(FORM['id'], updates, saves)
+
+    assert [list(update) for update in updates] == [["estimate"]]
+    assert updates[0]['estimate']['stage'] == "saving output"
+
+
+def test_exact_save_failure_is_an_error():
+    def fail():
+        raise IOError("upload failed")
+
+    updates = save_outputs(FORM['id'], [{"wallet": WALLET}, {"status": "processed", "income": 1.0}], [fail])
+
+    assert updates[0] == {"wallet": WALLET}
+    assert updates[1]['status'] == "error"
+    assert updates[1]['errors']['stage'] == "saving output"
+
+
+def test_estimate_mode_never_claims_from_the_queue():
+    with pytest.raises(ValueError):
+        process_controller.process_csv_requests(mode="estimate")
@@ -0,0 +1,167 @@
+import os
+import threading
+import time
+import pytest
+from sqlalchemy import MetaData, Table, select, text
+from db import hntdb, request_queue
+from db.request_queue import RequestListener, check_notify_trigger, claim_requests, release_claims, renew_leases
+
+
+MIGRATION = os.path.join(os.path.dirname(__file__), "..", hntdb.MIGRATION)
+
+
+@pytest.fixture
+def requests_table(hnt_db, monkeypatch):
+    """
+    A request table with 4 new requests, with the claim columns the migration adds
+    """
+    monkeypatch.setattr(request_queue, "_checked_tables", set())
+    hnt_db.execute(text("DROP TABLE IF EXISTS test_requests"))
+    hnt_db.execute(text(
+        "CREATE TABLE test_requests (id SERIAL PRIMARY KEY, wallet TEXT, status TEXT, errors JSONB, processed_at TIMESTAMP, "
+        "worker_id TEXT, claimed_at TIMESTAMPTZ, lease_expires_at TIMESTAMPTZ, attempts INTEGER NOT NULL DEFAULT 0)"
+    ))
+    hnt_db.execute(text("INSERT INTO test_requests (wallet, status) SELECT 'wallet' || n, 'new' FROM generate_series(1, 4) n"))
+
+    yield Table("test_requests", MetaData(), autoload_with=hnt_db)
+    hnt_db.execute(text("DROP TABLE test_requests"))
+
+
+def get_rows(hnt_db, table):
+    return {row.id: row for row in hnt_db.execute(select([table]).order_by(table.c.id))}
+
+
+def expire_leases(hnt_db, table):
+    hnt_db.execute(table.update().values(lease_expires_at=text("now() - interval '1 second'")))
+
+
+def test_claims_are_exclusive(requests_table, hnt_db):
+    assert [row.id for row in claim_requests(requests_table, "worker1", limit=2)] == [1, 2]
+    assert [row.id for row in claim_requests(requests_table, "worker2", limit=5)] == [3, 4]
+    assert claim_requests(requests_table, "worker3") == []
+
+    rows = get_rows(hnt_db, requests_table)
+    assert {row.id: (row.status, row.worker_id, row.attempts) for row in rows.values()} == {
+        1: ("processing", "worker1", 1),
+        2: ("processing", "worker1", 1),
+        3: ("processing", "worker2", 1),
+        4: ("processing", "worker2", 1)
+    }
+    assert all(row.lease_expires_at > row.claimed_at for row in rows.values())
+
+
+def test_claims_skip_locked_rows(requests_table, hnt_db):
+    # another worker is in the middle of claiming request 1
+    with hnt_db.connect() as conn, conn.begin():
+        conn.execute(text("SELECT id FROM test_requests WHERE id = 1 FOR UPDATE"))
+
+        start = time.time()
+        assert [row.id for row in claim_requests(requests_table, "worker2")] == [2]
+        assert time.time() - start < 5
+
+
+def test_expired_leases_are_reclaimed(requests_table, hnt_db):
+    claim_requests(requests_table, "worker1", limit=4)
+
+    # worker1's leases are still good while it renews them
+    assert renew_leases(requests_table, "worker1") == 4
+    assert claim_requests(requests_table, "worker2") == []
+
+    # until it dies, and they run out
+    expire_leases(hnt_db, requests_table)
+    reclaimed = claim_requests(requests_table, "worker2")
+    assert [(row.id, row.worker_id, row.attempts) for row in reclaimed] == [(1, "worker2", 2)]
+
+
+def test_release_claims(requests_table, hnt_db):
+    claim_requests(requests_table, "worker1", limit=2)
+    claim_requests(requests_table, "worker2", limit=1)
+
+    assert release_claims(requests_table, "worker1") == 2
+
+    # handing requests back on shutdown doesn't count as an attempt
+    rows = get_rows(hnt_db, requests_table)
+    assert [(rows[id_].status, rows[id_].worker_id, rows[id_].attempts) for id_ in (1, 2, 3)] == [
+        ("new", None, 0), ("new", None, 0), ("processing", "worker2", 1)
+    ]
+    assert [row.id for row in claim_requests(requests_table, "worker3", limit=4)] == [1, 2, 4]
+
+
+def test_requests_are_given_up_on_after_max_attempts(requests_table, hnt_db):
+    # request 1 crashes its worker every time it's claimed
+    for attempt in range(2):
+        assert [row.id for row in claim_requests(requests_table, f"worker{attempt}", max_attempts=2)] == [1]
+        hnt_db.execute(requests_table.update().where(requests_table.c.id == 1).values(lease_expires_at=text("now() - interval '1 second'")))
+
+    assert [row.id for row in claim_requests(requests_table, "worker3", max_attempts=2)] == [2]
+
+    row = get_rows(hnt_db, requests_table)[1]
+    assert (row.status, row.attempts, row.worker_id) == ("error", 2, None)
+    assert row.errors['stage'] == "claiming request"
+    assert row.processed_at is not None
+
+
+def test_unmigrated_tables_fail_clearly(hnt_db, monkeypatch):
+    monkeypatch.setattr(request_queue, "_checked_tables", set())
+    hnt_db.execute(text("DROP TABLE IF EXISTS test_requests"))
+    hnt_db.execute(text("CREATE TABLE test_requests (id SERIAL PRIMARY KEY, wallet TEXT, status TEXT)"))
+    try:
+        table = Table("test_requests", MetaData(), autoload_with=hnt_db)
+
+        # nothing is added at runtime - the worker stops and says what to run
+        with pytest.raises(RuntimeError, match="missing columns"):
+            claim_requests(table, "worker1")
+        with pytest.raises(RuntimeError, match="missing columns"):
+            hntdb.check_estimate_column(table)
+        with pytest.raises(RuntimeError, match="trigger"):
+            check_notify_trigger(table)
+
+        assert "worker_id" not in [column.name for column in Table("test_requests", MetaData(), autoload_with=hnt_db).c]
+    finally:
+        hnt_db.execute(text("DROP TABLE test_requests"))
+
+
+@pytest.fixture
+def migrated_tables(hnt_db, monkeypatch):
+    """
+    Bare request tables with the migration applied (twice, since it's meant to be safe to re-run)
+    """
+    monkeypatch.setattr(request_queue, "_checked_tables", set())
+    for name in ("hnt_csv_requests", "hnt_schedc_requests"):
+        hnt_db.execute(text(f"DROP TABLE IF EXISTS {name}"))
+        hnt_db.execute(text(f"CREATE TABLE {name} (id SERIAL PRIMARY KEY, wallet TEXT, status TEXT, errors JSONB, processed_at TIMESTAMP)"))
+
+    with open(MIGRATION) as f:
+        migration = f.read()
+    for _ in range(2):
+        conn = hnt_db.raw_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(migration)
+            conn.commit()
+        finally:
+            conn.close()
+
+    yield {name: Table(name, MetaData(), autoload_with=hnt_db) for name in ("hnt_csv_requests", "hnt_schedc_requests")}
+    for name in ("hnt_csv_requests", "hnt_schedc_requests"):
+        hnt_db.execute(text(f"DROP TABLE {name}"))
+    hnt_db.execute(text("DROP FUNCTION notify_hnt_csv_requests_new()"))
+
+
+def test_migration_adds_what_workers_need(migrated_tables, hnt_db):
+    csv_table = migrated_tables["hnt_csv_requests"]
+    hntdb.check_estimate_column(csv_table)
+    check_notify_trigger(csv_table)
+
+    hnt_db.execute(text("INSERT INTO hnt_schedc_requests (wallet, status) VALUES ('wallet1', 'new')"))
+    assert [row.id for row in claim_requests(migrated_tables["hnt_schedc_requests"], "worker1")] == [1]
+
+    # the trigger wakes up a listener as soon as a request is inserted
+    listener = RequestListener(csv_table, poll_seconds=10).start()
+    try:
+        threading.Timer(0.2, lambda: hnt_db.execute(text("INSERT INTO hnt_csv_requests (wallet, status) VALUES ('wallet1', 'new')"))).start()
+        start = time.time()
+        assert listener.wait() is True
+        assert time.time() - start < 5
+    finally:
+        listener.close()
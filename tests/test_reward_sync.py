@@ -0,0 +1,95 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pytest
+from conftest import StubHelium
+from db import reward_sync
+from db.reward_sync import get_sync_state, reward_sync_rows_table, reward_sync_table, save_sync_state
+from processors import BaseProcessor as base_processor
+from processors.CsvProcessor import CsvProcessor
+
+
+@pytest.fixture
+def sync_tables(hnt_db, monkeypatch):
+    reward_sync_rows_table.drop(hnt_db, checkfirst=True)
+    reward_sync_table.drop(hnt_db, checkfirst=True)
+    monkeypatch.setattr(reward_sync, "_table_checked", False)
+    yield
+    reward_sync_rows_table.drop(hnt_db, checkfirst=True)
+    reward_sync_table.drop(hnt_db, checkfirst=True)
+
+
+def rewards(*blocks):
+    # converted rewards, newest first
+    return pd.DataFrame({
+        "timestamp": pd.to_datetime([f"2021-03-01T00:00:{block % 60:02d}Z" for block in blocks], utc=True),
+        "block": blocks,
+        "hnt": [block / 100 for block in blocks],
+        "oracle_price": 10.0,
+        "usd": [block / 10 for block in blocks]
+    })
+
+
+def test_sync_state_appends_new_rows(sync_tables, hnt_db):
+    assert get_sync_state('hotspot', 'hotspotA', 2021) is None
+
+    save_sync_state('hotspot', 'hotspotA', 2021, rewards(120, 105))
+    save_sync_state('hotspot', 'hotspotA', 2021, rewards(150, 130))
+
+    state = get_sync_state('hotspot', 'hotspotA', 2021)
+    assert state['last_block'] == 150
+    assert list(state['rewards']['block']) == [150, 130, 120, 105]
+    assert state['rewards']['timestamp'].dt.tz is not None
+
+    # one chunk per sync, rather than the whole history rewritten each time
+    assert [len(row.rows['block']) for row in hnt_db.execute(reward_sync_rows_table.select().order_by(reward_sync_rows_table.c.id))] == [2, 2]
+    assert hnt_db.execute(reward_sync_table.select()).fetchone().num_rows == 4
+
+
+def test_sync_state_replace(sync_tables):
+    save_sync_state('hotspot', 'hotspotA', 2021, rewards(120, 105))
+    save_sync_state('hotspot', 'hotspotB', 2021, rewards(110))
+    save_sync_state('hotspot', 'hotspotA', 2021, rewards(150, 120, 105), replace=True)
+
+    assert list(get_sync_state('hotspot', 'hotspotA', 2021)['rewards']['block']) == [150, 120, 105]
+    assert list(get_sync_state('hotspot', 'hotspotB', 2021)['rewards']['block']) == [110]
+    assert get_sync_state('hotspot', 'hotspotA', 2020) is None
+
+
+def test_sync_state_skips_rows_already_synced(sync_tables, hnt_db):
+    save_sync_state('hotspot', 'hotspotA', 2021, rewards(120, 105))
+
+    # two workers both synced from block 120 and found the same new rewards
+    save_sync_state('hotspot', 'hotspotA', 2021, rewards(150, 130))
+    save_sync_state('hotspot', 'hotspotA', 2021, rewards(160, 150, 130))
+
+    assert list(get_sync_state('hotspot', 'hotspotA', 2021)['rewards']['block']) == [160, 150, 130, 120, 105]
+    assert hnt_db.execute(reward_sync_table.select()).fetchone().num_rows == 5
+
+
+def test_overlapping_first_syncs(sync_tables, hnt_db, make_client, monkeypatch):
+    hotspot_rewards = [
+        {"gateway": "hotspotA", "block": block, "amount": 10 ** 8, "hash": f"hash{block}", "type": "poc_witnesses", "timestamp": f"2021-03-01T00:00:{block % 60:02d}Z"}
+        for block in (150, 120, 105)
+    ]
+    hotspots = {"data": [{"address": "hotspotA"}]}
+
+    # both workers look for a sync state before either has saved one
+    both_read = threading.Barrier(2)
+
+    def get_sync_state_together(*args):
+        state = get_sync_state(*args)
+        both_read.wait(timeout=10)
+        return state
+    monkeypatch.setattr(base_processor, "get_sync_state", get_sync_state_together)
+
+    def compile_rewards(_):
+        client = make_client(StubHelium(rewards={"hotspotA": hotspot_rewards}, prices={block: 10 ** 9 for block in range(100, 151)}))
+        return CsvProcessor(incremental_sync=True, skip_idle=False).compile_hotspot_rewards(client, "wallet1", hotspots, 2021)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        dfs = list(executor.map(compile_rewards, range(2)))
+
+    assert [list(df['block']) for df in dfs] == [[150, 120, 105]] * 2
+    assert list(get_sync_state('hotspot', 'hotspotA', 2021)['rewards']['block']) == [150, 120, 105]
+    assert hnt_db.execute(reward_sync_table.select()).fetchone().num_rows == 3
@@ -0,0 +1,80 @@
+import gzip
+import pandas as pd
+import pytest
+from processors.RewardWriter import RewardWriter, output_file_name, reward_totals
+
+
+def rewards(hotspot, blocks):
+    return pd.DataFrame({
+        "hotspot_address": hotspot,
+        "block": blocks,
+        "hnt": [1.5] * len(blocks),
+        "usd": [3.0] * len(blocks)
+    })
+
+
+DFS = [rewards("hotspotA", [150, 120]), rewards("hotspotB", []), rewards("hotspotC", [210])]
+ALL_REWARDS = pd.concat(DFS, ignore_index=True)
+
+
+def write_all(writer, dfs=DFS):
+    with writer:
+        for df in dfs:
+            writer.write(df)
+    return writer.totals()
+
+
+@pytest.mark.parametrize("output_format, read", [
+    ("csv", pd.read_csv),
+    ("csv.gz", pd.read_csv),
+    ("parquet", pd.read_parquet)
+])
+def test_writes_rows_and_totals(tmp_path, output_format, read):
+    if output_format == "parquet":
+        pytest.importorskip("pyarrow")
+    path = tmp_path / output_file_name("rewards.csv", output_format)
+    completed = []
+
+    totals = write_all(RewardWriter(str(path), output_format=output_format, on_complete=completed.append))
+
+    assert totals == reward_totals(ALL_REWARDS) == {"rows": 3, "hnt": 4.5, "usd": 9.0}
+    assert completed == [str(path)]
+    assert not (tmp_path / f"{path.name}.part").exists()
+    pd.testing.assert_frame_equal(read(path), ALL_REWARDS, check_dtype=False)
+
+
+def test_csv_gz_is_compressed(tmp_path):
+    path = tmp_path / "rewards.csv.gz"
+    write_all(RewardWriter(str(path), output_format="csv.gz"))
+
+    with gzip.open(path, 'rt') as f:
+        assert f.readline().strip() == "hotspot_address,block,hnt,usd"
+
+
+def test_index_continues_across_writes(tmp_path):
+    path = tmp_path / "rewards.csv"
+    write_all(RewardWriter(str(path), index=True))
+
+    assert list(pd.read_csv(path, index_col=0).index) == [0, 1, 2]
+
+
+def test_failed_compilation_leaves_no_file(tmp_path):
+    path = tmp_path / "rewards.csv"
+    completed = []
+
+    with pytest.raises(RuntimeError):
+        with RewardWriter(str(path), on_complete=completed.append) as writer:
+            writer.write(DFS[0])
+            raise RuntimeError("helium went away")
+
+    assert list(tmp_path.iterdir()) == []
+    assert completed == []
+
+
+def test_no_rewards_leaves_no_file(tmp_path):
+    path = tmp_path / "rewards.csv"
+
+    totals = write_all(RewardWriter(str(path)), dfs=[DFS[1]])
+
+    assert totals['rows'] == 0
+    assert list(tmp_path.iterdir()) == []
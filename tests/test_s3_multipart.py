@@ -0,0 +1,115 @@
+import gzip
+import io
+import threading
+import pandas as pd
+import pytest
+from aws.multipart import S3MultipartWriter, S3TextStream
+from processors.RewardWriter import RewardWriter
+
+
+MB = 1024 * 1024
+
+
+class FakeS3:
+    """
+    Stands in for a boto3 s3 client - keeps put objects, and the parts of multipart uploads
+    until they're completed (or aborted)
+    """
+
+    def __init__(self, fail_part=None):
+        self.objects = {}
+        self.uploads = {}
+        self.aborted = []
+        self.fail_part = fail_part
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        upload_id = f"upload{len(self.uploads) + 1}"
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if PartNumber == self.fail_part:
+            raise IOError("connection reset")
+        with self._lock:
+            self.uploads[UploadId][PartNumber] = Body
+        return {"ETag": f"etag{PartNumber}"}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        assert [part["ETag"] for part in MultipartUpload["Parts"]] == [f"etag{n}" for n in sorted(parts)]
+        self.objects[Key] = b"".join(parts[n] for n in sorted(parts))
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId)
+        self.aborted.append(Key)
+
+
+def test_small_file_is_put_in_one_go():
+    s3 = FakeS3()
+    writer = S3MultipartWriter(s3, "bucket", "small.csv")
+    writer.write(b"a,b\n1,2\n")
+    writer.close()
+
+    assert s3.objects == {"small.csv": b"a,b\n1,2\n"}
+    assert s3.uploads == {}
+
+
+def test_big_file_is_uploaded_in_parts():
+    s3 = FakeS3()
+    data = bytes(range(256)) * (11 * MB // 256)
+
+    writer = S3MultipartWriter(s3, "bucket", "big.csv", part_size_mb=5)
+    for start in range(0, len(data), MB):
+        writer.write(data[start:start + MB])
+    writer.close()
+
+    # two full parts, then the rest
+    assert s3.objects == {"big.csv": data}
+    assert s3.uploads == {}
+    assert writer.num_bytes == len(data)
+
+
+def test_failed_part_aborts_the_upload():
+    s3 = FakeS3(fail_part=2)
+    writer = S3MultipartWriter(s3, "bucket", "big.csv", part_size_mb=5)
+    writer.write(b"x" * (5 * MB))
+    writer.write(b"x" * (5 * MB))
+
+    with pytest.raises(IOError):
+        writer.close()
+
+    assert s3.objects == {}
+    assert s3.uploads == {}
+    assert s3.aborted == ["big.csv"]
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_reward_writer_streams_csv_to_s3(compress):
+    s3 = FakeS3()
+    df = pd.DataFrame({"hotspot_address": ["hotspotA", "hotspotB"], "hnt": [1.0, 2.0], "usd": [10.0, 20.0]})
+
+    with RewardWriter("rewards.csv", stream=S3TextStream(s3, "bucket", "rewards.csv", compress=compress)) as writer:
+        writer.write(df.iloc[:1])
+        writer.write(df.iloc[1:])
+
+    body = s3.objects["rewards.csv"]
+    if compress:
+        body = gzip.decompress(body)
+    pd.testing.assert_frame_equal(pd.read_csv(io.BytesIO(body)), df)
+
+
+def test_reward_writer_aborts_stream_on_error():
+    s3 = FakeS3()
+    stream = S3TextStream(s3, "bucket", "rewards.csv")
+
+    with pytest.raises(RuntimeError):
+        with RewardWriter("rewards.csv", stream=stream) as writer:
+            writer.write(pd.DataFrame({"hnt": [1.0], "usd": [10.0]}))
+            raise RuntimeError("helium went away")
+
+    assert s3.objects == {}
+    assert stream.upload.closed
@@ -0,0 +1,101 @@
+import pytest
+from sqlalchemy import MetaData, Table, event, select, text
+from sqlalchemy.exc import DBAPIError
+from db.status_writer import StatusWriter
+
+
+@pytest.fixture
+def requests_table(hnt_db):
+    """
+    A request table with 4 new requests
+    """
+    hnt_db.execute(text("DROP TABLE IF EXISTS test_status_requests"))
+    hnt_db.execute(text(
+        "CREATE TABLE test_status_requests (id SERIAL PRIMARY KEY, wallet TEXT, status TEXT, income NUMERIC, errors JSONB, processed_at TIMESTAMP)"
+    ))
+    hnt_db.execute(text("INSERT INTO test_status_requests (wallet, status) SELECT 'wallet' || n, 'new' FROM generate_series(1, 4) n"))
+
+    yield Table("test_status_requests", MetaData(), autoload_with=hnt_db)
+    hnt_db.execute(text("DROP TABLE test_status_requests"))
+
+
+@pytest.fixture
+def updates_sent(hnt_db):
+    """
+    The UPDATE statements sent to the db - an executemany counts once
+    """
+    sent = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("UPDATE"):
+            sent.append(statement)
+
+    event.listen(hnt_db, "before_cursor_execute", record)
+    yield sent
+    event.remove(hnt_db, "before_cursor_execute", record)
+
+
+def get_rows(hnt_db, table):
+    return {row.id: (row.wallet, row.status, row.income) for row in hnt_db.execute(select([table]).order_by(table.c.id))}
+
+
+def test_updates_to_a_row_are_merged(requests_table, hnt_db, updates_sent):
+    writer = StatusWriter(requests_table, max_rows=10)
+    writer.add(1, [{"wallet": "wallet1b"}, {"status": "processed", "income": 1.5}])
+    writer.add(1, [{"status": "error"}])
+
+    assert writer.flush() == 1
+    assert len(updates_sent) == 1
+    assert get_rows(hnt_db, requests_table)[1] == ("wallet1b", "error", 1.5)
+    assert writer.num_flushed == 1
+
+
+def test_rows_are_batched_by_the_columns_they_update(requests_table, hnt_db, updates_sent):
+    writer = StatusWriter(requests_table, max_rows=10)
+    writer.add(1, [{"status": "processed", "income": 1}])
+    writer.add(2, [{"status": "processed", "income": 2}])
+    writer.add(3, [{"status": "empty"}])
+
+    assert writer.flush() == 3
+
+    # one executemany for the rows setting status and income, one for the row setting just status
+    assert len(updates_sent) == 2
+    assert get_rows(hnt_db, requests_table) == {
+        1: ("wallet1", "processed", 1),
+        2: ("wallet2", "processed", 2),
+        3: ("wallet3", "empty", None),
+        4: ("wallet4", "new", None)
+    }
+
+
+def test_failed_flush_is_requeued(requests_table, hnt_db):
+    writer = StatusWriter(requests_table, max_rows=10)
+    writer.add(1, [{"status": "processed", "income": "not a number"}])
+    writer.add(2, [{"status": "processed", "income": 2}])
+
+    # the batch is one transaction, so neither row is written
+    with pytest.raises(DBAPIError):
+        writer.flush()
+    assert get_rows(hnt_db, requests_table)[2] == ("wallet2", "new", None)
+
+    # updates queued since the failure are newer, so they win over the requeued ones
+    writer.add(1, [{"income": 1}])
+    assert writer.flush() == 2
+    rows = get_rows(hnt_db, requests_table)
+    assert (rows[1], rows[2]) == (("wallet1", "processed", 1), ("wallet2", "processed", 2))
+
+
+def test_full_buffer_and_close_flush(requests_table, hnt_db):
+    with StatusWriter(requests_table, max_rows=2, max_seconds=60) as writer:
+        writer.add(1, [{"status": "processed"}])
+        writer.add(2, [{"status": "processed"}])
+
+        # max_rows were waiting, so they're written straight away
+        assert [row[1] for row in get_rows(hnt_db, requests_table).values()] == ["processed", "processed", "new", "new"]
+
+        writer.add(3, [{"status": "error"}])
+        assert get_rows(hnt_db, requests_table)[3][1] == "new"
+
+    # and the rest when the writer closes
+    assert get_rows(hnt_db, requests_table)[3][1] == "error"
+    assert writer.num_flushed == 3